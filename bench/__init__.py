@@ -0,0 +1,3 @@
+"""
+Benchmark package for chat application
+"""
@@ -0,0 +1,110 @@
+"""
+Emoji Input Benchmark
+Per-keystroke cost of emoji shortcode handling in the message entry, full-buffer vs incremental
+
+Usage: python -m bench.emoji_input --lengths 100 1000 10000
+Measures the processing done on each KeyRelease, without the Tk widget itself.
+"""
+
+import argparse
+import random
+import time
+
+import emoji
+
+from client.utils import process_emoji_shortcodes, shortcode_index
+
+WORDS = "hello there :smile: see you at 10:30 ok :thumbsup: great :not_an_emoji: done".split()
+
+
+def build_text(length: int, seed: int = 1) -> str:
+    """Message text of about length characters with shortcodes sprinkled in"""
+    rng = random.Random(seed)
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:length]
+
+
+def keystroke_full_buffer(buffer: list[str]) -> None:
+    """The work done per keystroke before: emojize the whole message and compare"""
+    text = "".join(buffer)
+    if ":" not in text:
+        return
+    processed = emoji.emojize(text, language="alias")
+    if processed != text:
+        buffer[:] = processed
+
+
+def keystroke_incremental(buffer: list[str]) -> None:
+    """The work done per keystroke now: look up the token just before the cursor"""
+    index = shortcode_index()
+    match = index.match_before("".join(buffer[-index.longest :]))
+    if match:
+        length, emoji_char = match
+        del buffer[-length:]
+        buffer.append(emoji_char)
+
+
+def type_text(text: str, keystroke) -> tuple[str, list[float]]:
+    """Type text one character at a time, return the result and the seconds each keystroke took"""
+    buffer = []
+    samples = []
+    for char in text:
+        buffer.append(char)
+        start = time.perf_counter()
+        keystroke(buffer)
+        samples.append(time.perf_counter() - start)
+    return "".join(buffer), samples
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    """Mean, p99 and max of keystroke times, in microseconds"""
+    samples = sorted(samples)
+    return {
+        "mean_us": 1e6 * sum(samples) / len(samples),
+        "p99_us": 1e6 * samples[min(len(samples) - 1, int(0.99 * len(samples)))],
+        "max_us": 1e6 * samples[-1],
+    }
+
+
+def run_emoji_benchmark(lengths: list[int]) -> dict[int, dict[str, dict[str, float]]]:
+    """Type messages of each length with both processors, after checking they agree with a paste"""
+    shortcode_index()  # Built once up front, like the first keystroke in the client
+    results = {}
+    for length in lengths:
+        text = build_text(length)
+        typed = {}
+        results[length] = {}
+        for name, keystroke in (("full", keystroke_full_buffer), ("incremental", keystroke_incremental)):
+            typed[name], samples = type_text(text, keystroke)
+            results[length][name] = summarize(samples)
+        if not typed["full"] == typed["incremental"] == process_emoji_shortcodes(text):
+            raise AssertionError(f"Processors disagree on a {length} character message")
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Emoji shortcode keystroke benchmark")
+    parser.add_argument(
+        "--lengths",
+        type=int,
+        nargs="+",
+        default=[100, 1000, 10000],
+        help="Message lengths to type (default: 100 1000 10000)",
+    )
+    args = parser.parse_args()
+
+    for length, modes in run_emoji_benchmark(args.lengths).items():
+        for mode, result in modes.items():
+            print(
+                f"{length} chars, {mode}: mean {result['mean_us']:.1f}us, "
+                f"p99 {result['p99_us']:.1f}us, max {result['max_us']:.1f}us per keystroke"
+            )
+
+
+if __name__ == "__main__":
+    main()
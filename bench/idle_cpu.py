@@ -0,0 +1,121 @@
+"""
+Idle CPU Benchmark
+Measures server CPU time and thread wakeups while many clients sit idle
+
+Usage: python -m bench.idle_cpu --clients 5000 --engine threads
+Linux only, server statistics are read from /proc.
+"""
+
+import argparse
+import selectors
+import socket
+import threading
+import time
+
+from common.protocol import FRAME_LOGIN, encode_text
+from bench.utils import (
+    raise_fd_limit,
+    read_cpu_seconds,
+    read_context_switches,
+    start_server_process,
+    stop_server_process,
+)
+
+# Seconds without any server traffic before the room counts as idle
+SETTLE_QUIET_TIME = 1.0
+
+
+class IdleClients:
+    """Many logged-in clients that never speak and silently drain their sockets"""
+
+    def __init__(self) -> None:
+        """Initialize with no connections"""
+        self.selector = selectors.DefaultSelector()
+        self.sockets = []
+        self.last_traffic = time.monotonic()
+        self.running = True
+        self.thread = threading.Thread(target=self.drain)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def connect(self, host: str, port: int, username: str) -> None:
+        """Open a connection and log in as username"""
+        sock = socket.create_connection((host, port))
+        sock.sendall(encode_text(username, FRAME_LOGIN))
+        sock.setblocking(False)
+        self.sockets.append(sock)
+        self.selector.register(sock, selectors.EVENT_READ)
+
+    def drain(self) -> None:
+        """Read and discard everything the server sends"""
+        while self.running:
+            if not self.sockets:
+                time.sleep(0.05)
+                continue
+            for key, _ in self.selector.select(timeout=0.2):
+                try:
+                    if key.fileobj.recv(65536):
+                        self.last_traffic = time.monotonic()
+                except OSError:
+                    pass
+
+    def wait_until_quiet(self, quiet_time: float = SETTLE_QUIET_TIME) -> None:
+        """Block until the server has sent nothing for quiet_time seconds"""
+        while time.monotonic() - self.last_traffic < quiet_time:
+            time.sleep(0.1)
+
+    def close(self) -> None:
+        """Close every connection"""
+        self.running = False
+        self.thread.join()
+        for sock in self.sockets:
+            sock.close()
+
+
+def run_idle_benchmark(
+    clients: int, duration: float, engine: str, host: str, port: int
+) -> dict[str, float]:
+    """Connect idle clients, then measure server CPU and wakeups over duration"""
+    raise_fd_limit()
+    server = start_server_process(host, port, engine)
+    idle = IdleClients()
+    try:
+        for i in range(clients):
+            idle.connect(host, port, f"idle{i}")
+        idle.wait_until_quiet()
+
+        cpu_before = read_cpu_seconds(server.pid)
+        switches_before = read_context_switches(server.pid)
+        time.sleep(duration)
+        cpu_after = read_cpu_seconds(server.pid)
+        switches_after = read_context_switches(server.pid)
+    finally:
+        idle.close()
+        stop_server_process(server)
+
+    return {
+        "clients": clients,
+        "cpu_percent": 100 * (cpu_after - cpu_before) / duration,
+        "wakeups_per_sec": (switches_after - switches_before) / duration,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Idle CPU benchmark for the chat server")
+    parser.add_argument("--clients", type=int, default=5000, help="Idle clients (default: 5000)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to measure (default: 10)")
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12399)
+    args = parser.parse_args()
+
+    result = run_idle_benchmark(args.clients, args.duration, args.engine, args.host, args.port)
+    print(
+        f"{args.engine}: {result['clients']} idle clients, "
+        f"server CPU {result['cpu_percent']:.2f}%, "
+        f"{result['wakeups_per_sec']:.0f} wakeups/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
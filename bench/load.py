@@ -0,0 +1,262 @@
+"""
+Load Benchmark
+Drives many simulated clients against a chat server and reports throughput and latency
+"""
+
+import asyncio
+import json
+import random
+import time
+
+from common.protocol import (
+    FrameDecoder,
+    RECV_BUFFER_SIZE,
+    FRAME_LOGIN,
+    FRAME_TEXT,
+    FRAME_BROADCAST,
+    FRAME_HELLO_ACK,
+    CAP_COMPRESSION,
+    CAP_RESUME,
+    DEFAULT_COMPRESS_THRESHOLD,
+    encode_text,
+    encode_hello,
+    decode_hello,
+    decode_sequenced,
+    compress_frames,
+)
+from common.constants import DM_PREFIX, SUCCESS_MESSAGE
+from bench.utils import (
+    raise_fd_limit,
+    read_rss_bytes,
+    start_server_process,
+    stop_server_process,
+)
+
+# Marker that identifies benchmark payloads among join/leave announcements
+BENCH_MARKER = "bench:"
+
+# Connections opened at the same time while logging clients in
+CONNECT_CONCURRENCY = 50
+
+# Seconds to keep receiving after the last message is sent
+DRAIN_TIME = 1.0
+
+# Capabilities each --handshake offers in its hello, None for a bare login
+HANDSHAKES = {
+    "client": CAP_COMPRESSION | CAP_RESUME,  # What ChatClient sends
+    "no-compression": CAP_RESUME,
+    "legacy": None,  # Clients from before the hello
+}
+DEFAULT_HANDSHAKE = "client"
+
+
+class SimulatedClient:
+    """One headless client speaking the same protocol as ChatClient"""
+
+    def __init__(
+        self, username: str, stats: "LoadStats", capabilities: int | None = None
+    ) -> None:
+        """Initialize a client that is not yet connected"""
+        self.username = username
+        self.stats = stats
+        # Offered in a hello before logging in, no hello at all if None
+        self.capabilities = capabilities
+        self.compression = False
+        self.reader = None
+        self.writer = None
+        self.decoder = FrameDecoder()
+        self.logged_in = asyncio.Event()
+
+    async def connect(self, host: str, port: int) -> None:
+        """Connect, send the hello and username and wait for the welcome message"""
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        login = encode_text(self.username, FRAME_LOGIN)
+        if self.capabilities is not None:
+            login = encode_hello(self.capabilities) + login
+        self.writer.write(login)
+        asyncio.create_task(self.receive_loop())
+        await self.logged_in.wait()
+
+    async def receive_loop(self) -> None:
+        """Read frames and record the latency of every benchmark payload"""
+        while True:
+            try:
+                data = await self.reader.read(RECV_BUFFER_SIZE)
+            except ConnectionError:
+                return
+            if not data:
+                return
+
+            now = time.perf_counter_ns()
+            for frame_type, payload in self.decoder.feed(data):
+                if frame_type == FRAME_TEXT:
+                    message = payload.decode("utf-8")
+                elif frame_type == FRAME_BROADCAST:
+                    message = decode_sequenced(payload)[1]
+                elif frame_type == FRAME_HELLO_ACK:
+                    self.compression = bool(decode_hello(payload)[1] & CAP_COMPRESSION)
+                    continue
+                else:
+                    continue
+                marker = message.find(BENCH_MARKER)
+                if marker >= 0:
+                    sent_at = int(message[marker + len(BENCH_MARKER) :].split(" ", 1)[0])
+                    self.stats.record_delivery(now - sent_at)
+                elif message.startswith(SUCCESS_MESSAGE):
+                    self.logged_in.set()
+
+    def send(self, message: str) -> None:
+        """Queue a chat message, stamped with the send time"""
+        stamped = f"{BENCH_MARKER}{time.perf_counter_ns()} {message}"
+        self.write(encode_text(stamped))
+
+    def send_direct(self, target: str, message: str) -> None:
+        """Queue a direct message, stamped with the send time"""
+        stamped = f"{DM_PREFIX}{target} {BENCH_MARKER}{time.perf_counter_ns()} {message}"
+        self.write(encode_text(stamped))
+
+    def write(self, frame: bytes) -> None:
+        """Queue a frame, compressed when large the way ChatClient does"""
+        if self.compression and len(frame) >= DEFAULT_COMPRESS_THRESHOLD:
+            frame = compress_frames(frame)
+        self.writer.write(frame)
+        self.stats.sent += 1
+
+    def close(self) -> None:
+        """Close the connection"""
+        if self.writer:
+            self.writer.close()
+
+
+class LoadStats:
+    """Counters and latency samples collected during a run"""
+
+    def __init__(self) -> None:
+        """Initialize empty statistics"""
+        self.sent = 0
+        self.delivered = 0
+        self.latencies_ns = []
+
+    def record_delivery(self, latency_ns: int) -> None:
+        """Record one benchmark payload arriving at a client"""
+        self.delivered += 1
+        self.latencies_ns.append(latency_ns)
+
+    def percentile_ms(self, fraction: float) -> float:
+        """Latency at the given fraction of sorted samples, in milliseconds"""
+        if not self.latencies_ns:
+            return 0.0
+        samples = sorted(self.latencies_ns)
+        index = min(len(samples) - 1, int(fraction * len(samples)))
+        return samples[index] / 1e6
+
+
+async def drive_load(
+    host: str,
+    port: int,
+    clients: int,
+    duration: float,
+    rate: float,
+    dm_ratio: float,
+    message_size: int,
+    handshake: str = DEFAULT_HANDSHAKE,
+) -> dict:
+    """Log clients in, send messages at rate per client for duration, and collect stats"""
+    stats = LoadStats()
+    capabilities = HANDSHAKES[handshake]
+    simulated = [SimulatedClient(f"bench{i}", stats, capabilities) for i in range(clients)]
+    body = "x" * message_size
+
+    # Log everyone in with bounded concurrency to measure connect rate
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def connect(client: SimulatedClient) -> None:
+        async with semaphore:
+            await client.connect(host, port)
+
+    connect_start = time.perf_counter()
+    await asyncio.gather(*(connect(client) for client in simulated))
+    connect_elapsed = time.perf_counter() - connect_start
+
+    async def send_loop(client: SimulatedClient, deadline: float) -> None:
+        # Random start offset so clients do not send in lock step
+        await asyncio.sleep(random.random() / rate)
+        while time.perf_counter() < deadline:
+            if clients > 1 and random.random() < dm_ratio:
+                target = random.choice(simulated)
+                while target is client:
+                    target = random.choice(simulated)
+                client.send_direct(target.username, body)
+            else:
+                client.send(body)
+            await asyncio.sleep(1 / rate)
+
+    send_start = time.perf_counter()
+    deadline = send_start + duration
+    await asyncio.gather(*(send_loop(client, deadline) for client in simulated))
+    await asyncio.sleep(DRAIN_TIME)
+    elapsed = time.perf_counter() - send_start
+
+    for client in simulated:
+        client.close()
+
+    return {
+        "clients": clients,
+        "handshake": handshake,
+        "connect_rate": clients / connect_elapsed,
+        "sent": stats.sent,
+        "sent_per_sec": stats.sent / duration,
+        "delivered": stats.delivered,
+        "delivered_per_sec": stats.delivered / elapsed,
+        "p50_ms": stats.percentile_ms(0.50),
+        "p99_ms": stats.percentile_ms(0.99),
+        "p999_ms": stats.percentile_ms(0.999),
+    }
+
+
+def run_load_benchmark(
+    host: str,
+    port: int,
+    clients: int = 100,
+    duration: float = 10.0,
+    rate: float = 1.0,
+    dm_ratio: float = 0.1,
+    message_size: int = 64,
+    engine: str = "threads",
+    workers: int = 1,
+    as_json: bool = False,
+    handshake: str = DEFAULT_HANDSHAKE,
+) -> dict:
+    """Start a server, run the load against it and print a report"""
+    raise_fd_limit()
+    server = start_server_process(host, port, engine, workers)
+    try:
+        result = asyncio.run(
+            drive_load(
+                host, port, clients, duration, rate, dm_ratio, message_size, handshake
+            )
+        )
+        result["server_rss_mib"] = read_rss_bytes(server.pid) / (1024 * 1024)
+    finally:
+        stop_server_process(server)
+
+    result["engine"] = engine
+    result["workers"] = workers
+    if as_json:
+        print(json.dumps(result))
+    else:
+        print(
+            f"Engine: {engine} ({workers} worker{'s' if workers > 1 else ''}), "
+            f"clients: {clients} ({handshake} handshake), "
+            f"connect rate: {result['connect_rate']:.0f}/s"
+        )
+        print(
+            f"Sent: {result['sent']} ({result['sent_per_sec']:.0f} msgs/s), "
+            f"delivered: {result['delivered']} ({result['delivered_per_sec']:.0f} msgs/s)"
+        )
+        print(
+            f"Latency p50: {result['p50_ms']:.2f}ms, p99: {result['p99_ms']:.2f}ms, "
+            f"p999: {result['p999_ms']:.2f}ms"
+        )
+        print(f"Server RSS: {result['server_rss_mib']:.1f} MiB")
+    return result
@@ -0,0 +1,114 @@
+"""
+Message Parsing Benchmark
+Times classifying and URL-splitting a corpus of mixed chat lines, old approach vs client.parsing
+
+Usage: python -m bench.message_parsing --messages 100000
+"""
+
+import argparse
+import random
+import re
+import time
+
+from client.parsing import PREFIX_TAGS, REGULAR_TAG, message_classifier, tokenize_urls
+from common.constants import (
+    DM_FROM,
+    DM_TO,
+    INFO_MESSAGE,
+    SUCCESS_MESSAGE,
+    WARNING_MESSAGE,
+    ANNOUNCEMENT,
+)
+
+USERNAME = "alice"
+
+WORDS = "the quick brown fox jumps over a lazy dog while chat servers fan out frames".split()
+
+
+def build_corpus(count: int, seed: int = 1) -> list[str]:
+    """Mixed chat lines in roughly the proportions of a busy room"""
+    rng = random.Random(seed)
+
+    def sentence() -> str:
+        words = rng.choices(WORDS, k=rng.randint(3, 20))
+        if rng.random() < 0.1:
+            words.insert(rng.randrange(len(words)), f"https://example.com/{rng.randint(0, 9999)}")
+        return " ".join(words)
+
+    makers = (
+        (60, lambda: f"@user{rng.randint(0, 99)}: {sentence()}"),
+        (10, lambda: f"@{USERNAME}: {sentence()}"),
+        (8, lambda: f"[#room{rng.randint(0, 9)}] @user{rng.randint(0, 99)}: {sentence()}"),
+        (5, lambda: f"{DM_FROM} user{rng.randint(0, 99)}]: {sentence()}"),
+        (3, lambda: f"{DM_TO} user{rng.randint(0, 99)}]: {sentence()}"),
+        (6, lambda: f"{ANNOUNCEMENT}: @user{rng.randint(0, 99)} has joined the chat."),
+        (6, lambda: f"{INFO_MESSAGE}: @user{rng.randint(0, 99)} has left the chat."),
+        (1, lambda: f"{WARNING_MESSAGE}: User 'user{rng.randint(0, 99)}' not found."),
+        (1, lambda: f"{SUCCESS_MESSAGE}: Welcome, {USERNAME}! Current users: {USERNAME}"),
+    )
+    weights = [weight for weight, _ in makers]
+    return [maker() for (_, maker) in rng.choices(makers, weights, k=count)]
+
+
+def parse_baseline(message: str) -> tuple[str, str, list]:
+    """The per-message work the chat display did before message_classifier"""
+    message_tags = {f"@{USERNAME}: ": "my_message", **dict(PREFIX_TAGS)}
+    tag = next(
+        (tag for prefix, tag in message_tags.items() if message.startswith(prefix)),
+        REGULAR_TAG,
+    )
+    content = message.split(": ", 1)[1] if ": " in message else message
+    url_pattern = re.compile(r"(https?://[^\s]+)")
+    urls = [(match.start(), match.end(), match.group(1)) for match in url_pattern.finditer(content)]
+    return tag, content, urls
+
+
+def parse_current(message: str) -> tuple[str, str, list]:
+    """The per-message work done through client.parsing"""
+    tag, _, content = message_classifier(USERNAME)(message)
+    return tag, content, tokenize_urls(content)
+
+
+def time_parser(parser, corpus: list[str], rounds: int) -> float:
+    """Best seconds per message over rounds passes of the corpus"""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for message in corpus:
+            parser(message)
+        best = min(best, time.perf_counter() - start)
+    return best / len(corpus)
+
+
+def run_parsing_benchmark(messages: int, rounds: int) -> dict[str, float]:
+    """Time both parsers over the same corpus, after checking they agree on tags"""
+    corpus = build_corpus(messages)
+    for message in corpus:
+        if parse_baseline(message)[0] != parse_current(message)[0]:
+            raise AssertionError(f"Parsers disagree on {message!r}")
+
+    baseline = time_parser(parse_baseline, corpus, rounds)
+    current = time_parser(parse_current, corpus, rounds)
+    return {
+        "messages": messages,
+        "baseline_us": baseline * 1e6,
+        "current_us": current * 1e6,
+        "speedup": baseline / current,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Message parsing micro-benchmark")
+    parser.add_argument("--messages", type=int, default=100000, help="Corpus size (default: 100000)")
+    parser.add_argument("--rounds", type=int, default=5, help="Passes, the best is kept (default: 5)")
+    args = parser.parse_args()
+
+    result = run_parsing_benchmark(args.messages, args.rounds)
+    print(
+        f"{result['messages']} messages: baseline {result['baseline_us']:.2f}us/msg, "
+        f"client.parsing {result['current_us']:.2f}us/msg ({result['speedup']:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+TLS Handshake Benchmark
+Measures the cost of each TLS connect with full handshakes and with session resumption
+
+Usage: python -m bench.tls_handshake --tls-cert cert.pem --tls-key key.pem --connects 200
+The certificate must be valid for --host, server statistics are read from /proc (Linux only).
+"""
+
+import argparse
+import socket
+import ssl
+import time
+
+from common.protocol import FrameDecoder, RECV_BUFFER_SIZE, FRAME_HELLO_ACK, encode_hello
+from common.tls import client_context
+from bench.utils import read_cpu_seconds, start_server_process, stop_server_process
+
+
+def timed_connect(
+    host: str, port: int, context: ssl.SSLContext, session: ssl.SSLSession | None
+) -> tuple[float, ssl.SSLSocket]:
+    """Connect and handshake, return the seconds it took and the open socket"""
+    start = time.perf_counter()
+    sock = socket.create_connection((host, port))
+    tls_sock = context.wrap_socket(sock, server_hostname=host, session=session)
+    elapsed = time.perf_counter() - start
+
+    # Session tickets follow the handshake, reading the hello ack picks them up
+    tls_sock.sendall(encode_hello(0))
+    decoder = FrameDecoder()
+    while True:
+        data = tls_sock.recv(RECV_BUFFER_SIZE)
+        if not data or any(frame_type == FRAME_HELLO_ACK for frame_type, _ in decoder.feed(data)):
+            return elapsed, tls_sock
+
+
+def measure(
+    host: str, port: int, context: ssl.SSLContext, connects: int, resume: bool, server_pid: int
+) -> dict[str, float]:
+    """Connect repeatedly, offering the previous session each time if resume is set"""
+    samples = []
+    reused = 0
+    session = None
+    cpu_before = read_cpu_seconds(server_pid)
+    for _ in range(connects):
+        elapsed, tls_sock = timed_connect(host, port, context, session)
+        samples.append(elapsed)
+        reused += tls_sock.session_reused
+        if resume:
+            session = tls_sock.session
+        tls_sock.close()
+    cpu_after = read_cpu_seconds(server_pid)
+
+    samples.sort()
+    return {
+        "connects": connects,
+        "resumed": reused,
+        "mean_ms": 1000 * sum(samples) / connects,
+        "p50_ms": 1000 * samples[connects // 2],
+        "p99_ms": 1000 * samples[min(connects - 1, int(0.99 * connects))],
+        "server_cpu_ms": 1000 * (cpu_after - cpu_before) / connects,
+    }
+
+
+def run_handshake_benchmark(
+    connects: int, engine: str, host: str, port: int, tls_cert: str, tls_key: str
+) -> dict[str, dict[str, float]]:
+    """Start a TLS server and measure connects without and with session resumption"""
+    context = client_context(tls_cert)
+    server = start_server_process(host, port, engine, tls_cert=tls_cert, tls_key=tls_key)
+    try:
+        return {
+            "full": measure(host, port, context, connects, False, server.pid),
+            "resumed": measure(host, port, context, connects, True, server.pid),
+        }
+    finally:
+        stop_server_process(server)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="TLS handshake benchmark for the chat server")
+    parser.add_argument("--tls-cert", required=True, help="Server certificate, also trusted by the client")
+    parser.add_argument("--tls-key", required=True, help="Server private key")
+    parser.add_argument("--connects", type=int, default=200, help="Connects per mode (default: 200)")
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12399)
+    args = parser.parse_args()
+
+    results = run_handshake_benchmark(
+        args.connects, args.engine, args.host, args.port, args.tls_cert, args.tls_key
+    )
+    for mode, result in results.items():
+        print(
+            f"{args.engine} {mode}: {result['resumed']}/{result['connects']} resumed, "
+            f"connect+handshake mean {result['mean_ms']:.2f}ms, "
+            f"p50 {result['p50_ms']:.2f}ms, p99 {result['p99_ms']:.2f}ms, "
+            f"server CPU {result['server_cpu_ms']:.2f}ms/connect"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark Utilities
+Helpers for launching a server process and reading its resource usage
+
+Resource readings come from /proc and are Linux only.
+"""
+
+import os
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds to wait for a freshly launched server to accept connections
+SERVER_START_TIMEOUT = 10.0
+
+
+def raise_fd_limit() -> None:
+    """Raise the open file limit so thousands of sockets fit in one process"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def read_cpu_seconds(pid: int) -> float:
+    """User plus system CPU time consumed by a process"""
+    with open(f"/proc/{pid}/stat") as f:
+        # The command name may contain spaces, fields start after its ')'
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def read_context_switches(pid: int) -> int:
+    """Total context switches of every thread in a process"""
+    total = 0
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{tid}/status") as f:
+                for line in f:
+                    # voluntary_ctxt_switches and nonvoluntary_ctxt_switches
+                    if "ctxt_switches" in line:
+                        total += int(line.split()[1])
+        except FileNotFoundError:
+            # Thread exited while we were iterating
+            continue
+    return total
+
+
+def child_pids(pid: int) -> list[int]:
+    """Direct children of a process"""
+    children = []
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+        except FileNotFoundError:
+            continue
+    return children
+
+
+def read_rss_bytes(pid: int) -> int:
+    """Resident memory of a process and all of its descendants (e.g. cluster workers)"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            pending.extend(child_pids(current))
+        except FileNotFoundError:
+            continue
+    return total
+
+
+def start_server_process(
+    host: str,
+    port: int,
+    engine: str = "threads",
+    workers: int = 1,
+    tls_cert: str | None = None,
+    tls_key: str | None = None,
+) -> subprocess.Popen:
+    """Launch the chat server in a child process and wait until it accepts"""
+    tls = f", tls_cert={tls_cert!r}, tls_key={tls_key!r}" if tls_cert else ""
+    # Start the engine directly so the client GUI dependencies are not needed
+    if workers > 1:
+        code = f"from server.cluster import start_cluster; start_cluster({host!r}, {port}, {workers}{tls})"
+    elif engine == "asyncio":
+        code = f"from server.async_server import start_async_server; start_async_server({host!r}, {port}{tls})"
+    else:
+        code = f"from server.server import start_server; start_server({host!r}, {port}{tls})"
+
+    process = subprocess.Popen(
+        [sys.executable, "-c", code],
+        cwd=PROJECT_ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Server did not start listening in time")
+
+
+def stop_server_process(process: subprocess.Popen) -> None:
+    """Stop a server started by start_server_process"""
+    # SIGINT lets the server (or cluster parent) shut its workers down cleanly
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
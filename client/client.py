@@ -3,35 +3,106 @@ Main Chat Client Implementation
 Combines network communication with UI components
 """
 
+import random
 import socket
+import ssl
 import threading
 import queue
 import darkdetect
 import tkinter as tk
 
 from client.gui.login import LoginGUI
-from client.gui.chat import ChatGUI
+from client.gui.chat import ChatGUI, MESSAGE_EVENT
+from client.scrollback import DEFAULT_SCROLLBACK_LINES
 from client.theme import get_theme, WINDOW_SIZE
-from common.constants import DEFAULT_HOST, DEFAULT_PORT
+from common.constants import DEFAULT_HOST, DEFAULT_PORT, SUCCESS_MESSAGE
+from common.tls import client_context
+from common.protocol import (
+    FrameDecoder,
+    RECV_BUFFER_SIZE,
+    FRAME_LOGIN,
+    FRAME_TEXT,
+    FRAME_BROADCAST,
+    FRAME_HISTORY,
+    FRAME_SESSION,
+    FRAME_HELLO_ACK,
+    CAP_COMPRESSION,
+    CAP_RESUME,
+    DEFAULT_COMPRESS_THRESHOLD,
+    encode_text,
+    encode_hello,
+    decode_hello,
+    encode_history_request,
+    encode_resume,
+    decode_sequenced,
+    compress_frames,
+)
+
+# Seconds to wait for the server to accept a connection
+CONNECT_TIMEOUT = 5.0
+
+# Reconnect backoff: attempt n waits a random time up to
+# min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** n) seconds, so clients
+# dropped together by a server restart do not all come back at once
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+RECONNECT_ATTEMPTS = 10
+
+
+def reconnect_delay(attempt: int) -> float:
+    """Seconds to wait before the given reconnect attempt, with full jitter"""
+    ceiling = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2**attempt)
+    return random.uniform(0, ceiling)
 
 
 class ChatClient:
     """Chat client that connects to a server and manages communication and UI"""
 
-    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
-        """Initialize the client with host and port"""
+    def __init__(
+        self,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        tls: ssl.SSLContext | None = None,
+        scrollback: int = DEFAULT_SCROLLBACK_LINES,
+    ) -> None:
+        """Initialize the client with host and port, over TLS if a context is given"""
         self.host = host
         self.port = port
+        self.tls = tls
+        # TLS session of the last welcomed connection, reconnects resume it
+        # instead of paying for a full handshake
+        self.tls_session = None
         self.socket = None
         self.username = ""
         self.connected = False
         self.running = True
         self.receive_thread = None
+        # Sequence number of the newest broadcast seen, kept across reconnects
+        self.last_seq = None
+        # Token for resuming the session, and whether the current connection
+        # got far enough to be worth reconnecting
+        self.resume_token = None
+        self.established = False
+        # Set while reconnecting after a drop, until the server welcomes us back,
+        # and the attempts made so far
+        self.reconnecting = False
+        self.reconnect_attempts = 0
+        # Set by disconnect() to stop the current connection's receive thread and
+        # cut its reconnect backoff short, each connection gets a fresh one
+        self.stopped = threading.Event()
+        # Guards replacing self.socket, so a reconnect cannot install a new
+        # connection once disconnect() has run
+        self.socket_lock = threading.Lock()
+        # Whether the server agreed to compression on the current connection
+        self.compression = False
         self.theme = darkdetect.theme().lower()
         self.colors = get_theme(self.theme)
 
-        # Message queue for thread-safe communication
+        # Message queue for thread-safe communication, and whether the UI has
+        # already been woken to drain it
         self.message_queue = queue.Queue()
+        self.wakeup_pending = False
+        self.wakeup_lock = threading.Lock()
 
         # Create the UI components
         self.root = tk.Tk()
@@ -43,9 +114,18 @@ class ChatClient:
         # Apply theme to root window
         self.root.configure(bg=self.colors["bg_main"])
 
+        # The receive thread wakes the UI by writing to a socket pair the Tk
+        # event loop watches, so it never calls into Tcl itself. Tcl has no
+        # file handlers on Windows, where a generated event is used instead.
+        self.wakeup_reader = self.wakeup_writer = None
+        if hasattr(self.root.tk, "createfilehandler"):
+            self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+            self.wakeup_reader.setblocking(False)
+            self.wakeup_writer.setblocking(False)
+
         # Initialize UI components - do this after setting initial theme
         self.login_ui = LoginGUI(self.root, self, self.theme)
-        self.chat_ui = ChatGUI(self.root, self)
+        self.chat_ui = ChatGUI(self.root, self, scrollback)
 
     def start(self) -> None:
         """Start the client application"""
@@ -89,22 +169,26 @@ class ChatClient:
 
     def connect_to_server(self, username: str) -> bool:
         """Connect to the chat server"""
+        same_user = username == self.username
         self.username = username
 
         # Ensure we're properly disconnected first
         self.disconnect()
 
-        try:
-            # Create new socket and connect
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.host, self.port))
+        if not same_user:
+            self.resume_token = None
 
-            # Send username to server
-            self.socket.send(self.username.encode("utf-8"))
+        try:
+            # Create new socket, connect and log in
+            self.socket = self.open_connection()
 
-            # Start receiving thread
+            # Start receiving thread, a thread left over from the previous
+            # connection still holds that connection's stopped event
+            self.stopped = threading.Event()
             self.running = True
-            self.receive_thread = threading.Thread(target=self.receive_messages)
+            self.receive_thread = threading.Thread(
+                target=self.receive_messages, args=(self.stopped,)
+            )
             self.receive_thread.daemon = True
             self.receive_thread.start()
 
@@ -112,62 +196,215 @@ class ChatClient:
             return True
 
         except Exception as e:
-            self.message_queue.put(f"[Error] Could not connect to server: {str(e)}")
+            self.post_message(f"[Error] Could not connect to server: {str(e)}")
             return False
 
-    def receive_messages(self) -> None:
-        """Receive messages from server and put them in queue"""
-        while self.running:
+    def open_connection(self) -> socket.socket:
+        """Connect to the server and send the login, resuming the session if possible"""
+        # Send username to server, after asking for whatever was missed
+        # since the last session if there was one
+        login = encode_text(self.username, FRAME_LOGIN)
+        if self.resume_token is not None:
+            # Falls back to a normal login if the session has expired
+            login = encode_resume(self.last_seq or 0, self.resume_token, self.username)
+        elif self.last_seq is not None:
+            login = encode_history_request(self.last_seq) + login
+        # Open with the hello so the server knows which features we support
+        login = encode_hello(CAP_COMPRESSION | CAP_RESUME) + login
+
+        sock = socket.create_connection((self.host, self.port), CONNECT_TIMEOUT)
+        try:
+            if self.tls:
+                # Handshakes within the connect timeout, the session is only
+                # offered to the server it came from
+                sock = self.tls.wrap_socket(
+                    sock, server_hostname=self.host, session=self.tls_session
+                )
+            sock.settimeout(None)
+            sock.sendall(login)
+        except OSError:
+            sock.close()
+            raise
+        self.established = False
+        self.compression = False
+        return sock
+
+    def receive_messages(self, stopped: threading.Event) -> None:
+        """Receive messages from server and put them in queue until stopped is set"""
+        decoder = FrameDecoder()
+        while not stopped.is_set():
             try:
-                # Set a timeout to allow checking if we're still running
-                self.socket.settimeout(0.5)
-                data = self.socket.recv(1024).decode("utf-8")
+                # Block until data arrives, disconnect() shuts the socket
+                # down to wake this thread up
+                data = self.socket.recv(RECV_BUFFER_SIZE)
                 if not data:
+                    if self.reconnect(stopped):
+                        decoder = FrameDecoder()
+                        continue
                     break
 
-                # Put message in queue for UI thread to handle
-                self.message_queue.put(data)
+                # A single read may carry several frames or only part of one
+                for frame_type, payload in decoder.feed(data):
+                    self.handle_frame(frame_type, payload)
 
-            except socket.timeout:
-                # This is expected due to the timeout we set
-                continue
             except Exception as e:
-                if self.running:
-                    self.message_queue.put(f"[Error] Connection lost: {str(e)}")
+                if self.reconnect(stopped):
+                    decoder = FrameDecoder()
+                    continue
+                if not stopped.is_set():
+                    self.post_message(f"[Error] Connection lost: {str(e)}")
+                    stopped.set()
                     self.running = False
                 break
 
         # If we're still supposed to be running but we exited the loop, server disconnected
-        if self.running:
-            self.message_queue.put("[Info] Server disconnected.")
+        if not stopped.is_set():
+            self.post_message("[Info] Server disconnected.")
             self.chat_ui.handle_server_disconnect()
 
+    def handle_frame(self, frame_type: int, payload: bytes) -> None:
+        """Act on a single frame received from the server"""
+        if frame_type == FRAME_TEXT:
+            # Put message in queue for UI thread to handle
+            message = payload.decode("utf-8")
+            if message.startswith(SUCCESS_MESSAGE):
+                # Welcomed, so this connection is worth reconnecting
+                self.mark_established()
+            self.post_message(message)
+        elif frame_type in (FRAME_BROADCAST, FRAME_HISTORY):
+            seq, message = decode_sequenced(payload)
+            if self.last_seq is not None and seq <= self.last_seq:
+                # Already shown, replayed again after a reconnect
+                return
+            self.last_seq = seq
+            self.post_message(message)
+        elif frame_type == FRAME_SESSION:
+            self.resume_token = payload
+            self.mark_established()
+        elif frame_type == FRAME_HELLO_ACK:
+            _, capabilities = decode_hello(payload)
+            # Large frames both ways are compressed if the server agreed
+            self.compression = bool(capabilities & CAP_COMPRESSION)
+
+    def post_message(self, message: str) -> None:
+        """Queue a message for the UI, waking it once per burst of arrivals"""
+        self.message_queue.put(message)
+        with self.wakeup_lock:
+            if self.wakeup_pending:
+                return
+            self.wakeup_pending = True
+        try:
+            if self.wakeup_writer:
+                self.wakeup_writer.send(b"\0")
+            else:
+                # A threaded Tcl hands events generated off the Tk thread over to it
+                self.root.event_generate(MESSAGE_EVENT, when="tail")
+        except (OSError, tk.TclError, RuntimeError):
+            # The window is gone or not running yet, the next message tries again
+            self.message_wakeup_done()
+
+    def message_wakeup_done(self) -> None:
+        """Called by the UI before it drains the queue"""
+        with self.wakeup_lock:
+            self.wakeup_pending = False
+            if self.wakeup_reader:
+                # At most one wakeup byte is outstanding
+                try:
+                    self.wakeup_reader.recv(RECV_BUFFER_SIZE)
+                except OSError:
+                    pass
+
+    def mark_established(self) -> None:
+        """Note that the server accepted this connection's login"""
+        self.established = True
+        self.reconnecting = False
+        self.reconnect_attempts = 0
+        if self.tls and self.socket:
+            # Tickets arrive after the handshake, by now the session carries one
+            self.tls_session = self.socket.session
+
+    def reconnect(self, stopped: threading.Event) -> bool:
+        """Reconnect after the connection dropped, backing off between attempts"""
+        # Only connections that were logged in, or dropped while reconnecting,
+        # are retried, so a rejected first login does not turn into a loop
+        with self.socket_lock:
+            if stopped.is_set() or not (self.established or self.reconnecting):
+                return False
+            self.established = False
+            self.connected = False
+            self.reconnecting = True
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+
+        # Attempts carry over when a reconnect drops again before the welcome
+        while self.reconnect_attempts < RECONNECT_ATTEMPTS:
+            delay = reconnect_delay(self.reconnect_attempts)
+            self.reconnect_attempts += 1
+            self.post_message(
+                f"[Info] Connection lost, reconnecting in {delay:.1f}s "
+                f"(attempt {self.reconnect_attempts} of {RECONNECT_ATTEMPTS})..."
+            )
+            # disconnect() sets stopped to abandon the backoff
+            if stopped.wait(delay):
+                return False
+            try:
+                sock = self.open_connection()
+            except OSError:
+                continue
+            with self.socket_lock:
+                if stopped.is_set():
+                    # Disconnected while this attempt was connecting
+                    sock.close()
+                    return False
+                # The server sends only what was missed while we were away
+                self.socket = sock
+                self.connected = True
+            return True
+
+        self.reconnecting = False
+        self.reconnect_attempts = 0
+        return False
+
     def send_message(self, message: str) -> bool:
         """Send message to server"""
         if not self.connected or not self.socket:
             return False
 
         try:
-            self.socket.send(message.encode("utf-8"))
+            frame = encode_text(message)
+            if self.compression and len(frame) >= DEFAULT_COMPRESS_THRESHOLD:
+                # Large pastes travel compressed
+                frame = compress_frames(frame)
+            self.socket.sendall(frame)
             return True
         except Exception as e:
-            self.message_queue.put(f"[Error] Could not send message: {str(e)}")
+            self.post_message(f"[Error] Could not send message: {str(e)}")
             return False
 
     def disconnect(self) -> None:
         """Disconnect from the server"""
-        # Set running to False to stop the receive thread
-        self.running = False
+        # Set running to False to stop the receive thread, a reconnect in
+        # progress sees stopped once it has the lock and gives up
+        with self.socket_lock:
+            self.running = False
+            self.stopped.set()
+            sock = self.socket
+            self.socket = None
+            self.connected = False
 
-        # Close socket if it exists
-        if self.socket:
+        # Shut down and close socket if it exists, shutdown() wakes the
+        # receive thread out of its blocking recv()
+        if sock:
             try:
-                self.socket.close()
+                sock.shutdown(socket.SHUT_RDWR)
+            except:
+                pass
+            try:
+                sock.close()
             except:
                 pass
-            self.socket = None
-
-        self.connected = False
 
         # Wait for the receive thread to finish if it's running
         if self.receive_thread and self.receive_thread.is_alive():
@@ -191,9 +428,17 @@ class ChatClient:
             self.root.destroy()
 
 
-def start_client(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+def start_client(
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    tls: bool = False,
+    tls_ca: str | None = None,
+    scrollback: int = DEFAULT_SCROLLBACK_LINES,
+) -> None:
     """Start the chat client with the specified host and port"""
-    client = ChatClient(host, port)
+    client = ChatClient(
+        host, port, client_context(tls_ca) if tls or tls_ca else None, scrollback
+    )
     client.start()
 
 
@@ -14,28 +14,37 @@ else:
 from tkinter import scrolledtext, Frame, Label, messagebox, Canvas
 import queue
 import datetime
+from collections import deque
+import time
 import webbrowser
 
-from client.utils import process_emoji_shortcodes, extract_urls
+from client.utils import process_emoji_shortcodes, shortcode_index
+from client.parsing import message_classifier, tokenize_urls
 from client.tkHyperlinkManager import HyperlinkManager
-from common.constants import (
-    DM_FROM,
-    DM_TO,
-    ERROR_MESSAGE,
-    WARNING_MESSAGE,
-    INFO_MESSAGE,
-    SUCCESS_MESSAGE,
-    DEBUG_MESSAGE,
-    ANNOUNCEMENT,
-)
+from client.scrollback import ScrollbackStore, DEFAULT_SCROLLBACK_LINES
 from client.theme import FONT_BOLD, FONT_REGULAR, MESSAGE_STYLES
 
+# Virtual event the client raises on the root window when messages are queued
+MESSAGE_EVENT = "<<MessageArrived>>"
+
+# Most messages rendered with a single insert, and seconds of rendering per tick
+# before control goes back to Tk so input and redraws are not starved by a burst
+RENDER_BATCH_SIZE = 200
+RENDER_BUDGET = 0.015
+
+# Messages paged back in at a time when scrolling past the oldest one shown,
+# and the fraction of the scrollback cap (1/N) allowed over it before a trim
+SCROLLBACK_PAGE = 200
+SCROLLBACK_SLACK = 10
+
 
 class ChatGUI:
     """Chat interface for the chat client"""
 
-    def __init__(self, root: tk.Tk, client: any) -> None:
-        """Initialize the chat UI with root window and client reference"""
+    def __init__(
+        self, root: tk.Tk, client: any, scrollback: int = DEFAULT_SCROLLBACK_LINES
+    ) -> None:
+        """Initialize the chat UI with root window, client reference and scrollback cap"""
         self.root = root
         self.client = client
         self.colors = self.client.colors
@@ -46,6 +55,18 @@ class ChatGUI:
         self.update_timer = None
         self.status_label = None
 
+        # Lines kept in the display, 0 for no limit. Every message also goes to
+        # the store, older ones are paged back in from it when scrolling up.
+        self.scrollback = scrollback
+        self.scrollback_store = None
+        # Line count and link tags of each message in the display, oldest
+        # first, and the store position of the oldest one. The display holds
+        # the store from first_shown up to first_shown + len(shown).
+        self.shown = deque()
+        self.shown_lines = 0
+        self.first_shown = 0
+        self.paging = False
+
     def setup_chat_frame(self) -> None:
         """Create main chat interface with proper color constants for message types"""
         if self.chat_frame:
@@ -145,7 +166,9 @@ class ChatGUI:
             pady=8,
         )
         self.chat_display.pack(fill=tk.BOTH, expand=True)
-        self.chat_display.config(state=tk.DISABLED)
+        self.chat_display.config(state=tk.DISABLED, yscrollcommand=self.on_chat_scroll)
+        # A rebuilt display starts empty, earlier messages page back in from the store
+        self.reset_scrollback()
 
         # Initialize hyperlink manager
         self.hyperlink_manager = HyperlinkManager(
@@ -177,6 +200,7 @@ class ChatGUI:
 
         # Bind key events for emoji processing as you type
         self.message_entry.bind("<KeyRelease>", self.process_emoji_as_you_type)
+        self.message_entry.bind("<<Paste>>", self.paste_with_emoji)
 
         # Send button with default styling
         self.send_button = Button(
@@ -235,6 +259,8 @@ class ChatGUI:
         self.chat_display.config(state=tk.NORMAL)
         self.chat_display.delete("1.0", tk.END)
         self.chat_display.config(state=tk.DISABLED)
+        self.hyperlink_manager.reset()
+        self.reset_scrollback(clear=True)
 
         if self.message_entry:
             self.message_entry.delete("1.0", tk.END)
@@ -251,121 +277,237 @@ class ChatGUI:
         self.client.setup_login_ui()
 
     def start_message_processing(self) -> None:
-        """Start processing messages from the queue"""
+        """Render messages whenever the client signals new ones, starting with any already queued"""
         # Cancel any existing timer
         if self.update_timer:
             self.root.after_cancel(self.update_timer)
 
-        # Start a new timer
-        self.update_timer = self.root.after(100, self.process_messages)
+        # Nothing runs while the queue is empty, arrivals wake the UI instead
+        if self.client.wakeup_reader:
+            self.root.tk.createfilehandler(
+                self.client.wakeup_reader, tk.READABLE, lambda *args: self.process_messages()
+            )
+        else:
+            self.root.bind(MESSAGE_EVENT, lambda event: self.process_messages())
+        self.update_timer = self.root.after_idle(self.process_messages)
 
     def process_messages(self) -> None:
-        """Process messages from the queue and update UI"""
+        """Render queued messages in batches until the queue is empty or the budget is spent"""
+        self.update_timer = None
+        # Cleared before draining, so a message queued from here on wakes the UI again
+        self.client.message_wakeup_done()
+        if not self.chat_display:
+            # Left queued for the next chat screen
+            return
+        deadline = time.perf_counter() + RENDER_BUDGET
+        backlog = False
+        while True:
+            batch = self.drain_messages(RENDER_BATCH_SIZE)
+            if batch:
+                self.display_messages(batch)
+            if len(batch) < RENDER_BATCH_SIZE:
+                break
+            if time.perf_counter() >= deadline:
+                # Still more queued, let Tk handle events before the next batch
+                backlog = True
+                break
+
+        if backlog and self.client.running:
+            self.update_timer = self.root.after(1, self.process_messages)
+
+    def drain_messages(self, limit: int) -> list[str]:
+        """Take up to limit messages off the queue without blocking"""
+        messages = []
         try:
-            while not self.client.message_queue.empty():
-                message = self.client.message_queue.get_nowait()
-                self.display_message(message)
+            while len(messages) < limit:
+                messages.append(self.client.message_queue.get_nowait())
         except queue.Empty:
             pass
+        return messages
 
-        if self.client.running:
-            self.update_timer = self.root.after(100, self.process_messages)
-
-    def display_message(self, message) -> None:
-        """Add a message to the chat display with proper styling for URLs and message types"""
+    def display_messages(self, messages: list[str]) -> None:
+        """Add messages to the chat display with one insert and one scroll"""
         if not self.chat_display:
             return
 
-        self.chat_display.config(state=tk.NORMAL)
-        message_tags = {
-            f"@{self.client.username}: ": "my_message",
-            DM_FROM: "dm_to_me",
-            DM_TO: "dm_from_me",
-            ERROR_MESSAGE: "error_message",
-            WARNING_MESSAGE: "warning_message",
-            INFO_MESSAGE: "info_message",
-            SUCCESS_MESSAGE: "success_message",
-            DEBUG_MESSAGE: "debug_message",
-            ANNOUNCEMENT: "announcement",
-        }
-
-        # Determine message type for formatting
-        msg_tag = next(
-            (tag for prefix, tag in message_tags.items() if message.startswith(prefix)),
-            "regular",
-        )
-
-        # Add timestamp
+        # Messages rendered in the same tick share a timestamp
         timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-        self.chat_display.insert(tk.END, f"[{timestamp}] ", "timestamp")
-
-        # Insert message prefix ([DM from/to] or [System] or [Error] or username)
-        message_prefix = message.split(": ", 1)[0]
-        self.chat_display.insert(tk.END, f"{message_prefix}", msg_tag)
-        self.chat_display.insert(tk.END, "\t")
+        records = [(timestamp, message) for message in messages]
+        newest_shown = self.first_shown + len(self.shown) == len(self.scrollback_store)
+        self.scrollback_store.extend(records)
+        if not newest_shown:
+            # The newest messages were trimmed away while reading older ones,
+            # these are paged in after them once the user scrolls back down
+            return
 
-        # Get message content after prefix
-        message = message.split(": ", 1)[1] if ": " in message else message
+        # Only follow new messages if the user has not scrolled up to read older ones
+        at_bottom = self.chat_display.yview()[1] >= 1.0
+        fragments, shown = self.render_messages(records)
+        self.shown.extend(shown)
+        self.shown_lines += sum(lines for lines, _ in shown)
 
-        # Extract URLs from the message
-        urls = extract_urls(message)
+        self.chat_display.config(state=tk.NORMAL)
+        self.chat_display.insert(tk.END, *fragments)
+        self.trim_scrollback(at_bottom)
 
-        if urls:
-            # Insert message with clickable URLs
-            current_pos = 0
-            for url_start, url_end, url in urls:
-                # Insert text before URL
-                if url_start > current_pos:
-                    self.chat_display.insert(tk.END, message[current_pos:url_start])
+        # Scroll to bottom
+        if at_bottom:
+            self.chat_display.see(tk.END)
+        self.chat_display.config(state=tk.DISABLED)
 
-                # Insert the URL with hyperlink tags and the url tag
-                url_text = message[url_start:url_end]
+    def render_messages(
+        self, records: list[tuple[str, str]]
+    ) -> tuple[list, list[tuple[int, list[str]]]]:
+        """Text.insert arguments for (timestamp, message) records, and the lines and link tags of each"""
+        classify = message_classifier(self.client.username)
+
+        # Alternating text and tag list arguments for a single Text.insert
+        fragments = []
+        shown = []
+        for timestamp, message in records:
+            # Determine message type for formatting, then show the timestamp and
+            # the message prefix ([DM from/to] or [System] or [Error] or username)
+            msg_tag, message_prefix, content = classify(message)
+            fragments += (f"[{timestamp}] ", "timestamp", message_prefix, msg_tag)
+
+            # Message content with clickable URLs
+            text = "\t"
+            links = []
+            for piece, is_url in tokenize_urls(content):
+                if not is_url:
+                    text += piece
+                    continue
                 hyperlink_tags = self.hyperlink_manager.add(
-                    lambda u=url: webbrowser.open(u)
+                    lambda u=piece: webbrowser.open(u)
                 )
-                self.chat_display.insert(tk.END, url_text, hyperlink_tags)
-
-                current_pos = url_end
+                links.append(hyperlink_tags[1])
+                fragments += (text, (), piece, hyperlink_tags)
+                text = ""
+            fragments += (text + "\n", ())
+            shown.append(((message_prefix + content).count("\n") + 1, links))
+        return fragments, shown
+
+    def trim_scrollback(self, at_bottom: bool) -> None:
+        """Delete the oldest messages in bulk once the display holds too many lines"""
+        if not self.scrollback:
+            return
+        # Scrolled-up readers keep up to twice the cap so their view is not cut
+        # away, and trimming waits for some slack so it happens in bulk
+        keep = self.scrollback if at_bottom else 2 * self.scrollback
+        if self.shown_lines <= keep + self.scrollback // SCROLLBACK_SLACK:
+            return
 
-            # Insert any remaining text after the last URL
-            if current_pos < len(message):
-                self.chat_display.insert(tk.END, message[current_pos:])
+        # Trim the end furthest from what the user is looking at
+        first, last = self.chat_display.yview()
+        oldest = at_bottom or first > 1.0 - last
+        lines = 0
+        links = []
+        while self.shown and self.shown_lines - lines > keep:
+            count, tags = self.shown.popleft() if oldest else self.shown.pop()
+            lines += count
+            links += tags
+            if oldest:
+                self.first_shown += 1
+        if oldest:
+            self.chat_display.delete("1.0", f"{lines + 1}.0")
         else:
-            # No URLs, insert the whole message
-            self.chat_display.insert(tk.END, message)
-
-        # Add a newline at the end
-        self.chat_display.insert(tk.END, "\n")
+            self.chat_display.delete(f"{self.shown_lines - lines + 1}.0", tk.END)
+        self.hyperlink_manager.remove(links)
+        self.shown_lines -= lines
+
+    def on_chat_scroll(self, first: str, last: str) -> None:
+        """Update the scrollbar, and page stored messages in when either end is reached"""
+        self.chat_display.vbar.set(first, last)
+        if self.paging:
+            return
+        # Not from inside the scroll callback, the insert would re-enter it
+        if float(first) <= 0 and self.first_shown:
+            self.paging = True
+            self.root.after_idle(self.page_older_messages)
+        elif float(last) >= 1 and self.first_shown + len(self.shown) < len(self.scrollback_store):
+            self.paging = True
+            self.root.after_idle(self.page_newer_messages)
+
+    def page_older_messages(self) -> None:
+        """Insert the page of stored messages just before the oldest one shown"""
+        self.paging = False
+        if not self.chat_display or not self.first_shown:
+            return
+        start = max(0, self.first_shown - SCROLLBACK_PAGE)
+        fragments, shown = self.render_messages(
+            self.scrollback_store.read(start, self.first_shown)
+        )
+        lines = sum(count for count, _ in shown)
 
-        # Scroll to bottom
-        self.chat_display.see(tk.END)
+        self.chat_display.config(state=tk.NORMAL)
+        self.chat_display.insert("1.0", *fragments)
+        self.shown.extendleft(reversed(shown))
+        self.shown_lines += lines
+        self.first_shown = start
+
+        # Keep the message that was at the top where the user is looking
+        self.chat_display.yview(f"{lines + 1}.0")
+        self.trim_scrollback(False)
         self.chat_display.config(state=tk.DISABLED)
 
-    def process_emoji_as_you_type(self, event) -> None:
-        """Process emoji shortcodes as the user types"""
-        if not self.message_entry:
+    def page_newer_messages(self) -> None:
+        """Append the page of stored messages just after the newest one shown"""
+        self.paging = False
+        if not self.chat_display:
             return
-
-        current_text = self.message_entry.get("1.0", tk.END)
-
-        # Don't process if no potential shortcodes
-        if ":" not in current_text:
+        end = self.first_shown + len(self.shown)
+        fragments, shown = self.render_messages(
+            self.scrollback_store.read(end, end + SCROLLBACK_PAGE)
+        )
+        if not shown:
             return
 
-        # Process text with emojis
-        processed_text = process_emoji_shortcodes(current_text)
+        self.chat_display.config(state=tk.NORMAL)
+        self.chat_display.insert(tk.END, *fragments)
+        self.shown.extend(shown)
+        self.shown_lines += sum(count for count, _ in shown)
+        self.trim_scrollback(False)
+        self.chat_display.config(state=tk.DISABLED)
 
-        # Only update if there was a change
-        if processed_text != current_text:
-            cursor_pos = self.message_entry.index(tk.INSERT)
-            self.message_entry.delete("1.0", tk.END)
-            self.message_entry.insert("1.0", processed_text)
+    def reset_scrollback(self, clear: bool = False) -> None:
+        """Forget what the display shows, and the stored messages too if clear is set"""
+        if clear and self.scrollback_store:
+            self.scrollback_store.close()
+            self.scrollback_store = None
+        if self.scrollback_store is None:
+            self.scrollback_store = ScrollbackStore()
+        self.shown.clear()
+        self.shown_lines = 0
+        self.first_shown = len(self.scrollback_store)
+        self.paging = False
 
-            # Try to keep cursor position
-            try:
-                self.message_entry.mark_set(tk.INSERT, cursor_pos)
-            except:
-                pass
+    def process_emoji_as_you_type(self, event) -> None:
+        """Replace the emoji shortcode just typed before the cursor, if there is one"""
+        if not self.message_entry:
+            return
+
+        # Only the few characters a shortcode can span are read, so a keystroke
+        # costs the same however long the message is
+        index = shortcode_index()
+        before = self.message_entry.get(f"insert -{index.longest} chars", tk.INSERT)
+        match = index.match_before(before)
+        if match:
+            length, emoji_char = match
+            self.message_entry.delete(f"insert -{length} chars", tk.INSERT)
+            self.message_entry.insert(tk.INSERT, emoji_char)
+
+    def paste_with_emoji(self, event) -> str:
+        """Paste the clipboard with its emoji shortcodes already converted"""
+        try:
+            text = self.root.clipboard_get()
+        except tk.TclError:
+            # Nothing to paste
+            return "break"
+        if self.message_entry.tag_ranges(tk.SEL):
+            self.message_entry.delete(tk.SEL_FIRST, tk.SEL_LAST)
+        self.message_entry.insert(tk.INSERT, process_emoji_shortcodes(text))
+        self.message_entry.see(tk.INSERT)
+        return "break"
 
     def send_message(self) -> None:
         """Send message to server"""
@@ -0,0 +1,70 @@
+"""
+Message Parsing Module
+Classifies incoming chat lines and splits out their URLs, with every pattern compiled once
+"""
+
+import re
+from functools import lru_cache
+from common.constants import (
+    DM_FROM,
+    DM_TO,
+    ERROR_MESSAGE,
+    WARNING_MESSAGE,
+    INFO_MESSAGE,
+    SUCCESS_MESSAGE,
+    DEBUG_MESSAGE,
+    ANNOUNCEMENT,
+    ROOM_MESSAGE,
+)
+
+URL_PATTERN = re.compile(r"(https?://[^\s]+)")
+
+# Display tag of every message that starts with a known prefix, tried in this
+# order after the user's own "@username: " prefix
+PREFIX_TAGS = (
+    (DM_FROM, "dm_to_me"),
+    (DM_TO, "dm_from_me"),
+    (ERROR_MESSAGE, "error_message"),
+    (WARNING_MESSAGE, "warning_message"),
+    (INFO_MESSAGE, "info_message"),
+    (SUCCESS_MESSAGE, "success_message"),
+    (DEBUG_MESSAGE, "debug_message"),
+    (ANNOUNCEMENT, "announcement"),
+    (ROOM_MESSAGE, "room_message"),
+)
+
+# Tag of messages with none of the prefixes
+REGULAR_TAG = "regular"
+
+
+class MessageClassifier:
+    """Tags messages for display with a single compiled match per message"""
+
+    def __init__(self, username: str) -> None:
+        """Build the pattern for messages seen by username"""
+        prefixes = ((f"@{username}: ", "my_message"),) + PREFIX_TAGS
+        # One named group per prefix, the group that matched names the tag
+        self.pattern = re.compile(
+            "|".join(f"(?P<{tag}>{re.escape(prefix)})" for prefix, tag in prefixes)
+        )
+
+    def __call__(self, message: str) -> tuple[str, str, str]:
+        """Return the tag, the prefix before ": " and the content after it"""
+        match = self.pattern.match(message)
+        tag = match.lastgroup if match else REGULAR_TAG
+        prefix, separator, content = message.partition(": ")
+        # Lines without a prefix show in full as their content
+        return tag, prefix, content if separator else message
+
+
+@lru_cache(maxsize=4)
+def message_classifier(username: str) -> MessageClassifier:
+    """Classifier for username, built once per username"""
+    return MessageClassifier(username)
+
+
+def tokenize_urls(text: str) -> list[tuple[str, bool]]:
+    """Split text into (fragment, is_url) pieces in order, dropping empty fragments"""
+    # re.split keeps the captured URLs at the odd positions
+    pieces = URL_PATTERN.split(text)
+    return [(piece, index % 2 == 1) for index, piece in enumerate(pieces) if piece]
@@ -0,0 +1,60 @@
+"""
+Scrollback Store Module
+Every displayed message in a temporary file, so the chat display only holds the newest lines
+"""
+
+import tempfile
+from array import array
+
+# Lines kept in the chat display by default, older ones are paged back in from the store
+DEFAULT_SCROLLBACK_LINES = 5000
+
+# Separates the timestamp from the message in a stored record
+FIELD_SEPARATOR = "\x1f"
+
+
+class ScrollbackStore:
+    """Append-only log of (timestamp, message) records, read back by position"""
+
+    def __init__(self) -> None:
+        """Create an empty store, its file is deleted when closed"""
+        self.file = tempfile.TemporaryFile()
+        # Start of every record in the file, plus where the next one goes
+        self.offsets = array("Q", [0])
+
+    def __len__(self) -> int:
+        """Number of stored messages"""
+        return len(self.offsets) - 1
+
+    def extend(self, records: list[tuple[str, str]]) -> None:
+        """Append (timestamp, message) records with a single write"""
+        chunks = []
+        end = self.offsets[-1]
+        for timestamp, message in records:
+            chunk = f"{timestamp}{FIELD_SEPARATOR}{message}".encode("utf-8")
+            chunks.append(chunk)
+            end += len(chunk)
+            self.offsets.append(end)
+        self.file.seek(0, 2)
+        self.file.write(b"".join(chunks))
+
+    def read(self, start: int, end: int) -> list[tuple[str, str]]:
+        """Records start up to end, oldest first"""
+        start = max(0, start)
+        end = min(end, len(self))
+        if start >= end:
+            return []
+        base = self.offsets[start]
+        self.file.seek(base)
+        data = self.file.read(self.offsets[end] - base)
+
+        records = []
+        for index in range(start, end):
+            chunk = data[self.offsets[index] - base : self.offsets[index + 1] - base]
+            timestamp, _, message = chunk.decode("utf-8").partition(FIELD_SEPARATOR)
+            records.append((timestamp, message))
+        return records
+
+    def close(self) -> None:
+        """Delete the stored messages"""
+        self.file.close()
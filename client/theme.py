@@ -160,5 +160,15 @@ MESSAGE_STYLES = {
         "borderwidth": 0,
         "font": FONT_BOLD,
     },
+    "room_message": {
+        "background": "#ede7f6",  # Light purple
+        "foreground": "#4527a0",  # Dark purple
+        "lmargin1": 10,
+        "lmargin2": 10,
+        "rmargin": 10,
+        "relief": "flat",
+        "borderwidth": 0,
+        "font": FONT_BOLD,
+    },
     "timestamp": {"font": FONT_TIMESTAMP, "foreground": "#757575"},
 }
@@ -20,14 +20,26 @@ class HyperlinkManager:
 
     def reset(self) -> None:
         self.links = {}
+        # links can be removed, so tags are numbered by a counter instead
+        # of by how many links there are
+        self.next_id = 0
 
     def add(self, action) -> tuple[str, str]:
         # add an action to the manager.  returns tags to use in
         # associated text widget
-        tag = "hyper-%d" % len(self.links)
+        tag = "hyper-%d" % self.next_id
+        self.next_id += 1
         self.links[tag] = action
         return "hyper", tag
 
+    def remove(self, tags: list[str]) -> None:
+        # forget links whose text was deleted from the widget, along with
+        # their tags
+        for tag in tags:
+            self.links.pop(tag, None)
+        if tags:
+            self.text.tag_delete(*tags)
+
     def _enter(self, event) -> None:
         self.text.config(cursor="hand2")
 
@@ -3,22 +3,61 @@ Chat Client Utilities
 Helper functions for the chat client
 """
 
-import re
+from functools import lru_cache
 import emoji
 
+# Marks both ends of an emoji shortcode, e.g. ":smile:"
+SHORTCODE_DELIMITER = ":"
 
-def process_emoji_shortcodes(text:str) -> str:
-    """Convert emoji shortcodes to Unicode emojis"""
-    # Using the emoji library to convert shortcodes
-    return emoji.emojize(text, language="alias")
 
+class ShortcodeIndex:
+    """Every emoji shortcode mapped to its emoji, for looking up the one just typed"""
+
+    def __init__(self) -> None:
+        """Build the table the way emoji.emojize(language="alias") resolves names"""
+        fully_qualified = emoji.STATUS["fully_qualified"]
+        names = {}
+        aliases = {}
+        for emoji_char, data in emoji.EMOJI_DATA.items():
+            if data["status"] > fully_qualified:
+                continue
+            names.setdefault(data["en"], emoji_char)
+            for alias in data.get("alias", ()):
+                aliases.setdefault(alias, emoji_char)
+        # Aliases win over English names, as they do in emojize
+        names.update(aliases)
+        self.shortcodes = names
+        self.longest = max(map(len, names), default=0)
+
+    def match_before(self, text: str) -> tuple[int, str] | None:
+        """If text ends with a complete shortcode, return its length and its emoji"""
+        if not text.endswith(SHORTCODE_DELIMITER):
+            return None
+        start = text.rfind(SHORTCODE_DELIMITER, max(0, len(text) - self.longest), -1)
+        if start < 0:
+            return None
+        emoji_char = self.shortcodes.get(text[start:])
+        return (len(text) - start, emoji_char) if emoji_char else None
 
-def extract_urls(text:str) -> list[tuple[int, int, str]]:
-    """Extract URLs from text and return a list of (start_pos, end_pos, url) tuples"""
-    url_pattern = re.compile(r"(https?://[^\s]+)")
-    urls = []
 
-    for match in url_pattern.finditer(text):
-        urls.append((match.start(), match.end(), match.group(1)))
+@lru_cache(maxsize=1)
+def shortcode_index() -> ShortcodeIndex:
+    """The shortcode index, built on first use"""
+    return ShortcodeIndex()
 
-    return urls
+
+def process_emoji_shortcodes(text:str) -> str:
+    """Convert emoji shortcodes to Unicode emojis, exactly as typing the text would"""
+    # Look up the shortcode ending at each delimiter, left to right, the same
+    # way the message entry does when that delimiter is typed
+    index = shortcode_index()
+    pieces = text.split(SHORTCODE_DELIMITER)
+    result = pieces[0]
+    for piece in pieces[1:]:
+        result += SHORTCODE_DELIMITER
+        match = index.match_before(result)
+        if match:
+            length, emoji_char = match
+            result = result[:-length] + emoji_char
+        result += piece
+    return result
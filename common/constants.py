@@ -6,6 +6,7 @@ Common constants shared between client and server
 DEFAULT_HOST = "localhost"  # Default host for client
 DEFAULT_SERVER_HOST = "0.0.0.0"  # Listen on all interfaces for server
 DEFAULT_PORT = 12345  # Default port for both client and server
+LISTEN_BACKLOG = 1024  # Pending connections the kernel may queue before accept()
 
 # Message prefixes
 SYSTEM_MESSAGE = "[System]"
@@ -19,4 +20,9 @@ ANNOUNCEMENT = "[Announcement]"
 # Direct message prefixes
 DM_PREFIX = "@"
 DM_FROM = "[DM from"
-DM_TO = "[DM to"
\ No newline at end of file
+DM_TO = "[DM to"
+
+# Room prefixes
+ROOM_PREFIX = "#"  # "#room message" posts to a room the sender is in
+COMMAND_PREFIX = "/"  # "/join room", "/leave room" and "/rooms"
+ROOM_MESSAGE = "[#"  # Room messages read "[#room] @user: message"
\ No newline at end of file
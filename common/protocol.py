@@ -0,0 +1,219 @@
+"""
+Wire Protocol
+Length-prefixed framing shared between client and server
+"""
+
+import struct
+import zlib
+
+# Frame header: 4-byte big-endian payload length followed by a 1-byte frame type
+HEADER = struct.Struct("!IB")
+HEADER_SIZE = HEADER.size
+
+# Upper bound on a single frame payload, protects against corrupt length prefixes
+MAX_FRAME_SIZE = 1 << 20  # 1 MiB
+
+# Bytes requested per recv() call, large enough to drain many frames at once
+RECV_BUFFER_SIZE = 65536
+
+# Frame types
+FRAME_LOGIN = 0x01  # Client -> server: username
+FRAME_TEXT = 0x02  # Both directions: a UTF-8 chat line
+FRAME_BROADCAST = 0x03  # Server -> client: sequence number + UTF-8 chat line
+FRAME_HISTORY_REQUEST = 0x04  # Client -> server: sequence number to replay after
+FRAME_HISTORY = 0x05  # Server -> client: a replayed FRAME_BROADCAST, same payload
+FRAME_SESSION = 0x06  # Server -> client: resume token for the current session
+FRAME_RESUME = 0x07  # Client -> server: last sequence number + resume token + username
+FRAME_COMPRESS = 0x08  # Client -> server: supported compression, server -> client: the one chosen
+FRAME_COMPRESSED = 0x09  # Both directions: zlib-compressed run of complete frames
+FRAME_HELLO = 0x0A  # Client -> server: protocol version + capability flags, sent first
+FRAME_HELLO_ACK = 0x0B  # Server -> client: protocol version + capabilities enabled
+
+# Handshake: a client opens with FRAME_HELLO and the server answers with
+# FRAME_HELLO_ACK carrying the version both sides speak and the capabilities
+# both sides support. The client then logs in as before. Clients that start
+# with any other frame predate the handshake and get LEGACY_CAPABILITIES.
+HELLO = struct.Struct("!HI")
+PROTOCOL_VERSION = 1
+MIN_PROTOCOL_VERSION = 1
+
+# Capability flags
+CAP_COMPRESSION = 1 << 0  # Frames may be sent as FRAME_COMPRESSED (zlib)
+CAP_RESUME = 1 << 1  # The server hands out FRAME_SESSION tokens for FRAME_RESUME
+LEGACY_CAPABILITIES = CAP_RESUME
+
+# Sequence number prefix of FRAME_BROADCAST, FRAME_HISTORY and FRAME_HISTORY_REQUEST
+SEQ = struct.Struct("!Q")
+
+# Length of the opaque token carried by FRAME_SESSION and FRAME_RESUME
+RESUME_TOKEN_SIZE = 16
+
+# Compression negotiated with FRAME_COMPRESS. Frames shorter than the threshold,
+# such as most chat lines, are not worth compressing and are sent as they are.
+COMPRESSION_ZLIB = b"zlib"
+DEFAULT_COMPRESS_THRESHOLD = 256
+
+
+class ProtocolError(Exception):
+    """Raised when the peer sends bytes that do not form a valid frame"""
+
+
+def encode_frame(frame_type: int, payload: bytes) -> bytes:
+    """Build a complete frame from a frame type and a raw payload"""
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame payload too large: {len(payload)} bytes")
+    return HEADER.pack(len(payload), frame_type) + payload
+
+
+def encode_text(text: str, frame_type: int = FRAME_TEXT) -> bytes:
+    """Build a frame carrying a UTF-8 encoded string"""
+    return encode_frame(frame_type, text.encode("utf-8"))
+
+
+def encode_sequenced(seq: int, text: str, frame_type: int = FRAME_BROADCAST) -> bytes:
+    """Build a frame carrying a sequence number followed by a UTF-8 encoded string"""
+    return encode_frame(frame_type, SEQ.pack(seq) + text.encode("utf-8"))
+
+
+def encode_history_request(after_seq: int) -> bytes:
+    """Build a request for every broadcast numbered after after_seq"""
+    return encode_frame(FRAME_HISTORY_REQUEST, SEQ.pack(after_seq))
+
+
+def resequence(frame: bytes, seq: int) -> bytes:
+    """Copy of a complete sequenced frame carrying a different sequence number"""
+    return frame[:HEADER_SIZE] + SEQ.pack(seq) + frame[HEADER_SIZE + SEQ.size :]
+
+
+def encode_hello(
+    capabilities: int, version: int = PROTOCOL_VERSION, frame_type: int = FRAME_HELLO
+) -> bytes:
+    """Build a hello, or with FRAME_HELLO_ACK the server's answer to one"""
+    return encode_frame(frame_type, HELLO.pack(version, capabilities))
+
+
+def decode_hello(payload: bytes) -> tuple[int, int]:
+    """Split a FRAME_HELLO or FRAME_HELLO_ACK payload into version and capabilities"""
+    if len(payload) < HELLO.size:
+        raise ProtocolError("Hello frame too short")
+    # Later versions may append fields, which older peers ignore
+    return HELLO.unpack_from(payload)
+
+
+def encode_resume(last_seq: int, token: bytes, username: str) -> bytes:
+    """Build a request to resume a dropped session, or log in as username if it expired"""
+    return encode_frame(FRAME_RESUME, SEQ.pack(last_seq) + token + username.encode("utf-8"))
+
+
+def decode_resume(payload: bytes) -> tuple[int, bytes, str]:
+    """Split a FRAME_RESUME payload into last sequence number, token and username"""
+    token_end = SEQ.size + RESUME_TOKEN_SIZE
+    if len(payload) < token_end:
+        raise ProtocolError("Resume frame too short")
+    last_seq = SEQ.unpack_from(payload)[0]
+    return last_seq, payload[SEQ.size : token_end], payload[token_end:].decode("utf-8")
+
+
+def compress_frames(data: bytes, level: int = zlib.Z_DEFAULT_COMPRESSION) -> bytes:
+    """Wrap a run of complete frames in FRAME_COMPRESSED frames, where that makes it smaller"""
+    output = []
+    start = offset = 0
+    while offset < len(data):
+        length, _ = HEADER.unpack_from(data, offset)
+        end = offset + HEADER_SIZE + length
+        # Each compressed frame expands to at most MAX_FRAME_SIZE bytes
+        if end - start > MAX_FRAME_SIZE:
+            if offset > start:
+                output.append(_compress_chunk(data[start:offset], level))
+                start = offset
+            if end - start > MAX_FRAME_SIZE:
+                # A single frame too large to wrap goes out as it is
+                output.append(data[start:end])
+                start = end
+        offset = end
+    if start < len(data):
+        output.append(_compress_chunk(data[start:], level))
+    return b"".join(output)
+
+
+def _compress_chunk(chunk: bytes, level: int) -> bytes:
+    """One FRAME_COMPRESSED frame holding chunk, or chunk itself if that is smaller"""
+    compressed = zlib.compress(chunk, level)
+    if len(compressed) + HEADER_SIZE >= len(chunk):
+        return chunk
+    return HEADER.pack(len(compressed), FRAME_COMPRESSED) + compressed
+
+
+def decode_sequenced(payload: bytes) -> tuple[int, str]:
+    """Split a sequenced payload into its sequence number and text"""
+    if len(payload) < SEQ.size:
+        raise ProtocolError("Sequenced frame too short")
+    return SEQ.unpack_from(payload)[0], payload[SEQ.size :].decode("utf-8")
+
+
+class FrameDecoder:
+    """Incremental decoder that turns a byte stream into complete frames"""
+
+    def __init__(self, max_frame_size: int = MAX_FRAME_SIZE) -> None:
+        """Initialize an empty decoder"""
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> list[tuple[int, bytes]]:
+        """Append received bytes and return every frame completed by them"""
+        buffer = self._buffer
+        buffer += data
+
+        frames = []
+        offset = 0
+        available = len(buffer)
+        while available - offset >= HEADER_SIZE:
+            length, frame_type = HEADER.unpack_from(buffer, offset)
+            if length > self.max_frame_size:
+                raise ProtocolError(f"Frame payload too large: {length} bytes")
+
+            end = offset + HEADER_SIZE + length
+            if end > available:
+                # Partial frame, wait for more data
+                break
+
+            payload = bytes(buffer[offset + HEADER_SIZE : end])
+            if frame_type == FRAME_COMPRESSED:
+                frames.extend(self.decompress(payload))
+            else:
+                frames.append((frame_type, payload))
+            offset = end
+
+        # Drop consumed bytes in one operation instead of once per frame
+        if offset:
+            del buffer[:offset]
+
+        return frames
+
+    def decompress(self, payload: bytes) -> list[tuple[int, bytes]]:
+        """Return the frames packed into a FRAME_COMPRESSED payload"""
+        decompressor = zlib.decompressobj()
+        try:
+            data = decompressor.decompress(payload, self.max_frame_size)
+        except zlib.error as e:
+            raise ProtocolError(f"Invalid compressed frame: {e}")
+        # Refuse to inflate past the frame size limit, and reject truncated streams
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise ProtocolError("Compressed frame too large or truncated")
+
+        frames = []
+        offset = 0
+        while offset < len(data):
+            if len(data) - offset < HEADER_SIZE:
+                raise ProtocolError("Partial frame inside compressed frame")
+            length, frame_type = HEADER.unpack_from(data, offset)
+            end = offset + HEADER_SIZE + length
+            if end > len(data) or frame_type == FRAME_COMPRESSED:
+                raise ProtocolError("Invalid frame inside compressed frame")
+            frames.append((frame_type, data[offset + HEADER_SIZE : end]))
+            offset = end
+        return frames
+
+    def pending_bytes(self) -> int:
+        """Number of buffered bytes belonging to an incomplete frame"""
+        return len(self._buffer)
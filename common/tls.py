@@ -0,0 +1,29 @@
+"""
+TLS Module
+SSL contexts shared by the server engines, the client and the benchmarks
+"""
+
+import ssl
+
+# Session tickets the server issues after each full handshake. A client
+# reconnecting with one skips the certificate exchange and key agreement.
+SESSION_TICKETS = 2
+
+
+def server_context(cert_file: str, key_file: str) -> ssl.SSLContext:
+    """Context for serving TLS with the given certificate chain and private key"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(cert_file, key_file)
+    # Stateless tickets are encrypted with keys held by the context, so every
+    # worker forked after it is created can resume sessions issued by another
+    context.options &= ~ssl.OP_NO_TICKET
+    context.num_tickets = SESSION_TICKETS
+    return context
+
+
+def client_context(ca_file: str | None = None) -> ssl.SSLContext:
+    """Context for connecting over TLS, trusting ca_file or the system store"""
+    context = ssl.create_default_context(cafile=ca_file)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    return context
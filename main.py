@@ -1,13 +1,32 @@
 import argparse
 from server.server import start_server
+from server.async_server import start_async_server
+from server.cluster import start_cluster
 from client.client import start_client
+from client.scrollback import DEFAULT_SCROLLBACK_LINES
 from common.constants import DEFAULT_HOST, DEFAULT_SERVER_HOST, DEFAULT_PORT
+from common.protocol import DEFAULT_COMPRESS_THRESHOLD
+from server.outbound import (
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_POLICY,
+    SLOW_CONSUMER_POLICIES,
+    BLOCK,
+    DEFAULT_COALESCE_BYTES,
+    DEFAULT_COALESCE_DELAY,
+)
+from server.logger import logger, LEVELS
+from server.ring import DEFAULT_BACKFILL_SIZE
+from server.session import DEFAULT_RESUME_GRACE
+from server.ratelimit import DEFAULT_ACCEPT_RATE, DEFAULT_ACCEPT_BURST
+from bench.load import run_load_benchmark, HANDSHAKES, DEFAULT_HANDSHAKE
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="TCP Socket Chat Application CLI")
     parser.add_argument(
-        "mode", choices=["server", "client"], help="Run as server or client"
+        "mode",
+        choices=["server", "client", "bench"],
+        help="Run as server or client, or benchmark a local server",
     )
     parser.add_argument(
         "--host", default=None, help="Specify host (default: server/client default)"
@@ -15,6 +34,134 @@ def main() -> None:
     parser.add_argument(
         "--port", type=int, default=DEFAULT_PORT, help="Specify port (default: 5000)"
     )
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "asyncio"],
+        default="threads",
+        help="Server engine: one thread per client or a single asyncio event loop (default: threads)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Server worker processes sharing the port, threads engine only (default: 1)",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help=f"Outbound frames buffered per client (default: {DEFAULT_QUEUE_SIZE})",
+    )
+    parser.add_argument(
+        "--slow-consumer",
+        choices=SLOW_CONSUMER_POLICIES,
+        default=DEFAULT_POLICY,
+        help=f"What to do when a client's outbound queue is full (default: {DEFAULT_POLICY})",
+    )
+    parser.add_argument(
+        "--coalesce-bytes",
+        type=int,
+        default=DEFAULT_COALESCE_BYTES,
+        help=f"Most bytes of queued frames written to a client in one call (default: {DEFAULT_COALESCE_BYTES})",
+    )
+    parser.add_argument(
+        "--coalesce-delay",
+        type=float,
+        default=DEFAULT_COALESCE_DELAY,
+        help=f"Seconds a client's writer waits for more frames before writing, e.g. 0.002 (default: {DEFAULT_COALESCE_DELAY:g})",
+    )
+    parser.add_argument(
+        "--compress-threshold",
+        type=int,
+        default=DEFAULT_COMPRESS_THRESHOLD,
+        help=f"Compress frames of at least this many bytes for clients that support it, 0 to disable (default: {DEFAULT_COMPRESS_THRESHOLD})",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve Prometheus metrics on 127.0.0.1:PORT/metrics, workers use PORT+index",
+    )
+    parser.add_argument(
+        "--history-dir",
+        default=None,
+        help="Persist broadcasts in this directory and replay them to returning clients",
+    )
+    parser.add_argument(
+        "--backfill",
+        type=int,
+        default=DEFAULT_BACKFILL_SIZE,
+        help=f"Recent broadcasts sent to each client as it joins, 0 to disable (default: {DEFAULT_BACKFILL_SIZE})",
+    )
+    parser.add_argument(
+        "--resume-grace",
+        type=float,
+        default=None,
+        help=f"Seconds a dropped client can resume its session, 0 to disable (default: {DEFAULT_RESUME_GRACE:g})",
+    )
+    parser.add_argument(
+        "--accept-rate",
+        type=float,
+        default=DEFAULT_ACCEPT_RATE,
+        help=f"Connections each server process accepts per second, 0 for no limit (default: {DEFAULT_ACCEPT_RATE:g})",
+    )
+    parser.add_argument(
+        "--accept-burst",
+        type=int,
+        default=DEFAULT_ACCEPT_BURST,
+        help=f"Connections accepted at once before --accept-rate applies (default: {DEFAULT_ACCEPT_BURST})",
+    )
+    parser.add_argument(
+        "--tls-cert",
+        default=None,
+        help="Server: certificate chain to serve TLS with. Client: certificate or CA bundle to trust, implies --tls",
+    )
+    parser.add_argument(
+        "--tls-key", default=None, help="Server: private key for --tls-cert"
+    )
+    parser.add_argument(
+        "--tls",
+        action="store_true",
+        help="Client: connect over TLS, verifying the server against the system trust store",
+    )
+    parser.add_argument(
+        "--scrollback",
+        type=int,
+        default=DEFAULT_SCROLLBACK_LINES,
+        help=f"Client: lines kept in the chat window, older ones page back in when scrolling up, 0 for no limit (default: {DEFAULT_SCROLLBACK_LINES})",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=LEVELS,
+        default="info",
+        help="Server log level, debug also logs every message routed (default: info)",
+    )
+
+    # Benchmark options
+    parser.add_argument(
+        "--clients", type=int, default=100, help="Bench: simulated clients (default: 100)"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="Bench: seconds to send for (default: 10)"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=1.0, help="Bench: messages per second per client (default: 1)"
+    )
+    parser.add_argument(
+        "--dm-ratio", type=float, default=0.1, help="Bench: fraction of messages sent as DMs (default: 0.1)"
+    )
+    parser.add_argument(
+        "--message-size", type=int, default=64, help="Bench: message body length (default: 64)"
+    )
+    parser.add_argument(
+        "--handshake",
+        choices=HANDSHAKES,
+        default=DEFAULT_HANDSHAKE,
+        help=f"Bench: how clients log in, client sends the same hello as the chat client, no-compression leaves compression out of it, legacy sends no hello (default: {DEFAULT_HANDSHAKE})",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Bench: print results as a single JSON line"
+    )
 
     args = parser.parse_args()
     host = (
@@ -23,10 +170,95 @@ def main() -> None:
         else (DEFAULT_SERVER_HOST if args.mode == "server" else DEFAULT_HOST)
     )
 
+    if args.workers > 1 and args.engine != "threads":
+        parser.error("--workers is only supported with --engine threads")
+    if args.history_dir and (args.workers > 1 or args.engine != "threads"):
+        parser.error("--history-dir is only supported by a single threads engine server")
+    # Sessions live in one threads engine process, any explicit value elsewhere is an error
+    if args.resume_grace is not None and (args.workers > 1 or args.engine != "threads"):
+        parser.error("--resume-grace is only supported by a single threads engine server")
+    if args.resume_grace is None:
+        args.resume_grace = DEFAULT_RESUME_GRACE
+    if args.engine == "asyncio":
+        # Settings only the threads engine implements
+        for flag, value, default in (
+            ("--accept-rate", args.accept_rate, DEFAULT_ACCEPT_RATE),
+            ("--accept-burst", args.accept_burst, DEFAULT_ACCEPT_BURST),
+            ("--coalesce-bytes", args.coalesce_bytes, DEFAULT_COALESCE_BYTES),
+            ("--coalesce-delay", args.coalesce_delay, DEFAULT_COALESCE_DELAY),
+        ):
+            if value != default:
+                parser.error(f"{flag} is only supported with --engine threads")
+        if args.slow_consumer == BLOCK:
+            parser.error(f"--slow-consumer {BLOCK} is only supported with --engine threads")
+    if args.mode == "server" and bool(args.tls_cert) != bool(args.tls_key):
+        parser.error("--tls-cert and --tls-key must be given together")
+
     if args.mode == "server":
-        start_server(host, args.port)
+        logger.set_level(LEVELS[args.log_level])
+        if args.workers > 1:
+            start_cluster(
+                host,
+                args.port,
+                args.workers,
+                args.queue_size,
+                args.slow_consumer,
+                args.metrics_port,
+                args.backfill,
+                args.accept_rate,
+                args.accept_burst,
+                args.coalesce_bytes,
+                args.coalesce_delay,
+                args.compress_threshold,
+                args.tls_cert,
+                args.tls_key,
+            )
+        elif args.engine == "asyncio":
+            start_async_server(
+                host,
+                args.port,
+                args.queue_size,
+                args.slow_consumer,
+                args.metrics_port,
+                args.backfill,
+                args.compress_threshold,
+                args.tls_cert,
+                args.tls_key,
+            )
+        else:
+            start_server(
+                host,
+                args.port,
+                args.queue_size,
+                args.slow_consumer,
+                args.metrics_port,
+                args.history_dir,
+                args.backfill,
+                args.resume_grace,
+                args.accept_rate,
+                args.accept_burst,
+                args.coalesce_bytes,
+                args.coalesce_delay,
+                args.compress_threshold,
+                args.tls_cert,
+                args.tls_key,
+            )
+    elif args.mode == "bench":
+        run_load_benchmark(
+            host,
+            args.port,
+            args.clients,
+            args.duration,
+            args.rate,
+            args.dm_ratio,
+            args.message_size,
+            args.engine,
+            args.workers,
+            args.json,
+            args.handshake,
+        )
     else:
-        start_client(host, args.port)
+        start_client(host, args.port, args.tls, args.tls_cert, args.scrollback)
 
 
 if __name__ == "__main__":
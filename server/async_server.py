@@ -0,0 +1,643 @@
+"""
+Asyncio Chat Server Implementation
+Single-threaded server engine built on asyncio streams
+"""
+
+import asyncio
+import ssl
+import time
+from collections import deque
+from common.constants import (
+    DEFAULT_SERVER_HOST,
+    DEFAULT_PORT,
+    LISTEN_BACKLOG,
+    ERROR_MESSAGE,
+    WARNING_MESSAGE,
+    INFO_MESSAGE,
+    SUCCESS_MESSAGE,
+    ANNOUNCEMENT,
+    DM_FROM,
+    DM_TO,
+    DM_PREFIX,
+    ROOM_PREFIX,
+    ROOM_MESSAGE,
+    COMMAND_PREFIX,
+)
+from common.tls import server_context
+from common.protocol import (
+    FrameDecoder,
+    ProtocolError,
+    RECV_BUFFER_SIZE,
+    FRAME_LOGIN,
+    FRAME_TEXT,
+    FRAME_COMPRESS,
+    FRAME_HELLO,
+    FRAME_HELLO_ACK,
+    FRAME_HISTORY_REQUEST,
+    FRAME_RESUME,
+    PROTOCOL_VERSION,
+    MIN_PROTOCOL_VERSION,
+    CAP_COMPRESSION,
+    LEGACY_CAPABILITIES,
+    COMPRESSION_ZLIB,
+    DEFAULT_COMPRESS_THRESHOLD,
+    encode_frame,
+    encode_text,
+    encode_hello,
+    decode_hello,
+    decode_resume,
+    compress_frames,
+)
+from server.metrics import MetricsRegistry, MetricsServer
+from server.outbound import DEFAULT_QUEUE_SIZE, DEFAULT_POLICY, DROP_OLDEST, DISCONNECT
+from server.registry import UserRegistry
+from server.ring import FrameRing, DEFAULT_BACKFILL_SIZE
+from server.rooms import Room, RoomRegistry
+from server.logger import logger
+
+# Seconds a new connection has to send its username
+LOGIN_TIMEOUT = 5.0
+
+# Bytes buffered in a client's transport before further frames are held back in
+# its backlog, where the server's queue size and slow-consumer policy apply
+WRITE_BUFFER_LIMIT = 64 * 1024
+
+
+class AsyncClientHandler:
+    """Handles communication with a single client on the event loop"""
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        server: "AsyncChatServer",
+    ) -> None:
+        """Initialize the handler for an accepted connection"""
+        self.reader = reader
+        self.writer = writer
+        self.server = server
+        self.addr = writer.get_extra_info("peername")
+        self.username = None
+        # Features agreed in the handshake, and whether large frames are sent compressed
+        self.capabilities = LEGACY_CAPABILITIES & server.capabilities()
+        self.compression = False
+
+        # Frames waiting for the transport to drain, and the task handing them over
+        self.writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_LIMIT)
+        self.backlog = deque()
+        self.flush_task = None
+
+        # Incremental frame decoder and frames already decoded but not yet handled
+        self.decoder = FrameDecoder()
+        self.pending_frames = deque()
+
+    async def handle(self) -> None:
+        """Main coroutine to handle the client connection"""
+        try:
+            # First message should be the username
+            frame = await asyncio.wait_for(self.receive_frame(), LOGIN_TIMEOUT)
+            if frame is not None and frame[0] == FRAME_HELLO:
+                if not self.hello(frame[1]):
+                    return
+                frame = await asyncio.wait_for(self.receive_frame(), LOGIN_TIMEOUT)
+            elif frame is not None and frame[0] == FRAME_COMPRESS:
+                # Compression offer from clients that predate the hello
+                self.negotiate_compression(frame[1])
+                frame = await asyncio.wait_for(self.receive_frame(), LOGIN_TIMEOUT)
+            # Returning clients may ask for what they missed, but broadcasts are
+            # not numbered and sessions are not kept here, so they just log in
+            if frame is not None and frame[0] == FRAME_HISTORY_REQUEST:
+                frame = await asyncio.wait_for(self.receive_frame(), LOGIN_TIMEOUT)
+            elif frame is not None and frame[0] == FRAME_RESUME:
+                _, _, username = decode_resume(frame[1])
+                frame = (FRAME_LOGIN, username.encode("utf-8"))
+            if frame is None:
+                return
+            frame_type, payload = frame
+            if frame_type != FRAME_LOGIN:
+                self.send(f"{ERROR_MESSAGE}: Expected login before any other message.")
+                return
+            self.username = payload.decode("utf-8").strip()
+
+            # Claim the username and store client info in a single step
+            if not self.server.registry.reserve(self.username, self, self.addr):
+                self.send(
+                    f"{ERROR_MESSAGE}: Username '{self.username}' is already in use. Please choose another."
+                )
+                return
+
+            # Send current user list and what was said recently to the new client
+            self.send_welcome_message()
+            self.send_backfill()
+
+            # Announce new user
+            self.server.broadcast_message(
+                f"{ANNOUNCEMENT}: @{self.username} has joined the chat.",
+                exclude=self,
+            )
+            logger.info(f"{self.username} ({self.addr[0]}:{self.addr[1]}) connected.")
+
+            # Handle messages from this client
+            await self.message_loop()
+
+        except asyncio.TimeoutError:
+            logger.info(
+                f"Client at {self.addr[0]}:{self.addr[1]} timed out during login"
+            )
+        except ProtocolError as e:
+            logger.error(f"Protocol error from {self.addr[0]}:{self.addr[1]}: {e}")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.error(f"Exception during client handling: {e}")
+        finally:
+            # Client disconnected, clean up
+            await self.handle_disconnect()
+
+    def hello(self, payload: bytes) -> bool:
+        """Agree on a protocol version and capabilities, False if the client is too old"""
+        version, capabilities = decode_hello(payload)
+        if version < MIN_PROTOCOL_VERSION:
+            self.send(f"{ERROR_MESSAGE}: Protocol version {version} is no longer supported.")
+            return False
+        self.capabilities = capabilities & self.server.capabilities()
+        self.compression = bool(self.capabilities & CAP_COMPRESSION)
+        self.send_frame(
+            encode_hello(
+                self.capabilities, min(version, PROTOCOL_VERSION), FRAME_HELLO_ACK
+            )
+        )
+        return True
+
+    def negotiate_compression(self, offer: bytes) -> None:
+        """Pick a compression the client offered and tell it which one, if any"""
+        self.compression = self.server.accepts_compression(offer)
+        self.send_frame(
+            encode_frame(FRAME_COMPRESS, COMPRESSION_ZLIB if self.compression else b"")
+        )
+
+    def send_welcome_message(self) -> None:
+        """Send welcome message with current user list to the client"""
+        user_list = "Current users: " + ", ".join(self.server.registry.names())
+        self.send(f"{SUCCESS_MESSAGE}: Welcome, {self.username}! {user_list}")
+
+    def send_backfill(self) -> None:
+        """Write the recent broadcasts as a single buffer"""
+        backfill = self.server.recent.snapshot()
+        if backfill:
+            self.send_frame(backfill)
+
+    def send(self, message: str) -> None:
+        """Queue a single framed text message for this client"""
+        self.send_frame(self.server.encode(message))
+
+    def send_frame(self, frame: bytes, compressed: bytes | None = None) -> None:
+        """Queue an already encoded frame, applying the slow-consumer policy"""
+        if self.compression and len(frame) >= self.server.compress_threshold:
+            # A broadcast is compressed once and shared by every recipient
+            frame = compressed or self.server.compress(frame)
+        if self.writer.is_closing():
+            return
+        transport = self.writer.transport
+        if not self.backlog and transport.get_write_buffer_size() < WRITE_BUFFER_LIMIT:
+            self.write([frame])
+            return
+
+        # The client is not keeping up, hold the frame back in the bounded backlog
+        if len(self.backlog) >= self.server.queue_size:
+            if self.server.slow_consumer == DROP_OLDEST:
+                self.backlog.popleft()
+                self.server.frames_dropped.inc()
+            else:
+                # Disconnect the slow consumer, discarding what it never read
+                logger.warning(f"Disconnecting slow consumer {self.addr[0]}:{self.addr[1]}")
+                self.backlog.clear()
+                transport.abort()
+                return
+        self.backlog.append(frame)
+        if self.flush_task is None:
+            self.flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    def write(self, frames: list[bytes]) -> None:
+        """Hand frames to the transport and account for them"""
+        # write() rather than writelines(), which does not pause the protocol
+        # on the selector transport so drain() would never wait
+        for frame in frames:
+            self.writer.write(frame)
+        self.server.frames_sent.inc(len(frames))
+        self.server.bytes_sent.inc(sum(map(len, frames)))
+
+    async def flush(self) -> None:
+        """Move the backlog to the transport each time its write buffer drains"""
+        try:
+            while self.backlog:
+                await self.writer.drain()
+                frames = list(self.backlog)
+                self.backlog.clear()
+                if self.writer.is_closing():
+                    break
+                self.write(frames)
+        except ConnectionError:
+            self.backlog.clear()
+        finally:
+            self.flush_task = None
+
+    async def receive_frame(self) -> tuple[int, bytes] | None:
+        """Return the next complete frame from the client, or None on disconnect"""
+        while not self.pending_frames:
+            data = await self.reader.read(RECV_BUFFER_SIZE)
+            if not data:
+                return None
+            self.server.bytes_received.inc(len(data))
+            self.pending_frames.extend(self.decoder.feed(data))
+        return self.pending_frames.popleft()
+
+    async def message_loop(self) -> None:
+        """Handle incoming messages from the client"""
+        while True:
+            frame = await self.receive_frame()
+            if frame is None:
+                # Client disconnected
+                break
+
+            self.server.messages_received.inc()
+            frame_type, payload = frame
+            if frame_type == FRAME_TEXT:
+                self.process_message(payload.decode("utf-8"))
+
+    def process_message(self, message: str) -> None:
+        """Process a message from the client"""
+        # Check for direct message
+        if message.startswith(DM_PREFIX):
+            # Extract target username and message
+            parts = message[1:].split(" ", 1)
+            if len(parts) > 1:
+                target_username, dm_message = parts
+                # Message bodies are never logged
+                if __debug__ and logger.debug_enabled:
+                    logger.debug(f"DM from {self.username} to {target_username}")
+                normalize = self.server.registry.normalize
+                if normalize(target_username) != normalize(self.username):
+                    self.send_direct_message(target_username, dm_message)
+                else:
+                    # Sending a DM to oneself is not allowed
+                    self.send(f"{WARNING_MESSAGE}: You cannot DM yourself.")
+            else:
+                self.send(
+                    f"{WARNING_MESSAGE}: Invalid DM format. Use '@username message'"
+                )
+        elif message.startswith(ROOM_PREFIX):
+            # Room message, only members of the room receive it
+            parts = message[1:].split(" ", 1)
+            if len(parts) > 1:
+                self.send_room_message(parts[0], parts[1])
+            else:
+                self.send(
+                    f"{WARNING_MESSAGE}: Invalid room message format. Use '#room message'"
+                )
+        elif message.startswith(COMMAND_PREFIX):
+            self.process_command(message[1:])
+        else:
+            # Regular message - broadcast to all
+            self.server.broadcast_message(f"@{self.username}: {message}")
+
+    def process_command(self, command: str) -> None:
+        """Handle a /join, /leave or /rooms command"""
+        name, _, argument = command.partition(" ")
+        room_name = argument.strip().removeprefix(ROOM_PREFIX)
+        name = name.lower()
+        if name == "join" and room_name:
+            self.join_room(room_name)
+        elif name == "leave" and room_name:
+            self.leave_room(room_name)
+        elif name == "rooms":
+            self.send_room_list()
+        else:
+            self.send(
+                f"{WARNING_MESSAGE}: Unknown command. Use '/join room', '/leave room' or '/rooms'"
+            )
+
+    def join_room(self, room_name: str) -> None:
+        """Add this client to a room and send it the room's recent messages"""
+        rooms = self.server.rooms
+        if not rooms.valid_name(room_name):
+            self.send(
+                f"{WARNING_MESSAGE}: Room names are 1 to 32 letters, digits, '_' or '-'."
+            )
+            return
+        room = rooms.join(room_name, self, self.send_frame)
+        if room is None:
+            self.send(f"{WARNING_MESSAGE}: You are already in #{room_name}.")
+            return
+        # Members, including this client, see the join in the room
+        self.server.room_message(
+            room, f"{ROOM_MESSAGE}{room.name}]: @{self.username} has joined the room."
+        )
+
+    def leave_room(self, room_name: str) -> None:
+        """Remove this client from a room"""
+        room = self.server.rooms.leave(room_name, self)
+        if room is None:
+            self.send(f"{WARNING_MESSAGE}: You are not in #{room_name}.")
+            return
+        self.send(f"{INFO_MESSAGE}: You left #{room.name}.")
+        self.server.room_message(
+            room, f"{ROOM_MESSAGE}{room.name}]: @{self.username} has left the room."
+        )
+
+    def send_room_list(self) -> None:
+        """Send the rooms with their member counts and the rooms this client is in"""
+        rooms = self.server.rooms
+        listing = rooms.listing()
+        if not listing:
+            self.send(f"{INFO_MESSAGE}: No rooms yet. Use '/join room' to create one.")
+            return
+        summary = ", ".join(f"#{name} ({count})" for name, count in listing)
+        joined = ", ".join(f"#{name}" for name in rooms.rooms_of(self))
+        self.send(f"{INFO_MESSAGE}: Rooms: {summary}. You are in: {joined or 'none'}")
+
+    def send_room_message(self, room_name: str, message: str) -> bool:
+        """Send a message to every member of a room this client is in"""
+        room = self.server.rooms.lookup(room_name, self)
+        if room is None:
+            self.send(
+                f"{WARNING_MESSAGE}: You are not in #{room_name}. Use '/join {room_name}' first."
+            )
+            return False
+        # Message bodies are never logged
+        if __debug__ and logger.debug_enabled:
+            logger.debug(f"Room message from {self.username} to #{room.name}")
+        self.server.room_message(
+            room, f"{ROOM_MESSAGE}{room.name}] @{self.username}: {message}"
+        )
+        return True
+
+    def send_direct_message(self, target_username: str, message: str) -> bool:
+        """Send a direct message to a specific user"""
+        target = self.server.registry.lookup(target_username)
+        if target is None:
+            self.send(f"{WARNING_MESSAGE}: User '{target_username}' not found.")
+            return False
+
+        target.send(f"{DM_FROM} {self.username}]: {message}")
+        # Also send confirmation to the sender
+        self.send(f"{DM_TO} {target.username}]: {message}")
+        return True
+
+    async def handle_disconnect(self) -> None:
+        """Handle client disconnection"""
+        registered = self.server.registry.release(self) is not None
+        self.server.rooms.leave_all(self)
+
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+
+        if registered:
+            self.server.broadcast_message(
+                f"{INFO_MESSAGE}: @{self.username} has left the chat."
+            )
+            logger.info(
+                f"@{self.username} ({self.addr[0]}:{self.addr[1]}) disconnected."
+            )
+
+
+class AsyncChatServer:
+    """Chat server that multiplexes every client on a single asyncio event loop"""
+
+    def __init__(
+        self,
+        host: str = DEFAULT_SERVER_HOST,
+        port: int = DEFAULT_PORT,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        slow_consumer: str = DEFAULT_POLICY,
+        metrics_port: int | None = None,
+        backfill: int = DEFAULT_BACKFILL_SIZE,
+        compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD,
+        tls: ssl.SSLContext | None = None,
+    ):
+        """Initialize the server with host, port and outbound backlog settings"""
+        # The event loop cannot wait for a slow consumer, only drop frames or the client
+        if slow_consumer not in (DROP_OLDEST, DISCONNECT):
+            raise ValueError(f"Slow-consumer policy not supported by the asyncio engine: {slow_consumer}")
+        self.host = host
+        self.port = port
+        # Frames held back per client once its transport buffer is full
+        self.queue_size = queue_size
+        self.slow_consumer = slow_consumer
+        # Frames of at least this many bytes are compressed for clients that
+        # negotiated it, 0 turns compression off
+        self.compress_threshold = compress_threshold
+        # Connections are wrapped in TLS when a server context is given
+        self.tls = tls
+        self.server = None
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+
+        # Only touched from the event loop, the registry lock is never contended
+        self.registry = UserRegistry()
+        self.active_clients = self.registry.active_clients
+        # Recent broadcast frames sent to every client as it joins
+        self.recent = FrameRing(backfill)
+        # Rooms and their members, who are AsyncClientHandlers
+        self.rooms = RoomRegistry(backfill)
+
+        self.metrics = MetricsRegistry()
+        self.register_metrics()
+        # Every connection, including ones that never log in
+        self.connections_open = set()
+
+    def register_metrics(self) -> None:
+        """Create the counters, gauges and histograms updated on the hot path"""
+        metrics = self.metrics
+        self.connections = metrics.counter(
+            "chat_connections_total", "Client connections accepted"
+        )
+        self.tls_handshakes = metrics.counter(
+            "chat_tls_handshakes_total", "TLS handshakes completed"
+        )
+        self.tls_resumed = metrics.counter(
+            "chat_tls_sessions_resumed_total",
+            "TLS handshakes that resumed an earlier session from a ticket",
+        )
+        metrics.gauge(
+            "chat_connections_active",
+            "Open client connections",
+            lambda: len(self.connections_open),
+        )
+        metrics.gauge("chat_users_active", "Logged-in users", lambda: len(self.registry))
+        metrics.gauge("chat_rooms_active", "Rooms with members", lambda: len(self.rooms))
+        self.messages_received = metrics.counter(
+            "chat_messages_received_total", "Frames received from clients"
+        )
+        self.frames_sent = metrics.counter(
+            "chat_frames_sent_total", "Frames handed to client transports"
+        )
+        self.frames_dropped = metrics.counter(
+            "chat_frames_dropped_total", "Frames dropped by the drop_oldest policy"
+        )
+        self.bytes_received = metrics.counter(
+            "chat_bytes_received_total", "Bytes read from client sockets"
+        )
+        # Bytes produced by encoding vs. bytes handed to transports
+        self.bytes_encoded = metrics.counter(
+            "chat_bytes_encoded_total", "Bytes produced by encoding outgoing frames"
+        )
+        self.bytes_sent = metrics.counter(
+            "chat_bytes_sent_total", "Bytes handed to client transports"
+        )
+        self.bytes_uncompressed = metrics.counter(
+            "chat_compression_input_bytes_total", "Bytes of frames passed to compression"
+        )
+        self.bytes_compressed = metrics.counter(
+            "chat_compression_output_bytes_total", "Bytes produced by compressing frames"
+        )
+        self.fanout_time = metrics.histogram(
+            "chat_broadcast_fanout_seconds",
+            "Time to queue one broadcast for every recipient",
+        )
+        metrics.gauge(
+            "chat_outbound_buffered_bytes",
+            "Bytes waiting in all transport write buffers",
+            lambda: sum(
+                handler.writer.transport.get_write_buffer_size()
+                for handler in list(self.connections_open)
+            ),
+        )
+
+    async def start(self) -> None:
+        """Start the server and serve until cancelled"""
+        self.server = await asyncio.start_server(
+            self.handle_connection,
+            self.host,
+            self.port,
+            backlog=LISTEN_BACKLOG,
+            ssl=self.tls,
+            ssl_handshake_timeout=LOGIN_TIMEOUT if self.tls else None,
+        )
+        logger.info(
+            f"Server started on {self.host}:{self.port} (asyncio engine"
+            f"{', TLS' if self.tls else ''})"
+        )
+        if self.metrics_port:
+            self.metrics_server = MetricsServer(self.metrics, self.metrics_port)
+            self.metrics_server.start()
+
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            self.stop()
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Entry point for every accepted connection"""
+        self.connections.inc()
+        # The transport has already completed the TLS handshake
+        ssl_object = writer.get_extra_info("ssl_object")
+        if ssl_object is not None:
+            self.tls_handshakes.inc()
+            if ssl_object.session_reused:
+                self.tls_resumed.inc()
+        handler = AsyncClientHandler(reader, writer, self)
+        self.connections_open.add(handler)
+        try:
+            await handler.handle()
+        finally:
+            self.connections_open.discard(handler)
+
+    def encode(self, message: str) -> bytes:
+        """Encode a text message into a frame and account for the bytes produced"""
+        frame = encode_text(message)
+        self.bytes_encoded.inc(len(frame))
+        return frame
+
+    def capabilities(self) -> int:
+        """Capability flags this server offers in the handshake, it cannot resume sessions"""
+        return CAP_COMPRESSION if self.compress_threshold else 0
+
+    def accepts_compression(self, offer: bytes) -> bool:
+        """Whether to compress for a client offering these comma-separated methods"""
+        return bool(self.compress_threshold) and COMPRESSION_ZLIB in offer.split(b",")
+
+    def compress(self, frame: bytes) -> bytes:
+        """Compressed form of one or more encoded frames, accounting for the bytes saved"""
+        compressed = compress_frames(frame)
+        self.bytes_uncompressed.inc(len(frame))
+        self.bytes_compressed.inc(len(compressed))
+        return compressed
+
+    def fan_out(self, frame: bytes, recipients, exclude=None) -> None:
+        """Send an encoded frame to every recipient except exclude, compressing it at most once"""
+        start = time.perf_counter()
+        compressed = None
+        large = self.compress_threshold and len(frame) >= self.compress_threshold
+        for handler in recipients:
+            if handler is exclude:
+                continue
+            if large and compressed is None and handler.compression:
+                compressed = self.compress(frame)
+            handler.send_frame(frame, compressed)
+        self.fanout_time.observe(time.perf_counter() - start)
+
+    def broadcast_message(self, message: str, exclude=None) -> None:
+        """Send message to all clients except the excluded one"""
+        # Encode once and share the same immutable frame with every recipient
+        frame = self.encode(message)
+        self.recent.append(frame)
+        if __debug__ and logger.debug_enabled:
+            logger.debug(f"Broadcast to {len(self.active_clients)} clients")
+        self.fan_out(frame, self.active_clients, exclude)
+
+    def room_message(self, room: Room, message: str) -> None:
+        """Send message to the members of room only, encoded once for all of them"""
+        frame = self.encode(message)
+        room.recent.append(frame)
+        if __debug__ and logger.debug_enabled:
+            logger.debug(f"Room message to {len(room.members)} members of #{room.name}")
+        self.fan_out(frame, room.members)
+
+    def stop(self) -> None:
+        """Stop accepting connections and close all clients, must run on the loop"""
+        for handler in list(self.active_clients):
+            handler.writer.close()
+        if self.server:
+            self.server.close()
+        if self.metrics_server:
+            self.metrics_server.stop()
+
+        logger.info(
+            f"Bytes encoded: {self.bytes_encoded.value}, bytes sent: {self.bytes_sent.value}"
+        )
+        logger.info("Server closed.")
+
+
+def start_async_server(
+    host: str = DEFAULT_SERVER_HOST,
+    port: int = DEFAULT_PORT,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    slow_consumer: str = DEFAULT_POLICY,
+    metrics_port: int | None = None,
+    backfill: int = DEFAULT_BACKFILL_SIZE,
+    compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD,
+    tls_cert: str | None = None,
+    tls_key: str | None = None,
+) -> None:
+    """Start the asyncio chat server with the specified host and port"""
+    tls = server_context(tls_cert, tls_key) if tls_cert else None
+    server = AsyncChatServer(
+        host, port, queue_size, slow_consumer, metrics_port, backfill, compress_threshold, tls
+    )
+
+    try:
+        asyncio.run(server.start())
+    except KeyboardInterrupt:
+        # The serving task has already been cancelled and cleaned up by stop()
+        pass
+
+
+if __name__ == "__main__":
+    start_async_server()
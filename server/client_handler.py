@@ -4,7 +4,9 @@ Handles the communication with a single client
 """
 
 import socket
+import ssl
 import threading
+from collections import deque
 from common.constants import (
     ERROR_MESSAGE,
     WARNING_MESSAGE,
@@ -14,7 +16,36 @@ from common.constants import (
     DM_FROM,
     DM_TO,
     DM_PREFIX,
+    ROOM_PREFIX,
+    ROOM_MESSAGE,
+    COMMAND_PREFIX,
 )
+from common.protocol import (
+    FrameDecoder,
+    ProtocolError,
+    RECV_BUFFER_SIZE,
+    FRAME_LOGIN,
+    FRAME_TEXT,
+    FRAME_HISTORY_REQUEST,
+    FRAME_SESSION,
+    FRAME_RESUME,
+    FRAME_COMPRESS,
+    FRAME_HELLO,
+    FRAME_HELLO_ACK,
+    PROTOCOL_VERSION,
+    MIN_PROTOCOL_VERSION,
+    CAP_COMPRESSION,
+    LEGACY_CAPABILITIES,
+    encode_frame,
+    encode_hello,
+    decode_hello,
+    decode_sequenced,
+    decode_resume,
+    COMPRESSION_ZLIB,
+)
+from server.logger import logger
+from server.outbound import OutboundQueue
+from server.session import Session
 
 
 class ClientHandler:
@@ -24,114 +55,290 @@ class ClientHandler:
         self,
         client_socket: socket.socket,
         addr: tuple[str, int],
-        active_clients: dict[socket.socket, tuple[str, tuple[str, int]]],
-        clients_lock: threading.Lock,
-        broadcast_func: callable,
+        server: "ChatServer",
     ) -> None:
         """Initialize the client handler"""
         self.client_socket = client_socket
         self.addr = addr
-        self.active_clients = active_clients
-        self.clients_lock = clients_lock
-        self.broadcast_message = broadcast_func
+        self.server = server
+        self.active_clients = server.active_clients
+        self.clients_lock = server.clients_lock
+        self.registry = server.registry
+        self.broadcast_message = server.broadcast_message
+        self.reaper = server.reaper
         self.username = None
         self.running = True
+        # Resumable session, and whether the connection broke rather than closed
+        self.session = None
+        self.broken = False
+        # Features agreed in the handshake, and whether large frames are sent compressed
+        self.capabilities = LEGACY_CAPABILITIES & server.capabilities()
+        self.compression = False
+
+        # Outgoing frames are queued here and written by a dedicated writer thread
+        self.outbound = OutboundQueue(
+            server.queue_size, server.slow_consumer, drop_counter=server.frames_dropped
+        )
+        self.writer_thread = None
+        # SSLSocket cannot sendmsg(), TLS batches are joined into one buffer instead
+        self.tls = isinstance(client_socket, ssl.SSLSocket)
+        self.scatter_gather = hasattr(client_socket, "sendmsg") and not self.tls
+
+        # Incremental frame decoder and frames already decoded but not yet handled
+        self.decoder = FrameDecoder()
+        self.pending_frames = deque()
 
     def handle(self) -> None:
         """Main method to handle client connection"""
+        self.start_writer()
         try:
-            # First message should be the username
+            # First message should be the hello, or the username from older clients
             self.client_socket.settimeout(
                 5.0
             )  # Set timeout for initial username reception
-            username_message = self.client_socket.recv(1024).decode("utf-8")
-            self.username = username_message.strip()
+            if self.tls:
+                self.handshake()
+            frame = self.receive_frame()
+            if frame is not None and frame[0] == FRAME_HELLO:
+                if not self.hello(frame[1]):
+                    return
+                frame = self.receive_frame()
+            elif frame is not None and frame[0] == FRAME_COMPRESS:
+                # Compression offer from clients that predate the hello
+                self.negotiate_compression(frame[1])
+                frame = self.receive_frame()
+            # A returning client may ask for the history it missed before logging in
+            replay_after = None
+            if frame is not None and frame[0] == FRAME_HISTORY_REQUEST:
+                replay_after, _ = decode_sequenced(frame[1])
+                frame = self.receive_frame()
+            elif frame is not None and frame[0] == FRAME_RESUME:
+                replay_after, token, username = decode_resume(frame[1])
+                if self.server.resume(self, token, replay_after):
+                    self.client_socket.settimeout(None)
+                    logger.info(
+                        f"@{self.username} ({self.addr[0]}:{self.addr[1]}) resumed its session."
+                    )
+                    self.message_loop()
+                    return
+                # The session expired, log in afresh instead
+                frame = (FRAME_LOGIN, username.encode("utf-8"))
+            if frame is None:
+                return
+            frame_type, payload = frame
+            if frame_type != FRAME_LOGIN:
+                self.send(f"{ERROR_MESSAGE}: Expected login before any other message.")
+                return
+            self.username = payload.decode("utf-8").strip()
 
             # Reset timeout for normal operation
             self.client_socket.settimeout(None)
 
-            # Check if username is already in use
-            username_in_use = False
-            with self.clients_lock:
-                for _, (existing_username, _) in self.active_clients.items():
-                    if existing_username.lower() == self.username.lower():
-                        username_in_use = True
-                        break
-
-            if username_in_use:
-                self.client_socket.send(
-                    f"{ERROR_MESSAGE}: Username '{self.username}' is already in use. Please choose another.".encode(
-                        "utf-8"
-                    )
+            # Claim the username and store client info in a single step, the
+            # welcome message and backfill are queued ahead of any live broadcast
+            if not self.server.join(self, replay_after):
+                self.send(
+                    f"{ERROR_MESSAGE}: Username '{self.username}' is already in use. Please choose another."
                 )
                 return
 
-            # Store client info
-            with self.clients_lock:
-                self.active_clients[self.client_socket] = (self.username, self.addr)
-
             # Announce new user
             self.broadcast_message(
                 f"{ANNOUNCEMENT}: @{self.username} has joined the chat.",
                 exclude=self.client_socket,
             )
-            print(f"[INFO] {self.username} ({self.addr[0]}:{self.addr[1]}) connected.")
-
-            # Send current user list to the new client
-            self.send_welcome_message()
+            logger.info(f"{self.username} ({self.addr[0]}:{self.addr[1]}) connected.")
 
             # Handle messages from this client
             self.message_loop()
 
         except socket.timeout:
-            print(
-                f"[INFO] Client at {self.addr[0]}:{self.addr[1]} timed out during login"
+            logger.info(
+                f"Client at {self.addr[0]}:{self.addr[1]} timed out during login"
             )
+        except ProtocolError as e:
+            logger.error(f"Protocol error from {self.addr[0]}:{self.addr[1]}: {e}")
+        except ssl.SSLError as e:
+            logger.warning(f"TLS error with {self.addr[0]}:{self.addr[1]}: {e}")
         except Exception as e:
-            print(f"[ERROR] Exception during client handling: {e}")
+            logger.error(f"Exception during client handling: {e}")
         finally:
-            # Client disconnected, clean up
-            self.handle_disconnect()
+            # Client disconnected, let the reaper clean up
+            self.reaper.retire(self)
 
-    def send_welcome_message(self) -> None:
+    def handshake(self) -> None:
+        """Complete the TLS handshake, within the login timeout"""
+        self.client_socket.do_handshake()
+        self.server.tls_handshakes.inc()
+        if self.client_socket.session_reused:
+            self.server.tls_resumed.inc()
+
+    def hello(self, payload: bytes) -> bool:
+        """Agree on a protocol version and capabilities, False if the client is too old"""
+        version, capabilities = decode_hello(payload)
+        if version < MIN_PROTOCOL_VERSION:
+            self.send(f"{ERROR_MESSAGE}: Protocol version {version} is no longer supported.")
+            return False
+        self.capabilities = capabilities & self.server.capabilities()
+        self.compression = bool(self.capabilities & CAP_COMPRESSION)
+        self.send_frame(
+            encode_hello(
+                self.capabilities, min(version, PROTOCOL_VERSION), FRAME_HELLO_ACK
+            )
+        )
+        return True
+
+    def negotiate_compression(self, offer: bytes) -> None:
+        """Pick a compression the client offered and tell it which one, if any"""
+        self.compression = self.server.accepts_compression(offer)
+        self.send_frame(
+            encode_frame(FRAME_COMPRESS, COMPRESSION_ZLIB if self.compression else b"")
+        )
+
+    def send_welcome_message(self, names: list[str], wait: bool = True) -> None:
         """Send welcome message with current user list to the client"""
-        with self.clients_lock:
-            user_list = "Current users: " + ", ".join(
-                [name for name, _ in self.active_clients.values()]
+        user_list = "Current users: " + ", ".join(names)
+
+        self.send(f"{SUCCESS_MESSAGE}: Welcome, {self.username}! {user_list}", wait)
+
+    def send_session_token(self, wait: bool = True) -> None:
+        """Send the token the client can use to resume this session"""
+        self.send_frame(encode_frame(FRAME_SESSION, self.session.token), wait=wait)
+
+    def send_history(self, after_seq: int, wait: bool = True) -> None:
+        """Queue the stored broadcasts numbered after after_seq, up to the replay limit"""
+        history = self.server.history
+        if not history:
+            return
+        if history.last_seq - after_seq > history.replay_limit:
+            self.send(
+                f"{WARNING_MESSAGE}: Only the latest {history.replay_limit} messages are replayed.",
+                wait,
             )
+        # Each chunk is many frames read straight from a segment, no re-encoding
+        for chunk in history.read_since(after_seq):
+            self.send_frame(chunk, wait=wait)
 
+    def send_backfill(self, wait: bool = True) -> None:
+        """Queue the recent broadcasts as a single buffer, written with one send"""
+        backfill = self.server.recent.snapshot()
+        if backfill:
+            self.send_frame(backfill, wait=wait)
+
+    def send(self, message: str, wait: bool = True) -> None:
+        """Queue a single framed text message for this client"""
+        self.send_frame(self.server.encode(message), wait=wait)
+
+    def send_frame(
+        self, frame: bytes, compressed: bytes | None = None, wait: bool = True
+    ) -> None:
+        """Queue an already encoded frame, applying the slow-consumer policy"""
+        # Callers holding a lock other clients need pass wait=False, so the
+        # block policy disconnects a full queue instead of stalling them
+        if self.compression and len(frame) >= self.server.compress_threshold:
+            # A broadcast is compressed once and shared by every recipient
+            frame = compressed or self.server.compress(frame)
+        if not self.outbound.put(frame, wait):
+            self.reaper.retire(self, force=True)
+
+    def close_connection(self) -> None:
+        """Shut the socket down so the reader and writer threads both exit"""
         try:
-            self.client_socket.send(
-                f"{SUCCESS_MESSAGE}: Welcome, {self.username}! {user_list}".encode(
-                    "utf-8"
-                )
-            )
-        except:
+            self.client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
             pass
 
+    def start_writer(self) -> None:
+        """Start the thread that drains the outbound queue"""
+        self.writer_thread = threading.Thread(target=self.writer_loop)
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+
+    def writer_loop(self) -> None:
+        """Write queued frames to the socket until the queue is closed"""
+        server = self.server
+        try:
+            # Frames queued while the previous write was in progress go out together
+            while (
+                batch := self.outbound.get_batch(server.coalesce_bytes, server.coalesce_delay)
+            ) is not None:
+                sent = self.write_frames(batch)
+                server.write_calls.inc()
+                server.writes_saved.inc(len(batch) - 1)
+                server.frames_sent.inc(len(batch))
+                server.bytes_sent.inc(sent)
+        except OSError:
+            # The peer went away, the reaper will wake the reader too
+            self.broken = True
+            self.server.send_errors.inc()
+            self.reaper.retire(self, force=True)
+        finally:
+            self.reaper.wake()
+
+    def write_all(self, data: bytes) -> None:
+        """Write every byte of data, blocking until the kernel accepts it"""
+        self.client_socket.sendall(data)
+
+    def write_frames(self, frames: list[bytes]) -> int:
+        """Write a batch of frames with as few syscalls as possible, return the bytes written"""
+        if len(frames) == 1:
+            self.write_all(frames[0])
+            return len(frames[0])
+        if not self.scatter_gather:
+            data = b"".join(frames)
+            self.write_all(data)
+            return len(data)
+
+        # Scatter-gather straight from the queued frames, no copy into one buffer
+        buffers = deque(memoryview(frame) for frame in frames)
+        total = 0
+        while buffers:
+            sent = self.client_socket.sendmsg(buffers)
+            total += sent
+            # Drop what the kernel took and retry the rest of a partial write
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers.popleft())
+            if sent:
+                buffers[0] = buffers[0][sent:]
+        return total
+
+    def receive_frame(self) -> tuple[int, bytes] | None:
+        """Return the next complete frame from the client, or None on disconnect"""
+        while not self.pending_frames:
+            data = self.client_socket.recv(RECV_BUFFER_SIZE)
+            if not data:
+                return None
+            self.server.bytes_received.inc(len(data))
+            # A single recv may complete several frames, or none at all
+            self.pending_frames.extend(self.decoder.feed(data))
+        return self.pending_frames.popleft()
+
     def message_loop(self) -> None:
         """Handle incoming messages from the client"""
         while self.running:
             try:
-                # Set a timeout to allow checking if we're still running
-                self.client_socket.settimeout(0.5)
-                message = self.client_socket.recv(1024).decode("utf-8")
+                # Block until data arrives, shutdown() by the reaper or
+                # ChatServer.stop() wakes this up on disconnect
+                frame = self.receive_frame()
 
-                if not message:
+                if frame is None:
                     # Client disconnected
                     break
 
-                # Process the message
-                self.process_message(message)
+                self.server.messages_received.inc()
+                frame_type, payload = frame
+                if frame_type == FRAME_TEXT:
+                    # Process the message
+                    self.process_message(payload.decode("utf-8"))
+                elif frame_type == FRAME_HISTORY_REQUEST:
+                    self.send_history(decode_sequenced(payload)[0])
 
-            except socket.timeout:
-                # This is expected due to the timeout we set
-                continue
-            except ConnectionResetError:
-                # Client connection was reset
+            except OSError:
+                # Client connection was reset or timed out
+                self.broken = True
                 break
             except Exception as e:
-                print(f"[ERROR] Exception with {self.username}: {e}")
+                logger.error(f"Exception with {self.username}: {e}")
                 break
 
         self.running = False
@@ -145,90 +352,184 @@ class ClientHandler:
             if len(parts) > 1:
                 target_username = parts[0]
                 dm_message = parts[1]
-                print(
-                    f"[INFO] DM from {self.username} to {target_username}: {dm_message}"
-                )
-                if target_username.lower() != self.username.lower():
+                # Message bodies are never logged
+                if __debug__ and logger.debug_enabled:
+                    logger.debug(f"DM from {self.username} to {target_username}")
+                if self.registry.normalize(target_username) != self.registry.normalize(
+                    self.username
+                ):
                     self.send_direct_message(target_username, dm_message)
                 else:
                     # Sending a DM to oneself is not allowed
-                    try:
-                        self.client_socket.send(
-                            f"{WARNING_MESSAGE}: You cannot DM yourself.".encode(
-                                "utf-8"
-                            )
-                        )
-                    except:
-                        pass
+                    self.send(f"{WARNING_MESSAGE}: You cannot DM yourself.")
             else:
-                try:
-                    self.client_socket.send(
-                        f"{WARNING_MESSAGE}: Invalid DM format. Use '@username message'".encode(
-                            "utf-8"
-                        )
-                    )
-                except:
-                    pass
+                self.send(
+                    f"{WARNING_MESSAGE}: Invalid DM format. Use '@username message'"
+                )
+        elif message.startswith(ROOM_PREFIX):
+            # Room message, only members of the room receive it
+            parts = message[1:].split(" ", 1)
+            if len(parts) > 1:
+                self.send_room_message(parts[0], parts[1])
+            else:
+                self.send(
+                    f"{WARNING_MESSAGE}: Invalid room message format. Use '#room message'"
+                )
+        elif message.startswith(COMMAND_PREFIX):
+            self.process_command(message[1:])
         else:
             # Regular message - broadcast to all
             self.broadcast_message(f"@{self.username}: {message}")
 
+    def process_command(self, command: str) -> None:
+        """Handle a /join, /leave or /rooms command"""
+        name, _, argument = command.partition(" ")
+        room_name = argument.strip().removeprefix(ROOM_PREFIX)
+        name = name.lower()
+        if name == "join" and room_name:
+            self.join_room(room_name)
+        elif name == "leave" and room_name:
+            self.leave_room(room_name)
+        elif name == "rooms":
+            self.send_room_list()
+        else:
+            self.send(
+                f"{WARNING_MESSAGE}: Unknown command. Use '/join room', '/leave room' or '/rooms'"
+            )
+
+    def join_room(self, room_name: str) -> None:
+        """Add this client to a room, its recent messages are queued ahead of live ones"""
+        rooms = self.server.rooms
+        if not rooms.valid_name(room_name):
+            self.send(
+                f"{WARNING_MESSAGE}: Room names are 1 to 32 letters, digits, '_' or '-'."
+            )
+            return
+        room = rooms.join(room_name, self.client_socket, self.send_frame)
+        if room is None:
+            self.send(f"{WARNING_MESSAGE}: You are already in #{room_name}.")
+            return
+        self.server.count_room_member(room.name, 1)
+        # Members, including this client, see the join in the room
+        self.server.room_message(
+            room.name, f"{ROOM_MESSAGE}{room.name}]: @{self.username} has joined the room."
+        )
+
+    def leave_room(self, room_name: str) -> None:
+        """Remove this client from a room"""
+        room = self.server.rooms.leave(room_name, self.client_socket)
+        if room is None:
+            self.send(f"{WARNING_MESSAGE}: You are not in #{room_name}.")
+            return
+        self.server.count_room_member(room.name, -1)
+        self.send(f"{INFO_MESSAGE}: You left #{room.name}.")
+        self.server.room_message(
+            room.name, f"{ROOM_MESSAGE}{room.name}]: @{self.username} has left the room."
+        )
+
+    def send_room_list(self) -> None:
+        """Send the rooms with their member counts and the rooms this client is in"""
+        rooms = self.server.rooms
+        listing = self.server.room_listing()
+        if not listing:
+            self.send(f"{INFO_MESSAGE}: No rooms yet. Use '/join room' to create one.")
+            return
+        summary = ", ".join(f"#{name} ({count})" for name, count in listing)
+        joined = ", ".join(f"#{name}" for name in rooms.rooms_of(self.client_socket))
+        self.send(f"{INFO_MESSAGE}: Rooms: {summary}. You are in: {joined or 'none'}")
+
+    def send_room_message(self, room_name: str, message: str) -> bool:
+        """Send a message to every member of a room this client is in"""
+        room = self.server.rooms.lookup(room_name, self.client_socket)
+        if room is None:
+            self.send(
+                f"{WARNING_MESSAGE}: You are not in #{room_name}. Use '/join {room_name}' first."
+            )
+            return False
+        # Message bodies are never logged
+        if __debug__ and logger.debug_enabled:
+            logger.debug(f"Room message from {self.username} to #{room.name}")
+        self.server.room_message(
+            room.name, f"{ROOM_MESSAGE}{room.name}] @{self.username}: {message}"
+        )
+        return True
+
     def send_direct_message(self, target_username: str, message: str) -> bool:
         """Send a direct message to a specific user"""
         # Format the direct message
         formatted_message = f"{DM_FROM} {self.username}]: {message}"
 
-        with self.clients_lock:
-            # Find the target user
-            for client_socket, (username, _) in self.active_clients.items():
-                if username.lower() == target_username.lower():
-                    try:
-                        client_socket.send(formatted_message.encode("utf-8"))
-                        # Also send confirmation to the sender
-                        self.client_socket.send(
-                            f"{DM_TO} {username}]: {message}".encode("utf-8")
-                        )
-                        return True
-                    except:
-                        # Connection might be closed or broken
-                        return False
-
-        # User not found
-        try:
-            self.client_socket.send(
-                f"{WARNING_MESSAGE}: User '{target_username}' not found.".encode(
-                    "utf-8"
-                )
+        # Find the target user
+        target_socket = self.registry.lookup(target_username)
+        target = self.server.client_handlers.get(target_socket)
+
+        if target is not None:
+            # Queue outside the lock so a full queue never stalls other clients
+            target.send(formatted_message)
+            target_name = target.username
+        elif isinstance(target_socket, Session):
+            # Suspended, delivered if the session is resumed
+            target_socket.pending.append(formatted_message)
+            target_name = target_socket.username
+        elif self.server.cluster:
+            # The user may be connected to another worker
+            target_name = self.server.cluster.send_direct(
+                target_username, formatted_message
             )
-        except:
-            pass
-        return False
+        else:
+            target_name = None
+
+        if target_name is None:
+            # User not found
+            self.send(f"{WARNING_MESSAGE}: User '{target_username}' not found.")
+            return False
 
-    def handle_disconnect(self) -> None:
-        """Handle client disconnection"""
+        # Also send confirmation to the sender
+        self.send(f"{DM_TO} {target_name}]: {message}")
+        return True
+
+    def handle_disconnect(self, force: bool = False) -> None:
+        """Handle client disconnection, called from the reaper thread"""
         self.running = False
-        print(f"[INFO] {self.username} ({self.addr[0]}:{self.addr[1]}) disconnected.")
+
+        # A broken connection keeps its username for the resume grace window
+        if self.broken and self.server.suspend(self):
+            entry = None
+        else:
+            entry = self.server.release_username(self.client_socket)
+        if entry:
+            if __debug__ and logger.debug_enabled:
+                logger.debug(f"Cleaning up {self.username} ({self.addr[0]}:{self.addr[1]})")
+            if self.session:
+                with self.clients_lock:
+                    self.server.sessions.pop(self.session.token, None)
 
         with self.clients_lock:
-            if self.client_socket in self.active_clients:
-                print(
-                    f"[INFO] Cleaning up {self.username} ({self.addr[0]}:{self.addr[1]})"
-                )
-                if self.username:
-                    username = self.active_clients[self.client_socket][0]
-                    addr = self.active_clients[self.client_socket][1]
-                    del self.active_clients[self.client_socket]
-                else:
-                    # Unnamed client
-                    del self.active_clients[self.client_socket]
-        try:
-            print(f"[INFO] Closing connection with @{self.username}...")
-            self.client_socket.close()
-            print(f"[INFO] Connection with @{self.username} closed.")
+            self.server.client_handlers.pop(self.client_socket, None)
+            self.server.client_threads.pop(self.client_socket, None)
+
+        # Stop accepting frames, the writer flushes what is already queued
+        # (e.g. a login error) unless the connection is being forced out
+        self.outbound.close()
+        if force:
+            self.close_connection()
+
+        if entry:
+            username, addr = entry
             self.broadcast_message(
                 f"{INFO_MESSAGE}: @{username} has left the chat.",
                 exclude=self.client_socket,
             )
-            print(f"[INFO] @{username} ({addr[0]}:{addr[1]}) disconnected.")
-        except:
+            logger.info(f"@{username} ({addr[0]}:{addr[1]}) disconnected.")
+
+    def close_socket(self) -> None:
+        """Close the socket once the writer has drained or timed out"""
+        if __debug__ and logger.debug_enabled:
+            logger.debug(f"Closing connection with @{self.username}...")
+        self.close_connection()
+        try:
+            self.client_socket.close()
+        except OSError:
             pass
+        if __debug__ and logger.debug_enabled:
+            logger.debug(f"Connection with @{self.username} closed.")
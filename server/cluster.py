@@ -0,0 +1,475 @@
+"""
+Cluster Module
+Runs several ChatServer worker processes on one port and links them with a local bus
+"""
+
+import itertools
+import json
+import os
+import shutil
+import signal
+import socket
+import ssl
+import tempfile
+import threading
+from common.constants import DEFAULT_SERVER_HOST, DEFAULT_PORT
+from common.tls import server_context
+from common.protocol import (
+    FrameDecoder,
+    RECV_BUFFER_SIZE,
+    DEFAULT_COMPRESS_THRESHOLD,
+    encode_frame,
+)
+from server.outbound import (
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_POLICY,
+    DEFAULT_COALESCE_BYTES,
+    DEFAULT_COALESCE_DELAY,
+)
+from server.registry import UserRegistry
+from server.rooms import busiest_first
+from server.ring import DEFAULT_BACKFILL_SIZE
+from server.ratelimit import DEFAULT_ACCEPT_RATE, DEFAULT_ACCEPT_BURST
+from server.logger import logger
+
+# The parent process owns a ClusterHub listening on a Unix socket. Every worker
+# binds the chat port with SO_REUSEPORT so the kernel spreads connections across
+# them, and talks to the hub through a ClusterLink. The hub is the single source
+# of truth for which usernames are taken, relays broadcasts and room messages to every other worker
+# and routes direct messages to the worker holding the target user. It also adds up
+# how many members each worker has in every room, for listing rooms.
+
+# Bus frame types, separate from the client protocol frame types
+BUS_REQUEST = 0x40  # Worker -> hub: JSON {"id", "op", ...}
+BUS_RESPONSE = 0x41  # Hub -> worker: JSON {"id", "ok", ...}
+BUS_RELEASE = 0x42  # Worker -> hub: username that logged out
+BUS_BROADCAST = 0x43  # Both directions: an encoded client frame to fan out
+BUS_DELIVER = 0x44  # Hub -> worker: JSON {"name", "message"} direct message
+BUS_ROOM = 0x45  # Both directions: JSON {"room", "message"} to fan out to room members
+BUS_ROOM_MEMBERS = 0x46  # Worker -> hub: JSON {"room", "delta"} change in its member count
+
+# Seconds a worker waits for the hub to answer a request
+REQUEST_TIMEOUT = 5.0
+
+
+class BusConnection:
+    """Framed connection over the bus socket, safe to send on from many threads"""
+
+    def __init__(self, sock: socket.socket) -> None:
+        """Wrap a connected Unix socket"""
+        self.sock = sock
+        self.decoder = FrameDecoder()
+        self.send_lock = threading.Lock()
+
+    def send(self, frame_type: int, payload: bytes) -> None:
+        """Send a single bus frame"""
+        frame = encode_frame(frame_type, payload)
+        with self.send_lock:
+            self.sock.sendall(frame)
+
+    def send_json(self, frame_type: int, data: dict) -> None:
+        """Send a bus frame carrying a JSON object"""
+        self.send(frame_type, json.dumps(data).encode("utf-8"))
+
+    def frames(self):
+        """Yield received frames until the peer disconnects"""
+        while True:
+            data = self.sock.recv(RECV_BUFFER_SIZE)
+            if not data:
+                return
+            yield from self.decoder.feed(data)
+
+    def close(self) -> None:
+        """Shut down and close the socket"""
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class ClusterHub:
+    """Bus hub run by the parent process, keeps the global username table"""
+
+    def __init__(self, path: str) -> None:
+        """Bind the hub socket at path, call start() to begin serving"""
+        self.path = path
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen()
+
+        self.lock = threading.Lock()
+        self.workers: list[BusConnection] = []
+        # Casefolded username -> (display name, owning worker)
+        self.owners: dict[str, tuple[str, BusConnection]] = {}
+        # Worker -> casefolded room name -> members on that worker, and the
+        # display name of every room with members somewhere
+        self.room_counts: dict[BusConnection, dict[str, int]] = {}
+        self.room_names: dict[str, str] = {}
+
+    def start(self) -> None:
+        """Start accepting worker connections in the background"""
+        thread = threading.Thread(target=self.accept_workers)
+        thread.daemon = True
+        thread.start()
+
+    def accept_workers(self) -> None:
+        """Accept worker connections until the listener is closed"""
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            worker = BusConnection(sock)
+            with self.lock:
+                self.workers.append(worker)
+            thread = threading.Thread(target=self.serve_worker, args=(worker,))
+            thread.daemon = True
+            thread.start()
+
+    def serve_worker(self, worker: BusConnection) -> None:
+        """Handle bus frames from one worker"""
+        try:
+            for frame_type, payload in worker.frames():
+                if frame_type in (BUS_BROADCAST, BUS_ROOM):
+                    self.relay(worker, frame_type, payload)
+                elif frame_type == BUS_REQUEST:
+                    self.handle_request(worker, json.loads(payload))
+                elif frame_type == BUS_RELEASE:
+                    self.release(worker, payload.decode("utf-8"))
+                elif frame_type == BUS_ROOM_MEMBERS:
+                    change = json.loads(payload)
+                    self.count_members(worker, change["room"], change["delta"])
+        except OSError:
+            pass
+        finally:
+            # Forget everything the worker owned so its names become free again
+            with self.lock:
+                if worker in self.workers:
+                    self.workers.remove(worker)
+                for key in [k for k, (_, w) in self.owners.items() if w is worker]:
+                    del self.owners[key]
+                for key in self.room_counts.pop(worker, {}):
+                    self.forget_room(key)
+            worker.close()
+
+    def relay(self, sender: BusConnection, frame_type: int, payload: bytes) -> None:
+        """Forward a broadcast or room frame to every worker except the sender"""
+        with self.lock:
+            workers = [w for w in self.workers if w is not sender]
+        for worker in workers:
+            try:
+                worker.send(frame_type, payload)
+            except OSError:
+                pass
+
+    def handle_request(self, worker: BusConnection, request: dict) -> None:
+        """Answer a reserve, names or dm request from a worker"""
+        response = {"id": request["id"], "ok": False}
+        op = request["op"]
+
+        if op == "reserve":
+            key = UserRegistry.normalize(request["name"])
+            with self.lock:
+                if key not in self.owners:
+                    self.owners[key] = (request["name"], worker)
+                    response["ok"] = True
+        elif op == "names":
+            with self.lock:
+                response["names"] = [name for name, _ in self.owners.values()]
+            response["ok"] = True
+        elif op == "rooms":
+            response["rooms"] = self.room_listing()
+            response["ok"] = True
+        elif op == "dm":
+            with self.lock:
+                owner = self.owners.get(UserRegistry.normalize(request["name"]))
+            if owner is not None:
+                display_name, target_worker = owner
+                try:
+                    target_worker.send_json(
+                        BUS_DELIVER,
+                        {"name": display_name, "message": request["message"]},
+                    )
+                    response["ok"] = True
+                    response["name"] = display_name
+                except OSError:
+                    pass
+
+        worker.send_json(BUS_RESPONSE, response)
+
+    def release(self, worker: BusConnection, username: str) -> None:
+        """Free a username owned by worker"""
+        key = UserRegistry.normalize(username)
+        with self.lock:
+            owner = self.owners.get(key)
+            if owner is not None and owner[1] is worker:
+                del self.owners[key]
+
+    def count_members(self, worker: BusConnection, room: str, delta: int) -> None:
+        """Apply a change in how many members worker has in room"""
+        key = UserRegistry.normalize(room)
+        with self.lock:
+            counts = self.room_counts.setdefault(worker, {})
+            counts[key] = counts.get(key, 0) + delta
+            self.room_names.setdefault(key, room)
+            if counts[key] <= 0:
+                del counts[key]
+                self.forget_room(key)
+
+    def forget_room(self, key: str) -> None:
+        """Drop a room's display name once no worker has members in it, hold lock"""
+        if not any(key in counts for counts in self.room_counts.values()):
+            self.room_names.pop(key, None)
+
+    def room_listing(self) -> list[tuple[str, int]]:
+        """(name, member count) of every room across all workers, busiest first"""
+        with self.lock:
+            totals = dict.fromkeys(self.room_names, 0)
+            for counts in self.room_counts.values():
+                for key, count in counts.items():
+                    totals[key] += count
+            return busiest_first(
+                [(self.room_names[key], count) for key, count in totals.items()]
+            )
+
+    def close(self) -> None:
+        """Stop accepting workers and close the hub socket"""
+        self.listener.close()
+
+
+class ClusterLink:
+    """A worker's connection to the hub"""
+
+    def __init__(self, path: str) -> None:
+        """Remember the hub path, call start() once the server exists"""
+        self.path = path
+        self.server = None
+        self.connection = None
+
+        self.request_ids = itertools.count()
+        self.pending_lock = threading.Lock()
+        # Request id -> [event, response]
+        self.pending: dict[int, list] = {}
+
+    def start(self, server) -> None:
+        """Connect to the hub and start delivering bus traffic to server"""
+        self.server = server
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        self.connection = BusConnection(sock)
+
+        thread = threading.Thread(target=self.receive_loop)
+        thread.daemon = True
+        thread.start()
+
+    def receive_loop(self) -> None:
+        """Dispatch frames arriving from the hub"""
+        try:
+            for frame_type, payload in self.connection.frames():
+                if frame_type == BUS_BROADCAST:
+                    # Already encoded by the originating worker, fan out as is
+                    self.server.deliver(payload)
+                elif frame_type == BUS_DELIVER:
+                    message = json.loads(payload)
+                    self.server.deliver_direct(message["name"], message["message"])
+                elif frame_type == BUS_ROOM:
+                    # Workers without members in the room drop it
+                    message = json.loads(payload)
+                    self.server.deliver_room(message["room"], message["message"])
+                elif frame_type == BUS_RESPONSE:
+                    self.resolve(json.loads(payload))
+        except OSError:
+            pass
+        logger.error(f"Worker {os.getpid()} lost its connection to the cluster hub")
+
+    def request(self, op: str, **fields) -> dict | None:
+        """Send a request to the hub and wait for its response, None on timeout"""
+        request_id = next(self.request_ids)
+        slot = [threading.Event(), None]
+        with self.pending_lock:
+            self.pending[request_id] = slot
+
+        try:
+            self.connection.send_json(BUS_REQUEST, {"id": request_id, "op": op, **fields})
+            slot[0].wait(REQUEST_TIMEOUT)
+        except OSError:
+            pass
+        finally:
+            with self.pending_lock:
+                self.pending.pop(request_id, None)
+        return slot[1]
+
+    def resolve(self, response: dict) -> None:
+        """Wake the thread waiting for this response"""
+        with self.pending_lock:
+            slot = self.pending.get(response["id"])
+        if slot is not None:
+            slot[1] = response
+            slot[0].set()
+
+    def reserve(self, username: str) -> bool:
+        """Claim username across the whole cluster"""
+        response = self.request("reserve", name=username)
+        return bool(response and response["ok"])
+
+    def release(self, username: str) -> None:
+        """Give username back to the cluster"""
+        try:
+            self.connection.send(BUS_RELEASE, username.encode("utf-8"))
+        except OSError:
+            pass
+
+    def names(self) -> list[str] | None:
+        """Usernames logged in on any worker, None if the hub did not answer"""
+        response = self.request("names")
+        return response["names"] if response else None
+
+    def rooms(self) -> list[tuple[str, int]] | None:
+        """(name, member count) of every room on any worker, None if the hub did not answer"""
+        response = self.request("rooms")
+        return [tuple(entry) for entry in response["rooms"]] if response else None
+
+    def count_members(self, room: str, delta: int) -> None:
+        """Tell the hub this worker's member count in room changed by delta"""
+        try:
+            self.connection.send_json(BUS_ROOM_MEMBERS, {"room": room, "delta": delta})
+        except OSError:
+            pass
+
+    def send_direct(self, username: str, message: str) -> str | None:
+        """Route a DM to a user on another worker, returns their display name if found"""
+        response = self.request("dm", name=username, message=message)
+        return response["name"] if response and response["ok"] else None
+
+    def publish(self, frame: bytes) -> None:
+        """Send an encoded broadcast frame to every other worker"""
+        try:
+            self.connection.send(BUS_BROADCAST, frame)
+        except OSError:
+            pass
+
+    def publish_room(self, room: str, message: str) -> None:
+        """Send a room message to every other worker"""
+        try:
+            self.connection.send_json(BUS_ROOM, {"room": room, "message": message})
+        except OSError:
+            pass
+
+
+def run_worker(
+    hub_path: str,
+    host: str,
+    port: int,
+    queue_size: int,
+    slow_consumer: str,
+    metrics_port: int | None = None,
+    backfill: int = DEFAULT_BACKFILL_SIZE,
+    accept_rate: float = DEFAULT_ACCEPT_RATE,
+    accept_burst: int = DEFAULT_ACCEPT_BURST,
+    coalesce_bytes: int = DEFAULT_COALESCE_BYTES,
+    coalesce_delay: float = DEFAULT_COALESCE_DELAY,
+    compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD,
+    tls: ssl.SSLContext | None = None,
+) -> None:
+    """Body of a forked worker process"""
+    # Imported here to avoid a circular import with server.server
+    from server.server import ChatServer
+
+    server = ChatServer(
+        host,
+        port,
+        queue_size,
+        slow_consumer,
+        reuse_port=True,
+        cluster=ClusterLink(hub_path),
+        metrics_port=metrics_port,
+        backfill=backfill,
+        accept_rate=accept_rate,
+        accept_burst=accept_burst,
+        coalesce_bytes=coalesce_bytes,
+        coalesce_delay=coalesce_delay,
+        compress_threshold=compress_threshold,
+        tls=tls,
+    )
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+def start_cluster(
+    host: str = DEFAULT_SERVER_HOST,
+    port: int = DEFAULT_PORT,
+    workers: int = 2,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    slow_consumer: str = DEFAULT_POLICY,
+    metrics_port: int | None = None,
+    backfill: int = DEFAULT_BACKFILL_SIZE,
+    accept_rate: float = DEFAULT_ACCEPT_RATE,
+    accept_burst: int = DEFAULT_ACCEPT_BURST,
+    coalesce_bytes: int = DEFAULT_COALESCE_BYTES,
+    coalesce_delay: float = DEFAULT_COALESCE_DELAY,
+    compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD,
+    tls_cert: str | None = None,
+    tls_key: str | None = None,
+) -> None:
+    """Fork worker processes sharing the chat port and serve the bus until they exit"""
+    if not hasattr(socket, "SO_REUSEPORT") or not hasattr(os, "fork"):
+        raise RuntimeError("Multiple workers require fork() and SO_REUSEPORT")
+
+    # Created before forking so every worker shares the session ticket keys and
+    # a client can resume its session on whichever worker accepts the reconnect
+    tls = server_context(tls_cert, tls_key) if tls_cert else None
+
+    bus_dir = tempfile.mkdtemp(prefix="chat-cluster-")
+    hub = ClusterHub(os.path.join(bus_dir, "bus.sock"))
+
+    # Fork before any thread is started in this process
+    children = []
+    for index in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            hub.listener.close()
+            # Each worker serves its own metrics on consecutive ports
+            worker_metrics_port = metrics_port + index if metrics_port else None
+            try:
+                run_worker(
+                    hub.path,
+                    host,
+                    port,
+                    queue_size,
+                    slow_consumer,
+                    worker_metrics_port,
+                    backfill,
+                    accept_rate,
+                    accept_burst,
+                    coalesce_bytes,
+                    coalesce_delay,
+                    compress_threshold,
+                    tls,
+                )
+            finally:
+                # os._exit skips atexit handlers
+                logger.flush()
+                os._exit(0)
+        children.append(pid)
+
+    hub.start()
+    logger.info(f"Cluster started with {workers} workers on {host}:{port}")
+
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        logger.info("Cluster shutting down...")
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+    finally:
+        hub.close()
+        shutil.rmtree(bus_dir, ignore_errors=True)
+        logger.info("Cluster closed.")
@@ -0,0 +1,217 @@
+"""
+History Store Module
+Append-only on-disk log of broadcast messages, indexed by sequence number
+"""
+
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from collections.abc import Iterator
+from common.protocol import (
+    HEADER,
+    HEADER_SIZE,
+    SEQ,
+    FRAME_BROADCAST,
+    FRAME_HISTORY,
+)
+
+# Each segment is a pair of files named after the first sequence number they hold:
+#   <first_seq>.log  the FRAME_HISTORY frames exactly as they are sent on replay
+#   <first_seq>.idx  one INDEX_ENTRY per frame, (timestamp, offset into the .log)
+# Sequence numbers are contiguous, so the frame for seq lives at index entry
+# seq - first_seq of its segment and replaying "everything after seq X" is one
+# contiguous slice of each segment file.
+INDEX_ENTRY = struct.Struct("!dQ")
+LOG_SUFFIX = ".log"
+INDEX_SUFFIX = ".idx"
+
+# Start a new segment once the current one grows past this many bytes
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024  # 16 MiB
+
+# Most messages replayed to one client, a longer absence only gets the newest ones
+DEFAULT_REPLAY_LIMIT = 10000
+
+
+class Segment:
+    """One log file and its index, the last segment is the one appended to"""
+
+    def __init__(self, directory: str, first_seq: int) -> None:
+        """Open (or create) the segment starting at first_seq"""
+        self.first_seq = first_seq
+        base = os.path.join(directory, f"{first_seq:020d}")
+        self.log_path = base + LOG_SUFFIX
+        self.index_path = base + INDEX_SUFFIX
+
+        self.timestamps = array("d")
+        self.offsets = array("Q")
+        self.size = 0
+        self.log_file = None
+        self.index_file = None
+        self.load()
+
+    def __len__(self) -> int:
+        """Number of frames in the segment"""
+        return len(self.offsets)
+
+    def load(self) -> None:
+        """Read the index and drop any frame a crash left half written"""
+        log_size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as index_file:
+                data = index_file.read()
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            for timestamp, offset in INDEX_ENTRY.iter_unpack(data[:usable]):
+                self.timestamps.append(timestamp)
+                self.offsets.append(offset)
+
+        # The log is written before the index, so the index is the source of
+        # truth; trim entries pointing past the end of the log and log bytes
+        # that never made it into the index
+        end = 0
+        with open(self.log_path, "ab+") as log_file:
+            while self.offsets:
+                offset = self.offsets[-1]
+                if offset + HEADER_SIZE <= log_size:
+                    log_file.seek(offset)
+                    length, _ = HEADER.unpack(log_file.read(HEADER_SIZE))
+                    if offset + HEADER_SIZE + length <= log_size:
+                        end = offset + HEADER_SIZE + length
+                        break
+                self.offsets.pop()
+                self.timestamps.pop()
+            log_file.truncate(end)
+        with open(self.index_path, "ab") as index_file:
+            index_file.truncate(len(self.offsets) * INDEX_ENTRY.size)
+        self.size = end
+
+    def open_for_append(self) -> None:
+        """Open the files for appending, only the last segment is kept open"""
+        self.log_file = open(self.log_path, "ab", buffering=0)
+        self.index_file = open(self.index_path, "ab", buffering=0)
+
+    def append(self, timestamp: float, frame: bytes) -> None:
+        """Write one frame and its index entry"""
+        self.log_file.write(frame)
+        self.index_file.write(INDEX_ENTRY.pack(timestamp, self.size))
+        self.timestamps.append(timestamp)
+        self.offsets.append(self.size)
+        self.size += len(frame)
+
+    def read_from(self, seq: int, end: int) -> bytes:
+        """Return every frame from seq up to byte offset end, read through mmap"""
+        start = self.offsets[seq - self.first_seq]
+        with open(self.log_path, "rb") as log_file:
+            with mmap.mmap(log_file.fileno(), end, access=mmap.ACCESS_READ) as mapped:
+                return mapped[start:end]
+
+    def close(self) -> None:
+        """Close the append handles"""
+        for handle in (self.log_file, self.index_file):
+            if handle:
+                handle.close()
+        self.log_file = self.index_file = None
+
+
+class HistoryStore:
+    """Thread-safe append-only message history split into segment files"""
+
+    def __init__(
+        self,
+        directory: str,
+        segment_size: int = DEFAULT_SEGMENT_SIZE,
+        replay_limit: int = DEFAULT_REPLAY_LIMIT,
+    ) -> None:
+        """Open the history in directory, creating it if needed"""
+        self.directory = directory
+        self.segment_size = segment_size
+        self.replay_limit = replay_limit
+        self.lock = threading.Lock()
+        self.closed = False
+        os.makedirs(directory, exist_ok=True)
+
+        first_seqs = sorted(
+            int(name[: -len(LOG_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.endswith(LOG_SUFFIX)
+        )
+        self.segments = [Segment(directory, first_seq) for first_seq in first_seqs]
+        # Parallel to segments, for bisecting a sequence number to its segment
+        self.first_seqs = first_seqs
+
+        if self.segments:
+            last = self.segments[-1]
+            self.next_seq = last.first_seq + len(last)
+            last.open_for_append()
+        else:
+            self.next_seq = 1
+
+    @property
+    def last_seq(self) -> int:
+        """Sequence number of the newest message, 0 when empty"""
+        return self.next_seq - 1
+
+    def append(self, text: str) -> tuple[int, bytes]:
+        """Persist a broadcast line and return its sequence number and FRAME_BROADCAST frame"""
+        payload_text = text.encode("utf-8")
+        with self.lock:
+            seq = self.next_seq
+            payload = SEQ.pack(seq) + payload_text
+            header = HEADER.pack(len(payload), FRAME_HISTORY)
+
+            # Messages racing shutdown are still delivered, just not persisted
+            if not self.closed:
+                segment = self.segments[-1] if self.segments else None
+                if segment is None or segment.size >= self.segment_size:
+                    segment = self.roll(seq)
+
+                # Timestamps never go backwards so the time index stays sorted
+                timestamp = time.time()
+                if segment.timestamps and timestamp < segment.timestamps[-1]:
+                    timestamp = segment.timestamps[-1]
+                segment.append(timestamp, header + payload)
+            self.next_seq = seq + 1
+
+        return seq, HEADER.pack(len(payload), FRAME_BROADCAST) + payload
+
+    def roll(self, first_seq: int) -> Segment:
+        """Seal the current segment and start a new one, must hold lock"""
+        if self.segments:
+            self.segments[-1].close()
+        segment = Segment(self.directory, first_seq)
+        segment.open_for_append()
+        self.segments.append(segment)
+        self.first_seqs.append(first_seq)
+        return segment
+
+    def read_since(self, seq: int) -> Iterator[bytes]:
+        """Yield the FRAME_HISTORY frames after seq, up to replay_limit of the newest, a segment at a time"""
+        with self.lock:
+            start = max(
+                seq + 1,
+                self.next_seq - self.replay_limit,
+                self.first_seqs[0] if self.first_seqs else 1,
+            )
+            if start >= self.next_seq:
+                return
+            index = bisect.bisect_right(self.first_seqs, start) - 1
+            # Snapshot where each segment ends, appends after this are not replayed
+            ranges = []
+            for segment in self.segments[index:]:
+                first = max(start, segment.first_seq)
+                if first < segment.first_seq + len(segment):
+                    ranges.append((segment, first, segment.size))
+
+        # Only one segment's frames are in memory at a time
+        for segment, first, end in ranges:
+            yield segment.read_from(first, end)
+
+    def close(self) -> None:
+        """Close the segment being appended to"""
+        with self.lock:
+            self.closed = True
+            if self.segments:
+                self.segments[-1].close()
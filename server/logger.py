@@ -0,0 +1,163 @@
+"""
+Server Logging Module
+Leveled logger that formats and writes records on a background thread
+"""
+
+import atexit
+import os
+import queue
+import sys
+import threading
+import time
+from server.ratelimit import TokenBucket
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+LEVELS = {name.lower(): level for level, name in LEVEL_NAMES.items()}
+
+DEFAULT_LEVEL = INFO
+
+# Records waiting for the writer, anything beyond this is dropped instead of blocking
+LOG_QUEUE_SIZE = 10000
+
+# Sustained records per second and burst size accepted before rate limiting kicks in
+DEFAULT_RATE = 1000.0
+DEFAULT_BURST = 2000
+
+# Hot-path call sites are guarded with `if __debug__ and logger.debug_enabled:` so
+# running the server with `python -O` removes them from the bytecode entirely.
+
+
+class Logger:
+    """Leveled logger that never blocks the caller on I/O"""
+
+    def __init__(
+        self,
+        level: int = DEFAULT_LEVEL,
+        stream=None,
+        rate: float = DEFAULT_RATE,
+        burst: int = DEFAULT_BURST,
+        queue_size: int = LOG_QUEUE_SIZE,
+    ) -> None:
+        """Initialize the logger, the writer thread starts on the first record"""
+        self.level = level
+        # Cheap check for hot-path call sites, skips formatting a message nobody sees
+        self.debug_enabled = level <= DEBUG
+        self.stream = stream
+        self.rate = rate
+        self.burst = burst
+        self.queue_size = queue_size
+
+        # Records dropped by the rate limiter or a full queue since the last report
+        self.dropped = 0
+        self._bucket = TokenBucket(rate, burst)
+        self._reset()
+
+    def _reset(self) -> None:
+        """Forget the writer thread, used at init and in forked children"""
+        self._lock = threading.Lock()
+        self._records = queue.Queue(self.queue_size)
+        self._writer = None
+
+    def set_level(self, level: int) -> None:
+        """Only emit records at level or above"""
+        self.level = level
+        self.debug_enabled = level <= DEBUG
+
+    def debug(self, message: str) -> None:
+        """Log a debug record"""
+        if DEBUG >= self.level:
+            self.log(DEBUG, message)
+
+    def info(self, message: str) -> None:
+        """Log an informational record"""
+        if INFO >= self.level:
+            self.log(INFO, message)
+
+    def warning(self, message: str) -> None:
+        """Log a warning record"""
+        if WARNING >= self.level:
+            self.log(WARNING, message)
+
+    def error(self, message: str) -> None:
+        """Log an error record"""
+        if ERROR >= self.level:
+            self.log(ERROR, message)
+
+    def log(self, level: int, message: str) -> None:
+        """Hand a record to the writer thread, dropping it if over the rate limit"""
+        if level < self.level:
+            return
+        now = time.time()
+        with self._lock:
+            if not self._bucket.take():
+                self.dropped += 1
+                return
+            if self._writer is None:
+                self._start_writer()
+        try:
+            self._records.put_nowait((now, level, message))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _start_writer(self) -> None:
+        """Launch the writer thread, must be called with _lock held"""
+        self._writer = threading.Thread(target=self._write_loop, name="log-writer")
+        self._writer.daemon = True
+        self._writer.start()
+
+    def _write_loop(self) -> None:
+        """Format queued records and write them in batches"""
+        while True:
+            batch = [self._records.get()]
+            # Take whatever else is already waiting so one write covers many records
+            while True:
+                try:
+                    batch.append(self._records.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for _ in batch:
+                self._records.task_done()
+
+    def _write(self, batch: list) -> None:
+        """Write a batch of records and report any that were dropped"""
+        lines = [self.format(*record) for record in batch]
+
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            lines.append(
+                self.format(time.time(), WARNING, f"Dropped {dropped} log records")
+            )
+
+        stream = self.stream or sys.stdout
+        try:
+            stream.write("\n".join(lines) + "\n")
+            stream.flush()
+        except (OSError, ValueError):
+            # stdout is gone, nothing sensible left to do
+            pass
+
+    @staticmethod
+    def format(timestamp: float, level: int, message: str) -> str:
+        """Render a record as a single line"""
+        clock = time.strftime("%H:%M:%S", time.localtime(timestamp))
+        return f"{clock}.{int(timestamp % 1 * 1000):03d} [{LEVEL_NAMES[level]}] {message}"
+
+    def flush(self) -> None:
+        """Block until every queued record has been written"""
+        if self._writer is not None and self._writer.is_alive():
+            self._records.join()
+
+
+logger = Logger()
+
+# Write out pending records on exit, and give forked workers their own writer
+atexit.register(logger.flush)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=logger._reset)
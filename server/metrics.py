@@ -0,0 +1,207 @@
+"""
+Server Metrics Module
+Counters, gauges and histograms shared by the server engines, exposed as Prometheus text
+"""
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from server.logger import logger
+
+
+# Default histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.00001, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# Metrics are only served on the loopback interface
+DEFAULT_METRICS_HOST = "127.0.0.1"
+
+
+class Counter:
+    """Monotonic counter that is safe to increment from many threads"""
+
+    def __init__(self) -> None:
+        """Initialize the counter at zero"""
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        """Increase the counter by amount"""
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    """Bucketed distribution of observed values that is safe to update from many threads"""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        """Initialize an empty histogram with the given bucket upper bounds"""
+        self.buckets = buckets
+        # One extra slot for values above the largest bucket
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """Record a single observation"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def mean(self) -> float:
+        """Average of all observations, zero when empty"""
+        return self.sum / self.count if self.count else 0.0
+
+
+class Gauge:
+    """Value that can go up and down, or is computed when read"""
+
+    def __init__(self, function=None) -> None:
+        """Initialize the gauge, function is called on every read if given"""
+        self.value = 0
+        self.function = function
+
+    def set(self, value: float) -> None:
+        """Set the current value"""
+        self.value = value
+
+    def get(self) -> float:
+        """Return the current value"""
+        return self.function() if self.function else self.value
+
+
+class TimedLock:
+    """Mutex that records how long callers wait to acquire it when it is held"""
+
+    def __init__(self, wait_time: Histogram, uncontended: Counter) -> None:
+        """Initialize the lock, contended waits are observed into wait_time"""
+        self._lock = threading.Lock()
+        self.wait_time = wait_time
+        self.uncontended = uncontended
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        """Acquire the lock, recording the time spent waiting if it was held"""
+        # Uncontended fast path, no clock reads and no histogram update. The
+        # count is guarded by this lock itself, so the counter's lock is skipped.
+        if self._lock.acquire(False):
+            self.uncontended.value += 1
+            return True
+        if not blocking:
+            return False
+
+        start = time.perf_counter()
+        acquired = self._lock.acquire(True, timeout)
+        self.wait_time.observe(time.perf_counter() - start)
+        return acquired
+
+    def release(self) -> None:
+        """Release the lock"""
+        self._lock.release()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class MetricsRegistry:
+    """Named collection of metrics that renders the Prometheus text format"""
+
+    def __init__(self) -> None:
+        """Initialize an empty registry"""
+        # (name, help text, metric) in registration order
+        self._metrics = []
+
+    def register(self, name: str, help_text: str, metric):
+        """Add an existing metric under name and return it"""
+        self._metrics.append((name, help_text, metric))
+        return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        """Create and register a counter"""
+        return self.register(name, help_text, Counter())
+
+    def gauge(self, name: str, help_text: str, function=None) -> Gauge:
+        """Create and register a gauge"""
+        return self.register(name, help_text, Gauge(function))
+
+    def histogram(
+        self, name: str, help_text: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        """Create and register a histogram"""
+        return self.register(name, help_text, Histogram(buckets))
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        for name, help_text, metric in self._metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            if isinstance(metric, Counter):
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name} {metric.value}")
+            elif isinstance(metric, Gauge):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {metric.get()}")
+            elif isinstance(metric, Histogram):
+                lines.append(f"# TYPE {name} histogram")
+                cumulative = 0
+                for bound, count in zip(metric.buckets, metric.bucket_counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{le="+Inf"}} {metric.count}')
+                lines.append(f"{name}_sum {metric.sum}")
+                lines.append(f"{name}_count {metric.count}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Tiny HTTP server exposing a registry at /metrics"""
+
+    def __init__(
+        self, registry: MetricsRegistry, port: int, host: str = DEFAULT_METRICS_HOST
+    ) -> None:
+        """Initialize the endpoint, call start() to begin serving"""
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.httpd = None
+
+    def start(self) -> None:
+        """Serve metrics on a background thread"""
+        registry = self.registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                # Scrapes are frequent, keep them out of the server log
+                pass
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    def stop(self) -> None:
+        """Stop serving metrics"""
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
@@ -0,0 +1,131 @@
+"""
+Outbound Queue Module
+Bounded per-connection send queue with a configurable slow-consumer policy
+"""
+
+import threading
+import time
+from collections import deque
+
+# Slow-consumer policies applied when a client's queue is full
+DROP_OLDEST = "drop_oldest"  # Discard the oldest queued frame to make room
+DISCONNECT = "disconnect"  # Drop the client
+BLOCK = "block"  # Make the producer wait for room, then disconnect on timeout
+SLOW_CONSUMER_POLICIES = (DROP_OLDEST, DISCONNECT, BLOCK)
+
+DEFAULT_QUEUE_SIZE = 1024  # Frames buffered per client
+DEFAULT_POLICY = DROP_OLDEST
+DEFAULT_BLOCK_TIMEOUT = 5.0  # Seconds a producer may wait under the block policy
+
+# Frames queued back to back are written together: up to this many bytes per write,
+# optionally waiting this many seconds for more frames after the first one
+DEFAULT_COALESCE_BYTES = 64 * 1024
+DEFAULT_COALESCE_DELAY = 0.0
+# Buffers in one sendmsg() call, the usual IOV_MAX
+MAX_BATCH_FRAMES = 1024
+
+
+class OutboundQueue:
+    """Thread-safe bounded queue of encoded frames waiting to be written"""
+
+    def __init__(
+        self,
+        maxsize: int = DEFAULT_QUEUE_SIZE,
+        policy: str = DEFAULT_POLICY,
+        block_timeout: float = DEFAULT_BLOCK_TIMEOUT,
+        drop_counter=None,
+    ) -> None:
+        """Initialize an empty queue, drop_counter is a shared Counter of dropped frames"""
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow-consumer policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.closed = False
+        self.dropped = 0
+        self.drop_counter = drop_counter
+
+        self._frames = deque()
+        self._bytes = 0  # Total size of the queued frames
+        self._condition = threading.Condition()
+
+    def __len__(self) -> int:
+        """Number of frames waiting to be written"""
+        return len(self._frames)
+
+    def put(self, frame: bytes, wait: bool = True) -> bool:
+        """Queue a frame, returning False if the consumer should be disconnected"""
+        with self._condition:
+            if self.closed:
+                return False
+
+            if len(self._frames) >= self.maxsize:
+                if self.policy == DROP_OLDEST:
+                    self._bytes -= len(self._frames.popleft())
+                    self.dropped += 1
+                    if self.drop_counter:
+                        self.drop_counter.inc()
+                elif self.policy == BLOCK and wait:
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._frames) >= self.maxsize and not self.closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    if self.closed or len(self._frames) >= self.maxsize:
+                        self.closed = True
+                        self._condition.notify_all()
+                        return False
+                else:
+                    # Disconnect the slow consumer
+                    self.closed = True
+                    self._condition.notify_all()
+                    return False
+
+            self._frames.append(frame)
+            self._bytes += len(frame)
+            self._condition.notify_all()
+            return True
+
+    def get_batch(
+        self, max_bytes: int = DEFAULT_COALESCE_BYTES, max_delay: float = DEFAULT_COALESCE_DELAY
+    ) -> list[bytes] | None:
+        """Take the queued frames that fit in max_bytes, or None once closed and drained"""
+        with self._condition:
+            while not self._frames and not self.closed:
+                self._condition.wait()
+            if not self._frames:
+                return None
+
+            # Give a burst a moment to build up so it goes out in one write
+            if max_delay > 0:
+                deadline = time.monotonic() + max_delay
+                while self._bytes < max_bytes and not self.closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+            # Always take at least one frame, however large
+            frame = self._frames.popleft()
+            batch = [frame]
+            size = len(frame)
+            while (
+                self._frames
+                and len(batch) < MAX_BATCH_FRAMES
+                and size + len(self._frames[0]) <= max_bytes
+            ):
+                frame = self._frames.popleft()
+                batch.append(frame)
+                size += len(frame)
+            self._bytes -= size
+
+            # Wake producers waiting for room under the block policy
+            self._condition.notify_all()
+            return batch
+
+    def close(self) -> None:
+        """Stop accepting frames, already queued frames can still be drained"""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
@@ -0,0 +1,41 @@
+"""
+Rate Limit Module
+Token bucket shared by the logger and the accept loop
+"""
+
+import time
+
+# Connections accepted per second and burst size before the accept loop backs off,
+# the rest wait in the kernel's listen backlog
+DEFAULT_ACCEPT_RATE = 500.0
+DEFAULT_ACCEPT_BURST = 1000
+
+
+class TokenBucket:
+    """Allows rate events per second with bursts of up to burst, not thread-safe"""
+
+    def __init__(self, rate: float, burst: float) -> None:
+        """Initialize a full bucket"""
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.refilled = time.monotonic()
+
+    def refill(self) -> None:
+        """Add the tokens earned since the last refill"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+
+    def take(self) -> bool:
+        """Spend one token, False if none is available"""
+        self.refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def delay(self) -> float:
+        """Seconds until a token is available"""
+        self.refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
@@ -0,0 +1,130 @@
+"""
+Connection Reaper Module
+Retires dead client connections on a dedicated thread, off the broadcast path
+"""
+
+import heapq
+import itertools
+import queue
+import threading
+import time
+from server.metrics import Counter, Histogram
+from server.logger import logger
+
+# Seconds a retired client's writer may spend flushing queued frames
+WRITER_DRAIN_TIMEOUT = 1.0
+
+# How often lingering connections are re-checked while their writers drain
+LINGER_POLL_INTERVAL = 0.05
+
+
+class Reaper:
+    """Background stage that cleans up connections handed to it by any thread"""
+
+    def __init__(self, drain_timeout: float = WRITER_DRAIN_TIMEOUT) -> None:
+        """Initialize the reaper, call start() to launch its thread"""
+        self.drain_timeout = drain_timeout
+        self.thread = None
+
+        self._requests = queue.Queue()
+        self._requested = set()
+        self._lock = threading.Lock()
+        # (due, tie-breaker, callback) heap of work scheduled for later
+        self._timers = []
+        self._timer_ids = itertools.count()
+
+        # Time from retire() to the socket being closed
+        self.reaped = Counter()
+        self.reap_latency = Histogram()
+
+    def start(self) -> None:
+        """Start the reaper thread"""
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Ask the reaper thread to exit"""
+        self._requests.put(None)
+
+    def wake(self) -> None:
+        """Re-check lingering connections now, called when a writer exits"""
+        self._requests.put(False)
+
+    def schedule(self, delay: float, callback) -> None:
+        """Run callback on the reaper thread after delay seconds"""
+        with self._lock:
+            heapq.heappush(
+                self._timers, (time.monotonic() + delay, next(self._timer_ids), callback)
+            )
+        self.wake()
+
+    def retire(self, handler, force: bool = False) -> None:
+        """Hand a connection over for cleanup, never blocks the caller"""
+        # force shuts the socket down at once instead of letting the writer
+        # flush, used for slow consumers and broken connections
+        with self._lock:
+            if handler in self._requested:
+                return
+            self._requested.add(handler)
+        self._requests.put((handler, force, time.monotonic()))
+
+    def run(self) -> None:
+        """Reap connections until stopped"""
+        # (deadline, handler, requested_at) for connections whose writer is draining
+        lingering = []
+        while True:
+            timeout = LINGER_POLL_INTERVAL if lingering else None
+            with self._lock:
+                if self._timers:
+                    until = max(0.0, self._timers[0][0] - time.monotonic())
+                    timeout = until if timeout is None else min(timeout, until)
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                request = False
+
+            # None stops the reaper, False only re-checks lingering connections
+            if request is None:
+                break
+            if request:
+                handler, force, requested_at = request
+                try:
+                    handler.handle_disconnect(force)
+                except Exception as e:
+                    logger.error(f"Exception while retiring {handler.username}: {e}")
+                lingering.append(
+                    (time.monotonic() + self.drain_timeout, handler, requested_at)
+                )
+
+            lingering = self.close_drained(lingering)
+            self.run_timers()
+
+    def run_timers(self) -> None:
+        """Run every scheduled callback that is due"""
+        while True:
+            with self._lock:
+                if not self._timers or self._timers[0][0] > time.monotonic():
+                    return
+                _, _, callback = heapq.heappop(self._timers)
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Exception in scheduled reaper task: {e}")
+
+    def close_drained(self, lingering: list) -> list:
+        """Close connections whose writer finished or ran out of time"""
+        now = time.monotonic()
+        still_lingering = []
+        for deadline, handler, requested_at in lingering:
+            writer = handler.writer_thread
+            if writer and writer.is_alive() and now < deadline:
+                still_lingering.append((deadline, handler, requested_at))
+                continue
+
+            handler.close_socket()
+            self.reap_latency.observe(time.monotonic() - requested_at)
+            self.reaped.inc()
+            with self._lock:
+                self._requested.discard(handler)
+        return still_lingering
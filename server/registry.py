@@ -0,0 +1,67 @@
+"""
+User Registry Module
+Keeps logged-in users indexed by connection and by case-insensitive username
+"""
+
+import threading
+
+
+class UserRegistry:
+    """Thread-safe index of active users with constant-time name lookup"""
+
+    def __init__(self, lock: threading.Lock | None = None) -> None:
+        """Initialize an empty registry guarded by lock"""
+        self.lock = lock or threading.Lock()
+
+        # Connection -> (username, address), the map broadcasts iterate over
+        self.active_clients = {}
+        # Casefolded username -> connection, used for duplicate checks and DMs
+        self._by_name = {}
+
+    @staticmethod
+    def normalize(username: str) -> str:
+        """Return the key used to compare usernames regardless of case"""
+        return username.casefold()
+
+    def __len__(self) -> int:
+        """Number of registered users"""
+        return len(self.active_clients)
+
+    def reserve(self, username: str, connection, addr: tuple[str, int]) -> bool:
+        """Atomically claim username for connection, False if it is already taken"""
+        key = self.normalize(username)
+        with self.lock:
+            if key in self._by_name:
+                return False
+            self._by_name[key] = connection
+            self.active_clients[connection] = (username, addr)
+            return True
+
+    def release(self, connection) -> tuple[str, tuple[str, int]] | None:
+        """Remove connection and return its (username, address), if registered"""
+        with self.lock:
+            entry = self.active_clients.pop(connection, None)
+            if entry is not None:
+                self._by_name.pop(self.normalize(entry[0]), None)
+            return entry
+
+    def transfer(self, old_connection, new_connection, addr: tuple[str, int]) -> bool:
+        """Atomically move a user to a new connection, False if old is not registered"""
+        with self.lock:
+            entry = self.active_clients.pop(old_connection, None)
+            if entry is None:
+                return False
+            username = entry[0]
+            self.active_clients[new_connection] = (username, addr)
+            self._by_name[self.normalize(username)] = new_connection
+            return True
+
+    def lookup(self, username: str):
+        """Return the connection logged in under username, or None"""
+        with self.lock:
+            return self._by_name.get(self.normalize(username))
+
+    def names(self) -> list[str]:
+        """Return the usernames of every registered user"""
+        with self.lock:
+            return [name for name, _ in self.active_clients.values()]
@@ -0,0 +1,68 @@
+"""
+Frame Ring Module
+Fixed-size ring of the most recent broadcast frames, used to backfill joining clients
+"""
+
+from array import array
+
+# Broadcast frames kept for backfill by default
+DEFAULT_BACKFILL_SIZE = 100
+
+
+class FrameRing:
+    """Preallocated circular buffer of encoded frames, guarded by the caller's lock"""
+
+    def __init__(self, capacity: int = DEFAULT_BACKFILL_SIZE) -> None:
+        """Initialize an empty ring holding up to capacity frames"""
+        self.capacity = capacity
+        self._slots: list[bytes | None] = [None] * capacity
+        # Sequence number of the frame in each slot
+        self._seqs = array("Q", bytes(8 * capacity))
+        self._next = 0  # Slot the next frame is written to
+        self._count = 0
+        # Highest sequence number overwritten so far, numbering may skip ahead
+        self._evicted_seq = 0
+
+    def __len__(self) -> int:
+        """Number of frames currently held"""
+        return self._count
+
+    def append(self, frame: bytes, seq: int = 0) -> None:
+        """Store frame, overwriting the oldest one once the ring is full"""
+        if not self.capacity:
+            return
+        if self._count == self.capacity:
+            self._evicted_seq = max(self._evicted_seq, self._seqs[self._next])
+        self._slots[self._next] = frame
+        self._seqs[self._next] = seq
+        self._next = (self._next + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def snapshot(self) -> bytes:
+        """All held frames, oldest first, joined into a single buffer for one write"""
+        return self.newest(self._count)
+
+    def newest(self, count: int) -> bytes:
+        """The newest count frames, oldest first, joined into a single buffer"""
+        count = min(count, self._count)
+        start = (self._next - count) % self.capacity if count else self._next
+        if start + count <= self.capacity:
+            return b"".join(self._slots[start : start + count])
+        return b"".join(self._slots[start:]) + b"".join(self._slots[: self._next])
+
+    def since(self, seq: int) -> bytes | None:
+        """Frames numbered after seq in one buffer, None if some were already overwritten"""
+        if not self.capacity:
+            return None
+        if self._evicted_seq > seq:
+            return None
+        # Count back from the newest frame, numbers are increasing but not always contiguous
+        count = 0
+        slot = self._next
+        while count < self._count:
+            slot = (slot - 1) % self.capacity
+            if self._seqs[slot] <= seq:
+                break
+            count += 1
+        return self.newest(count)
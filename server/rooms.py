@@ -0,0 +1,136 @@
+"""
+Room Registry Module
+Named chat rooms indexed by name and by member, so room messages only reach members
+"""
+
+import re
+import threading
+from server.registry import UserRegistry
+from server.ring import FrameRing, DEFAULT_BACKFILL_SIZE
+
+# Room names are short words, compared regardless of case like usernames
+ROOM_NAME = re.compile(r"[\w-]{1,32}")
+
+
+def busiest_first(rooms: list[tuple[str, int]]) -> list[tuple[str, int]]:
+    """Sort (name, member count) pairs by count, then by name"""
+    return sorted(rooms, key=lambda entry: (-entry[1], entry[0].casefold()))
+
+
+class Room:
+    """Members of one room and its most recent messages"""
+
+    def __init__(self, name: str, backfill: int) -> None:
+        """Initialize an empty room"""
+        self.name = name
+        self.members = set()
+        # Recent room messages sent to each member as it joins
+        self.recent = FrameRing(backfill)
+        # Held while changing members or fanning out, so every member sees the
+        # room's messages in one order and a join never misses or repeats one
+        self.lock = threading.Lock()
+
+
+class RoomRegistry:
+    """Thread-safe index of rooms by name and of the rooms each connection is in"""
+
+    def __init__(self, backfill: int = DEFAULT_BACKFILL_SIZE) -> None:
+        """Initialize an empty registry"""
+        self.backfill = backfill
+        self.lock = threading.Lock()
+        # Casefolded room name -> Room
+        self._rooms: dict[str, Room] = {}
+        # Connection -> casefolded names of the rooms it is in
+        self._memberships: dict = {}
+
+    normalize = staticmethod(UserRegistry.normalize)
+
+    def __len__(self) -> int:
+        """Number of rooms with at least one member"""
+        return len(self._rooms)
+
+    @staticmethod
+    def valid_name(name: str) -> bool:
+        """Whether name can be used as a room name"""
+        return ROOM_NAME.fullmatch(name) is not None
+
+    def join(self, name: str, connection, send_backlog) -> Room | None:
+        """Add connection to the room, creating it if needed, None if already a member"""
+        key = self.normalize(name)
+        with self.lock:
+            room = self._rooms.get(key)
+            if room is None:
+                room = self._rooms[key] = Room(name, self.backfill)
+            rooms = self._memberships.setdefault(connection, set())
+            if key in rooms:
+                return None
+            rooms.add(key)
+            # The backlog is handed over under the room lock so it is queued
+            # ahead of any live message sent to the new member
+            with room.lock:
+                room.members.add(connection)
+                backlog = room.recent.snapshot()
+                if backlog:
+                    send_backlog(backlog)
+            return room
+
+    def leave(self, name: str, connection) -> Room | None:
+        """Remove connection from the room, None if it was not a member"""
+        key = self.normalize(name)
+        with self.lock:
+            rooms = self._memberships.get(connection)
+            if not rooms or key not in rooms:
+                return None
+            rooms.discard(key)
+            if not rooms:
+                del self._memberships[connection]
+            return self._remove(key, connection)
+
+    def leave_all(self, connection) -> list[Room]:
+        """Remove connection from every room it is in and return those rooms"""
+        with self.lock:
+            keys = self._memberships.pop(connection, ())
+            return [self._remove(key, connection) for key in keys]
+
+    def _remove(self, key: str, connection) -> Room:
+        """Drop connection from a room and forget the room once empty, hold lock"""
+        room = self._rooms[key]
+        with room.lock:
+            room.members.discard(connection)
+            if not room.members:
+                del self._rooms[key]
+        return room
+
+    def transfer(self, old_connection, new_connection) -> None:
+        """Move every membership of old_connection to new_connection"""
+        with self.lock:
+            keys = self._memberships.pop(old_connection, None)
+            if not keys:
+                return
+            self._memberships[new_connection] = keys
+            for key in keys:
+                room = self._rooms[key]
+                with room.lock:
+                    room.members.discard(old_connection)
+                    room.members.add(new_connection)
+
+    def lookup(self, name: str, connection=None) -> Room | None:
+        """Return the room, only if connection is a member of it when given"""
+        key = self.normalize(name)
+        with self.lock:
+            if connection is not None and key not in self._memberships.get(connection, ()):
+                return None
+            return self._rooms.get(key)
+
+    def rooms_of(self, connection) -> list[str]:
+        """Names of the rooms connection is in"""
+        with self.lock:
+            return sorted(
+                self._rooms[key].name for key in self._memberships.get(connection, ())
+            )
+
+    def listing(self) -> list[tuple[str, int]]:
+        """(name, member count) of every room, busiest first"""
+        with self.lock:
+            rooms = [(room.name, len(room.members)) for room in self._rooms.values()]
+        return busiest_first(rooms)
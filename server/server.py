@@ -3,119 +3,620 @@ Chat Server Implementation
 Handles server setup and client connections
 """
 
+import selectors
 import socket
+import ssl
 import threading
+import time
 from server.client_handler import ClientHandler
-from common.constants import DEFAULT_SERVER_HOST, DEFAULT_PORT
+from server.outbound import (
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_POLICY,
+    DEFAULT_COALESCE_BYTES,
+    DEFAULT_COALESCE_DELAY,
+)
+from server.metrics import MetricsRegistry, MetricsServer, TimedLock
+from server.registry import UserRegistry
+from server.reaper import Reaper
+from server.history import HistoryStore
+from server.ring import FrameRing, DEFAULT_BACKFILL_SIZE
+from server.rooms import Room, RoomRegistry
+from server.session import Session, DEFAULT_RESUME_GRACE
+from server.ratelimit import TokenBucket, DEFAULT_ACCEPT_RATE, DEFAULT_ACCEPT_BURST
+from server.logger import logger
+from common.constants import (
+    DEFAULT_SERVER_HOST,
+    DEFAULT_PORT,
+    LISTEN_BACKLOG,
+    INFO_MESSAGE,
+    WARNING_MESSAGE,
+)
+from common.tls import server_context
+from common.protocol import (
+    encode_text,
+    encode_sequenced,
+    resequence,
+    compress_frames,
+    COMPRESSION_ZLIB,
+    DEFAULT_COMPRESS_THRESHOLD,
+    CAP_COMPRESSION,
+    CAP_RESUME,
+)
 
 
 class ChatServer:
     """Chat server that handles multiple client connections"""
 
-    def __init__(self, host:str=DEFAULT_SERVER_HOST, port:int=DEFAULT_PORT):
-        """Initialize the server with host and port"""
+    def __init__(
+        self,
+        host: str = DEFAULT_SERVER_HOST,
+        port: int = DEFAULT_PORT,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        slow_consumer: str = DEFAULT_POLICY,
+        reuse_port: bool = False,
+        cluster=None,
+        metrics_port: int | None = None,
+        history_dir: str | None = None,
+        backfill: int = DEFAULT_BACKFILL_SIZE,
+        resume_grace: float = DEFAULT_RESUME_GRACE,
+        accept_rate: float = DEFAULT_ACCEPT_RATE,
+        accept_burst: int = DEFAULT_ACCEPT_BURST,
+        coalesce_bytes: int = DEFAULT_COALESCE_BYTES,
+        coalesce_delay: float = DEFAULT_COALESCE_DELAY,
+        compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD,
+        tls: ssl.SSLContext | None = None,
+    ):
+        """Initialize the server with host, port and outbound queue settings"""
         self.host = host
         self.port = port
+        self.queue_size = queue_size
+        self.slow_consumer = slow_consumer
+        # Writer threads send queued frames in batches of up to coalesce_bytes
+        self.coalesce_bytes = coalesce_bytes
+        self.coalesce_delay = coalesce_delay
+        # Frames of at least this many bytes are compressed for clients that
+        # negotiated it, 0 turns compression off
+        self.compress_threshold = compress_threshold
+        # Connections are wrapped in TLS when a server context is given
+        self.tls = tls
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+
+        # Set when running as one worker of a multi-process cluster
+        self.reuse_port = reuse_port
+        self.cluster = cluster
         self.server_socket = None
         self.running = False
+        self.stopped = False
+        self.stop_lock = threading.Lock()
+
+        # Persistent broadcast log, broadcasts carry sequence numbers when enabled
+        self.history = HistoryStore(history_dir) if history_dir else None
+        # Recent broadcast frames sent to every client as it joins
+        self.recent = FrameRing(backfill)
+        # Sequence number of the newest broadcast, continues the history if there is one
+        self.last_seq = self.history.last_seq if self.history else 0
+
+        # Resume token -> Session of every logged-in or suspended user. Sessions
+        # only make sense within one process, so clusters do not hand them out.
+        self.resume_grace = 0 if cluster else resume_grace
+        self.sessions: dict[bytes, Session] = {}
+        # Numbering, fan-out and joins share one lock so every client sees
+        # broadcasts in order, with no gap or overlap between backfill and live
+        self.broadcast_lock = threading.Lock()
+
+        # Caps how fast connections are accepted so a reconnect storm after a
+        # restart queues in the listen backlog instead of swamping the server
+        self.accept_limit = TokenBucket(accept_rate, accept_burst) if accept_rate else None
 
-        # Active clients dictionary and lock for thread-safe access
-        self.active_clients = {}
-        self.clients_lock = threading.Lock()
+        # stop() writes to this socket pair to wake the accept loop
+        self.wakeup_reader = None
+        self.wakeup_writer = None
+
+        self.metrics = MetricsRegistry()
+
+        # Active clients dictionary, username index and lock for thread-safe access.
+        # The lock records how long callers wait for it when another thread holds it.
+        self.lock_wait = self.metrics.histogram(
+            "chat_clients_lock_wait_seconds",
+            "Time spent waiting to acquire clients_lock while another thread held it",
+        )
+        self.lock_uncontended = self.metrics.counter(
+            "chat_clients_lock_uncontended_total", "clients_lock acquisitions that did not wait"
+        )
+        self.clients_lock = TimedLock(self.lock_wait, self.lock_uncontended)
+        self.registry = UserRegistry(self.clients_lock)
+        self.active_clients = self.registry.active_clients
         self.client_threads = {}
+        self.client_handlers = {}
+        # Room members are registry keys too, so they follow suspend and resume
+        self.rooms = RoomRegistry(backfill)
+
+        # Dead connections are retired here instead of on the broadcast path
+        self.reaper = Reaper()
+
+        self.register_metrics()
+
+    def register_metrics(self) -> None:
+        """Create the counters, gauges and histograms updated on the hot path"""
+        metrics = self.metrics
+        self.connections = metrics.counter(
+            "chat_connections_total", "Client connections accepted"
+        )
+        self.tls_handshakes = metrics.counter(
+            "chat_tls_handshakes_total", "TLS handshakes completed"
+        )
+        self.tls_resumed = metrics.counter(
+            "chat_tls_sessions_resumed_total",
+            "TLS handshakes that resumed an earlier session from a ticket",
+        )
+        self.accepts_throttled = metrics.counter(
+            "chat_accepts_throttled_total",
+            "Times the accept loop paused because the accept rate limit was reached",
+        )
+        metrics.gauge(
+            "chat_connections_active",
+            "Open client connections",
+            lambda: len(self.client_handlers),
+        )
+        metrics.gauge("chat_users_active", "Logged-in users", lambda: len(self.registry))
+        metrics.gauge("chat_rooms_active", "Rooms with members", lambda: len(self.rooms))
+        self.messages_received = metrics.counter(
+            "chat_messages_received_total", "Frames received from clients"
+        )
+        self.frames_sent = metrics.counter(
+            "chat_frames_sent_total", "Frames written to client sockets"
+        )
+        self.bytes_received = metrics.counter(
+            "chat_bytes_received_total", "Bytes read from client sockets"
+        )
+        # Bytes produced by encoding vs. bytes written to sockets
+        self.bytes_encoded = metrics.counter(
+            "chat_bytes_encoded_total", "Bytes produced by encoding outgoing frames"
+        )
+        self.bytes_sent = metrics.counter(
+            "chat_bytes_sent_total", "Bytes written to client sockets"
+        )
+        self.bytes_uncompressed = metrics.counter(
+            "chat_compression_input_bytes_total", "Bytes of frames passed to compression"
+        )
+        self.bytes_compressed = metrics.counter(
+            "chat_compression_output_bytes_total", "Bytes produced by compressing frames"
+        )
+        # Frames sent vs. write calls made, the difference is saved by coalescing
+        self.write_calls = metrics.counter(
+            "chat_write_calls_total", "Socket write calls made by writer threads"
+        )
+        self.writes_saved = metrics.counter(
+            "chat_write_calls_saved_total",
+            "Frames that shared a write call with an earlier frame",
+        )
+        self.send_errors = metrics.counter(
+            "chat_send_errors_total", "Socket writes that failed"
+        )
+        self.frames_dropped = metrics.counter(
+            "chat_frames_dropped_total", "Frames dropped by the drop_oldest policy"
+        )
+        self.fanout_time = metrics.histogram(
+            "chat_broadcast_fanout_seconds",
+            "Time to queue one broadcast for every local recipient",
+        )
+        metrics.gauge(
+            "chat_outbound_queue_depth",
+            "Frames waiting in all outbound queues",
+            lambda: sum(self.queue_depths()),
+        )
+        metrics.gauge(
+            "chat_outbound_queue_depth_max",
+            "Frames waiting in the deepest outbound queue",
+            lambda: max(self.queue_depths(), default=0),
+        )
+        metrics.register(
+            "chat_connections_reaped_total",
+            "Connections retired by the reaper",
+            self.reaper.reaped,
+        )
+        metrics.register(
+            "chat_reap_latency_seconds",
+            "Time from a connection being retired to its socket being closed",
+            self.reaper.reap_latency,
+        )
+
+    def queue_depths(self) -> list[int]:
+        """Current outbound queue length of every connection"""
+        return [len(handler.outbound) for handler in list(self.client_handlers.values())]
 
     def start(self) -> None:
         """Start the server and listen for connections"""
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            # Let every worker bind the same port, the kernel balances accepts
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
         try:
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
+            self.server_socket.listen(LISTEN_BACKLOG)
+            self.server_socket.setblocking(False)
+            self.wakeup_reader, self.wakeup_writer = socket.socketpair()
             self.running = True
-            print(f"[INFO] Server started on {self.host}:{self.port}")
+            self.reaper.start()
+            if self.cluster:
+                self.cluster.start(self)
+            if self.metrics_port:
+                self.metrics_server = MetricsServer(self.metrics, self.metrics_port)
+                self.metrics_server.start()
+            logger.info(
+                f"Server started on {self.host}:{self.port}{' (TLS)' if self.tls else ''}"
+            )
 
             self.accept_connections()
 
         except Exception as e:
-            print(f"[ERROR] Server error: {e}")
+            logger.error(f"Server error: {e}")
             self.stop()
 
     def accept_connections(self) -> None:
         """Accept incoming client connections"""
+        selector = selectors.DefaultSelector()
+        selector.register(self.server_socket, selectors.EVENT_READ)
+        selector.register(self.wakeup_reader, selectors.EVENT_READ)
+        accepting = True
         try:
             while self.running:
-                try:
-                    # Set a timeout to allow checking if server is still running
-                    self.server_socket.settimeout(1.0)
-                    client_socket, addr = self.server_socket.accept()
-                    self.server_socket.settimeout(None)  # Reset timeout
-
-                    # Create a client handler for this connection
-                    handler = ClientHandler(
-                        client_socket,
-                        addr,
-                        self.active_clients,
-                        self.clients_lock,
-                        self.broadcast_message,
-                    )
-
-                    # Start the handler in a new thread
-                    thread = threading.Thread(target=handler.handle)
-                    thread.daemon = True
-                    self.client_threads[client_socket] = thread
-                    thread.start()
-                except socket.timeout:
-                    # This is expected due to the timeout we set
-                    continue
-                except Exception as e:
-                    if self.running:
-                        print(f"[ERROR] Error accepting connection: {e}")
+                timeout = None
+                if not accepting:
+                    timeout = self.accept_limit.delay()
+                    if timeout <= 0:
+                        selector.register(self.server_socket, selectors.EVENT_READ)
+                        accepting = True
+                        timeout = None
+
+                # Sleep until a client connects, the rate limit lifts or stop() wakes us up
+                events = selector.select(timeout)
+                if not self.running:
+                    break
+
+                for key, _ in events:
+                    if key.fileobj is not self.server_socket:
+                        continue
+                    if self.accept_limit is None or self.accept_limit.take():
+                        self.accept_client()
+                    else:
+                        # Over the rate, leave pending connections in the backlog
+                        selector.unregister(self.server_socket)
+                        accepting = False
+                        self.accepts_throttled.inc()
 
         except KeyboardInterrupt:
-            print("[INFO] Server shutting down...")
+            logger.info("Server shutting down...")
         except Exception as e:
             if self.running:
-                print(f"[ERROR] Error in accept loop: {e}")
+                logger.error(f"Error in accept loop: {e}")
         finally:
+            selector.close()
             self.stop()
 
+    def accept_client(self) -> None:
+        """Accept one pending connection and start its handler thread"""
+        try:
+            client_socket, addr = self.server_socket.accept()
+        except BlockingIOError:
+            # Another wakeup already took this connection
+            return
+        except Exception as e:
+            if self.running:
+                logger.error(f"Error accepting connection: {e}")
+            return
+
+        self.connections.inc()
+        if self.tls:
+            # The handshake runs on the handler thread, not in the accept loop
+            client_socket = self.tls.wrap_socket(
+                client_socket, server_side=True, do_handshake_on_connect=False
+            )
+
+        # Create a client handler for this connection
+        handler = ClientHandler(client_socket, addr, self)
+
+        # Start the handler in a new thread
+        thread = threading.Thread(target=handler.handle)
+        thread.daemon = True
+        with self.clients_lock:
+            self.client_handlers[client_socket] = handler
+            self.client_threads[client_socket] = thread
+        thread.start()
+
+    def encode(self, message: str) -> bytes:
+        """Encode a text message into a frame and account for the bytes produced"""
+        frame = encode_text(message)
+        self.bytes_encoded.inc(len(frame))
+        return frame
+
+    def capabilities(self) -> int:
+        """Capability flags this server offers in the handshake"""
+        capabilities = 0
+        if self.compress_threshold:
+            capabilities |= CAP_COMPRESSION
+        if self.resume_grace:
+            capabilities |= CAP_RESUME
+        return capabilities
+
+    def accepts_compression(self, offer: bytes) -> bool:
+        """Whether to compress for a client offering these comma-separated methods"""
+        return bool(self.compress_threshold) and COMPRESSION_ZLIB in offer.split(b",")
+
+    def compress(self, frame: bytes) -> bytes:
+        """Compressed form of one or more encoded frames, accounting for the bytes saved"""
+        compressed = compress_frames(frame)
+        self.bytes_uncompressed.inc(len(frame))
+        self.bytes_compressed.inc(len(compressed))
+        return compressed
+
+    def join(self, handler: ClientHandler, replay_after: int | None = None) -> bool:
+        """Register a client, queueing its welcome and backfill ahead of live broadcasts"""
+        username = handler.username
+        # Cluster round trips happen before taking broadcast_lock, the bus
+        # thread needs that lock to deliver the hub's answers
+        if self.cluster and not self.cluster.reserve(username):
+            return False
+        names = self.cluster.names() if self.cluster else None
+
+        # Holding broadcast_lock makes the backfill end exactly where live
+        # delivery to this client starts, with no gap and no overlap. Nothing
+        # queued under it may wait for room, or one slow client stalls everyone.
+        with self.broadcast_lock:
+            if not self.registry.reserve(username, handler.client_socket, handler.addr):
+                if self.cluster:
+                    self.cluster.release(username)
+                return False
+            handler.send_welcome_message(names or self.registry.names(), wait=False)
+            if self.resume_grace and handler.capabilities & CAP_RESUME:
+                handler.session = Session(username)
+                handler.session.connection = handler.client_socket
+                with self.clients_lock:
+                    self.sessions[handler.session.token] = handler.session
+                handler.send_session_token(wait=False)
+            if replay_after is not None and self.history:
+                handler.send_history(replay_after, wait=False)
+            elif replay_after is not None:
+                self.send_missed(handler, replay_after)
+            else:
+                handler.send_backfill(wait=False)
+        return True
+
+    def resume(self, handler: ClientHandler, token: bytes, last_seq: int) -> bool:
+        """Reattach a suspended session to a new connection and send what it missed"""
+        with self.broadcast_lock:
+            with self.clients_lock:
+                session = self.sessions.pop(token, None)
+                if session is None:
+                    return False
+                self.sessions[session.rotate_token()] = session
+            # The client may notice a dead connection before the server does,
+            # in which case the old connection is taken over and shut down
+            previous = session.connection
+            if not self.registry.transfer(previous, handler.client_socket, handler.addr):
+                # The grace window ran out
+                with self.clients_lock:
+                    self.sessions.pop(session.token, None)
+                return False
+            self.rooms.transfer(previous, handler.client_socket)
+            session.connection = handler.client_socket
+            stale = self.client_handlers.get(previous)
+            if stale:
+                stale.close_connection()
+
+            handler.username = session.username
+            handler.session = session
+            handler.send_session_token(wait=False)
+            handler.send(f"{INFO_MESSAGE}: Session resumed.", wait=False)
+            if self.history:
+                handler.send_history(last_seq, wait=False)
+            else:
+                self.send_missed(handler, last_seq)
+            while session.pending:
+                handler.send(session.pending.popleft(), wait=False)
+        return True
+
+    def send_missed(self, handler: ClientHandler, last_seq: int) -> None:
+        """Queue the backfill a client needs after the last broadcast it saw, hold broadcast_lock"""
+        if last_seq > self.last_seq:
+            # Numbered by another worker or an earlier run of the server. Carry on
+            # from there so the client does not take new broadcasts for ones it saw.
+            self.last_seq = last_seq
+            return
+        missed = self.recent.since(last_seq)
+        if missed is None:
+            handler.send(
+                f"{WARNING_MESSAGE}: Some messages were missed while disconnected.", wait=False
+            )
+            missed = self.recent.snapshot()
+        if missed:
+            handler.send_frame(missed, wait=False)
+
+    def suspend(self, handler: ClientHandler) -> bool:
+        """Keep a dropped client's username for the grace window, False if not resumable"""
+        session = handler.session
+        if not (session and self.resume_grace and self.running):
+            return False
+        if not self.registry.transfer(handler.client_socket, session, handler.addr):
+            # Already taken over by a resumed connection
+            return False
+        self.rooms.transfer(handler.client_socket, session)
+        session.connection = session
+        session.suspensions += 1
+        suspension = session.suspensions
+        self.reaper.schedule(self.resume_grace, lambda: self.expire(session, suspension))
+        logger.info(
+            f"@{session.username} dropped, resumable for {self.resume_grace:g} seconds"
+        )
+        return True
+
+    def expire(self, session: Session, suspension: int) -> None:
+        """End a suspended session that was not resumed in time"""
+        if session.suspensions != suspension:
+            # Resumed and dropped again since, a later timer owns the session
+            return
+        entry = self.release_username(session)
+        if entry is None:
+            # Resumed in the meantime
+            return
+        with self.clients_lock:
+            self.sessions.pop(session.token, None)
+        self.broadcast_message(f"{INFO_MESSAGE}: @{session.username} has left the chat.")
+        logger.info(f"@{session.username} did not resume and left.")
+
+    def release_username(
+        self, client_socket: socket.socket
+    ) -> tuple[str, tuple[str, int]] | None:
+        """Unregister a client and return its (username, address), if registered"""
+        entry = self.registry.release(client_socket)
+        if entry:
+            for room in self.rooms.leave_all(client_socket):
+                self.count_room_member(room.name, -1)
+            if self.cluster:
+                self.cluster.release(entry[0])
+        return entry
+
     def broadcast_message(self, message:str, exclude=None):
-        """Send message to all clients except the sender"""
-        print(f"[INFO] Current clients: {self.active_clients}")
+        """Queue message for all clients except the sender"""
+        if __debug__ and logger.debug_enabled:
+            logger.debug(f"Broadcast to {len(self.active_clients)} local clients")
+        # Encode once and share the same immutable frame with every recipient,
+        # including those connected to other workers
+        with self.broadcast_lock:
+            if self.history:
+                self.last_seq, frame = self.history.append(message)
+            else:
+                self.last_seq += 1
+                frame = encode_sequenced(self.last_seq, message)
+            self.bytes_encoded.inc(len(frame))
+            self.fan_out(frame, exclude)
+        if self.cluster:
+            self.cluster.publish(frame)
+
+    def deliver(self, frame: bytes) -> None:
+        """Queue a broadcast frame relayed from another worker for every local client"""
+        with self.broadcast_lock:
+            # Every worker numbers broadcasts in the order its own clients see them
+            self.last_seq += 1
+            self.fan_out(resequence(frame, self.last_seq))
+
+    def fan_out(self, frame: bytes, exclude=None) -> None:
+        """Queue an encoded frame for every local client except exclude, hold broadcast_lock"""
+        start = time.perf_counter()
+        self.recent.append(frame, self.last_seq)
         with self.clients_lock:
-            dead_clients = []
-            for client_socket, (username, _) in self.active_clients.items():
-                try:
-                    if client_socket != exclude:
-                        client_socket.send(message.encode("utf-8"))
-                except:
-                    # Mark this client for removal
-                    dead_clients.append(client_socket)
-
-            # Remove any dead clients
-            for client in dead_clients:
-                if client in self.active_clients:
-                    username = self.active_clients[client][0]
-                    addr = self.active_clients[client][1]
-                    self.client_threads[client].join()
-                    # Remove from active clients
-                    del self.active_clients[client]
-                    print(
-                        f"[INFO] Removed dead client: {username} ({addr[0]}:{addr[1]})"
-                    )
+            # Suspended sessions stay registered but have no handler
+            recipients = [
+                self.client_handlers[client_socket]
+                for client_socket in self.active_clients
+                if client_socket != exclude and client_socket in self.client_handlers
+            ]
+
+        # Only enqueue, each client's writer thread does the actual send and
+        # slow consumers are handled by their own queue's policy, without
+        # waiting for room since broadcast_lock is held. The frame is
+        # compressed at most once, for the recipients that negotiated it.
+        compressed = None
+        large = self.compress_threshold and len(frame) >= self.compress_threshold
+        for handler in recipients:
+            if large and compressed is None and handler.compression:
+                compressed = self.compress(frame)
+            handler.send_frame(frame, compressed, wait=False)
+        self.fanout_time.observe(time.perf_counter() - start)
+
+    def room_message(self, name: str, message: str) -> None:
+        """Queue message for every member of a room, including those on other workers"""
+        room = self.rooms.lookup(name)
+        if room is not None:
+            self.fan_out_room(room, message)
+        if self.cluster:
+            self.cluster.publish_room(name, message)
+
+    def count_room_member(self, name: str, delta: int) -> None:
+        """Tell the cluster a local client joined (1) or left (-1) a room"""
+        if self.cluster:
+            self.cluster.count_members(name, delta)
+
+    def room_listing(self) -> list[tuple[str, int]]:
+        """(name, member count) of every room, counting members on every worker"""
+        listing = self.cluster.rooms() if self.cluster else None
+        # Only local members are counted if the hub does not answer
+        return self.rooms.listing() if listing is None else listing
+
+    def deliver_room(self, name: str, message: str) -> None:
+        """Queue a room message relayed from another worker for local members"""
+        room = self.rooms.lookup(name)
+        if room is not None:
+            self.fan_out_room(room, message)
+
+    def fan_out_room(self, room: Room, message: str) -> None:
+        """Queue message for the members of room only, encoded once for all of them"""
+        frame = self.encode(message)
+        start = time.perf_counter()
+        recipients = []
+        # Only snapshot the members under room.lock, so a member whose queue
+        # makes it wait cannot hold up joins and other senders to the room
+        with room.lock:
+            if __debug__ and logger.debug_enabled:
+                logger.debug(f"Room message to {len(room.members)} members of #{room.name}")
+            room.recent.append(frame)
+            for member in room.members:
+                handler = self.client_handlers.get(member)
+                if handler is not None:
+                    recipients.append(handler)
+                elif isinstance(member, Session):
+                    # Suspended, delivered if the session is resumed
+                    member.pending.append(message)
+        compressed = None
+        large = self.compress_threshold and len(frame) >= self.compress_threshold
+        for handler in recipients:
+            if large and compressed is None and handler.compression:
+                compressed = self.compress(frame)
+            handler.send_frame(frame, compressed)
+        self.fanout_time.observe(time.perf_counter() - start)
+
+    def deliver_direct(self, username: str, message: str) -> bool:
+        """Queue a direct message for a local user, False if they are not here"""
+        handler = self.client_handlers.get(self.registry.lookup(username))
+        if handler is None:
+            return False
+        handler.send(message)
+        return True
 
     def stop(self) -> None:
         """Stop the server and close all connections"""
+        # Both the caller and the accept loop end up here, only stop once
+        with self.stop_lock:
+            if self.stopped:
+                return
+            self.stopped = True
         self.running = False
 
-        # Close all client connections
+        # Wake the accept loop so it notices we are stopping
+        if self.wakeup_writer:
+            try:
+                self.wakeup_writer.send(b"\0")
+            except OSError:
+                pass
+
+        # Shut down all client connections, which also wakes their blocked reads
         with self.clients_lock:
-            for sock in list(self.active_clients.keys()):
-                try:
-                    sock.close()
-                except:
-                    pass
+            handlers = list(self.client_handlers.values())
+        for handler in handlers:
+            handler.close_connection()
+            try:
+                handler.client_socket.close()
+            except:
+                pass
+
+        self.reaper.stop()
+        if self.metrics_server:
+            self.metrics_server.stop()
+        if self.history:
+            self.history.close()
 
         # Close server socket
         if self.server_socket:
@@ -124,12 +625,51 @@ class ChatServer:
             except:
                 pass
 
-        print("[INFO] Server closed.")
+        logger.info(
+            f"Bytes encoded: {self.bytes_encoded.value}, bytes sent: {self.bytes_sent.value}"
+        )
+        latency = self.reaper.reap_latency
+        logger.info(
+            f"Reaped {self.reaper.reaped.value} connections, "
+            f"mean latency {latency.mean() * 1000:.1f}ms, max {latency.max * 1000:.1f}ms"
+        )
+        logger.info("Server closed.")
 
 
-def start_server(host:str=DEFAULT_SERVER_HOST, port:int=DEFAULT_PORT) -> None:
-    """Start the chat server with the specified host and port"""
-    server = ChatServer(host, port)
+def start_server(
+    host: str = DEFAULT_SERVER_HOST,
+    port: int = DEFAULT_PORT,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    slow_consumer: str = DEFAULT_POLICY,
+    metrics_port: int | None = None,
+    history_dir: str | None = None,
+    backfill: int = DEFAULT_BACKFILL_SIZE,
+    resume_grace: float = DEFAULT_RESUME_GRACE,
+    accept_rate: float = DEFAULT_ACCEPT_RATE,
+    accept_burst: int = DEFAULT_ACCEPT_BURST,
+    coalesce_bytes: int = DEFAULT_COALESCE_BYTES,
+    coalesce_delay: float = DEFAULT_COALESCE_DELAY,
+    compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD,
+    tls_cert: str | None = None,
+    tls_key: str | None = None,
+) -> None:
+    """Start the chat server with the specified host, port and queue settings"""
+    server = ChatServer(
+        host,
+        port,
+        queue_size,
+        slow_consumer,
+        metrics_port=metrics_port,
+        history_dir=history_dir,
+        backfill=backfill,
+        resume_grace=resume_grace,
+        accept_rate=accept_rate,
+        accept_burst=accept_burst,
+        coalesce_bytes=coalesce_bytes,
+        coalesce_delay=coalesce_delay,
+        compress_threshold=compress_threshold,
+        tls=server_context(tls_cert, tls_key) if tls_cert else None,
+    )
 
     try:
         server.start()
@@ -0,0 +1,34 @@
+"""
+Session Module
+Identity of a logged-in user that can outlive a dropped connection
+"""
+
+import secrets
+from collections import deque
+from common.protocol import RESUME_TOKEN_SIZE
+
+# Seconds a dropped session can be resumed before the user is announced as gone
+DEFAULT_RESUME_GRACE = 30.0
+
+# Direct and room messages kept for a suspended session, older ones are dropped first
+PENDING_MESSAGES = 100
+
+
+class Session:
+    """A user's resumable session, registered in place of the socket while suspended"""
+
+    def __init__(self, username: str) -> None:
+        """Start a session for username with a fresh resume token"""
+        self.username = username
+        self.token = secrets.token_bytes(RESUME_TOKEN_SIZE)
+        # Registry key of the user: the client socket, or this session while suspended
+        self.connection = None
+        # Bumped on every suspension so a stale expiry timer can tell it is stale
+        self.suspensions = 0
+        # Direct and room messages that arrived while no connection was attached
+        self.pending = deque(maxlen=PENDING_MESSAGES)
+
+    def rotate_token(self) -> bytes:
+        """Replace the token, a token is only ever good for one resume"""
+        self.token = secrets.token_bytes(RESUME_TOKEN_SIZE)
+        return self.token